@@ -0,0 +1,102 @@
+"""CPU per deck and headroom with 2, 4 and 8 decks playing
+
+Run from the repository root:
+
+    python benchmarks/bench_decks.py [--seconds 5]
+
+Every deck plays its own synthetic track at a different tempo; the first
+deck is the master and the others are synced to it, so every block goes
+through the resampler. Blocks are pulled at the sound card's pace by a
+realtime NullSink. Process CPU time covers the audio thread and every
+deck's feeder thread; headroom is the share of one core left over.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dj_engine.playback import Mixer, NullSink  # noqa: E402
+from dj_engine.profiler import LatencyHistogram  # noqa: E402
+
+DECK_COUNTS = (2, 4, 8)
+SAMPLE_RATE = 44100
+
+
+def write_track(path, bpm, seconds=120):
+    """Stereo 16-bit WAV: a decaying kick on every beat over quiet noise"""
+    rng = np.random.default_rng(int(bpm * 10))
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    phase = (t * bpm / 60.0) % 1.0
+    mono = 0.5 * np.exp(-phase * 10) * np.sin(2 * np.pi * 60 * t) + 0.05 * rng.standard_normal(len(t))
+    stereo = (np.repeat(mono[:, None], 2, axis=1) * 32767).astype("<i2")
+    with wave.open(path, "wb") as out:
+        out.setnchannels(2)
+        out.setsampwidth(2)
+        out.setframerate(SAMPLE_RATE)
+        out.writeframes(stereo.tobytes())
+
+
+def measure(paths, bpms, seconds):
+    mixer = Mixer(SAMPLE_RATE)
+    for index, (path, bpm) in enumerate(zip(paths, bpms)):
+        deck = mixer.add_deck()
+        deck.load(path)
+        deck.wait_buffered(2.0)
+        deck.set_beatgrid(bpm, 0.0)
+        deck.set_sync(index > 0)
+        deck.play()
+    sink = NullSink(mixer, realtime=True)
+    sink.start()
+    time.sleep(0.5)  # Let sync lock and the feeders settle
+    mixer.latency = LatencyHistogram()
+    underruns = mixer.underruns
+    xruns = sink.xruns
+    cpu, wall = time.process_time(), time.perf_counter()
+    time.sleep(seconds)
+    cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+    sink.stop()
+    latency = mixer.latency.summary()
+    result = {
+        "decks": len(paths),
+        "cpu_percent": round(100 * cpu / wall, 2),
+        "cpu_percent_per_deck": round(100 * cpu / wall / len(paths), 2),
+        "headroom_percent": round(100 * (1 - cpu / wall), 2),
+        "render_p99_ms": round(latency["p99_ms"], 3),
+        "block_budget_ms": round(1000 * mixer.block_size / SAMPLE_RATE, 3),
+        "underruns": mixer.underruns - underruns,
+        "xruns": sink.xruns - xruns,
+    }
+    mixer.close()
+    return result
+
+
+def run(deck_counts=DECK_COUNTS, seconds=5.0):
+    with tempfile.TemporaryDirectory() as folder:
+        bpms = [120.0 + 3.5 * i for i in range(max(deck_counts))]
+        paths = []
+        for index, bpm in enumerate(bpms):
+            paths.append(os.path.join(folder, f"deck{index + 1}.wav"))
+            write_track(paths[-1], bpm)
+        return [measure(paths[:count], bpms[:count], seconds) for count in deck_counts]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+    print(f"{'decks':>5}  {'CPU %':>7}  {'per deck %':>10}  {'headroom %':>10}  "
+          f"{'p99 ms':>7}  {'budget ms':>9}  {'underruns':>9}  {'xruns':>5}")
+    for row in run(seconds=args.seconds):
+        print(f"{row['decks']:>5}  {row['cpu_percent']:>7.2f}  {row['cpu_percent_per_deck']:>10.2f}  "
+              f"{row['headroom_percent']:>10.2f}  {row['render_p99_ms']:>7.3f}  "
+              f"{row['block_budget_ms']:>9.3f}  {row['underruns']:>9}  {row['xruns']:>5}")
+
+
+if __name__ == "__main__":
+    main()
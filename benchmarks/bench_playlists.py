@@ -0,0 +1,105 @@
+"""Playlist import/export throughput on a synthetic 100k-track collection
+
+Run from the repository root:
+
+    python benchmarks/bench_playlists.py [--tracks 100000]
+
+Writes the collection in every supported format, then reads each back
+and resolves its paths against a LibraryIndex holding the same tracks.
+The Rekordbox XML is also resolved as if exported on another machine
+(a different music root), which goes through the file name fallback.
+Peak memory of the XML read is measured with tracemalloc at a tenth of
+the size and at full size: streaming keeps the two close.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dj_engine.library import LibraryIndex  # noqa: E402
+from dj_engine.playlists import PathResolver, read_playlist, write_playlist  # noqa: E402
+
+FORMATS = (".m3u8", ".pls", ".crate", ".xml")
+ROOT = "/Volumes/Music"
+
+
+def collection(count, root=ROOT):
+    """Deterministic entries spread over artist/album folders"""
+    return [{"path": f"{root}/Artist {i % 997}/Album {i % 53}/{i:06d} Track {i}.mp3",
+             "title": f"Track {i}", "artist": f"Artist {i % 997}", "album": f"Album {i % 53}",
+             "duration": 180 + i % 240, "bpm": 90 + (i * 7) % 80, "key": f"{i % 12 + 1}A"}
+            for i in range(count)]
+
+
+def peak_read(path):
+    tracemalloc.start()
+    count = sum(1 for _ in read_playlist(path))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return count, peak
+
+
+def run(count=100000):
+    entries = collection(count)
+    library = LibraryIndex()
+    for entry in entries:
+        library.add(entry["path"], song=entry["title"], artist=entry["artist"])
+    rows = []
+    with tempfile.TemporaryDirectory() as folder:
+        for ext in FORMATS:
+            path = os.path.join(folder, "collection" + ext)
+            started = time.perf_counter()
+            write_playlist(path, entries)
+            write_time = time.perf_counter() - started
+            started = time.perf_counter()
+            paths = [entry["path"] for entry in read_playlist(path)]
+            read_time = time.perf_counter() - started
+            started = time.perf_counter()
+            resolved = PathResolver(library).resolve(paths)
+            resolve_time = time.perf_counter() - started
+            rows.append({"format": ext, "entries": len(paths),
+                         "megabytes": round(os.path.getsize(path) / 1e6, 1),
+                         "write_s": round(write_time, 3), "read_s": round(read_time, 3),
+                         "resolve_s": round(resolve_time, 3),
+                         "matched": sum(track_id is not None for track_id in resolved)})
+
+        # The same collection exported from a machine with a different music folder
+        path = os.path.join(folder, "moved.xml")
+        write_playlist(path, collection(count, root="/home/dj/Music"))
+        paths = [entry["path"] for entry in read_playlist(path)]
+        started = time.perf_counter()
+        resolved = PathResolver(library).resolve(paths)
+        rows.append({"format": ".xml moved", "entries": len(paths),
+                     "megabytes": round(os.path.getsize(path) / 1e6, 1), "write_s": None,
+                     "read_s": None, "resolve_s": round(time.perf_counter() - started, 3),
+                     "matched": sum(track_id is not None for track_id in resolved)})
+
+        small = os.path.join(folder, "small.xml")
+        write_playlist(small, entries[:count // 10])
+        memory = {"xml_peak_mb_tenth": round(peak_read(small)[1] / 1e6, 2),
+                  "xml_peak_mb_full": round(peak_read(os.path.join(folder, "collection.xml"))[1] / 1e6, 2)}
+    return rows, memory
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tracks", type=int, default=100000)
+    args = parser.parse_args()
+    rows, memory = run(args.tracks)
+    print(f"{'format':>11}  {'entries':>8}  {'MB':>6}  {'write s':>8}  {'read s':>7}  "
+          f"{'resolve s':>9}  {'matched':>8}")
+    for row in rows:
+        cells = [f"{row[k]:.3f}" if row[k] is not None else "-"
+                 for k in ("write_s", "read_s", "resolve_s")]
+        print(f"{row['format']:>11}  {row['entries']:>8}  {row['megabytes']:>6}  {cells[0]:>8}  "
+              f"{cells[1]:>7}  {cells[2]:>9}  {row['matched']:>8}")
+    print(f"XML read peak memory: {memory['xml_peak_mb_tenth']} MB at {args.tracks // 10} tracks, "
+          f"{memory['xml_peak_mb_full']} MB at {args.tracks}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""Frame-time benchmark: canvas items vs. rasterized image tiles for the centre waveform
+
+Run from the repository root:
+
+    python benchmarks/bench_waveform_render.py
+
+Each path is timed two ways. "full" redraws everything every frame, as
+after a zoom change or on the first frame. "scroll" is the steady state
+while playing: canvas items are moved and resized in place, and tiles
+only move, rasterizing the ones that scroll into view. Canvas heights
+cover a two-deck lane taller than 258 px, as in a fullscreen window.
+
+Without a display only the rasterizer (NumPy -> PPM bytes) is timed.
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tkinter as tk  # noqa: E402
+
+from dj_engine.waveform import WaveformPyramid, render_rgb, to_ppm  # noqa: E402
+
+WIDTHS = (600, 1920, 3840)
+HEIGHTS = (300, 700) # Canvas height; each of the two lanes gets half
+SECONDS_VISIBLE = 8.0
+FRAMES = 60
+
+
+def synthetic_pyramid(seconds=360, rate=22050, bpm=128.0):
+    """Kick-like decaying bursts over noise, so columns vary like real music"""
+    rng = np.random.default_rng(1)
+    t = np.arange(int(seconds * rate)) / rate
+    phase = (t * bpm / 60.0) % 1.0
+    samples = 0.6 * np.exp(-phase * 12) * np.sin(2 * np.pi * 55 * t)
+    samples += 0.1 * rng.standard_normal(len(t))
+    return WaveformPyramid.from_samples(samples.astype(np.float32), rate)
+
+
+def canvas_peaks(pyramid, position, width, height):
+    """Per 3px column amplitude in pixels, as the old canvas path drew it"""
+    seconds_per_pixel = SECONDS_VISIBLE / width
+    start = position - width // 2 * seconds_per_pixel
+    columns = pyramid.columns(start, seconds_per_pixel * 3, width // 3)
+    return np.maximum(-columns[0].astype(np.int32), columns[1]) * (height // 2 - 10) // 127
+
+
+def draw_canvas_items(canvas, pyramid, position, width, height):
+    """The old path: delete everything and create one rectangle per 3px column"""
+    canvas.delete("all")
+    center_y = height // 2
+    canvas.create_line(0, center_y, width, center_y, fill='#333', width=2)
+    for direction, color in ((-1, '#ff8800'), (1, '#0066cc')):
+        for i, amp in enumerate(canvas_peaks(pyramid, position, width, height).tolist()):
+            canvas.create_rectangle(i * 3, center_y + direction * amp, i * 3 + 2, center_y,
+                                    fill=color, outline='')
+    canvas.create_line(width // 2, 0, width // 2, height, fill='white', width=3)
+
+
+def move_canvas_items(canvas, items, pyramid, position, width, height):
+    """The cheapest scroll the item path allows: resize the existing rectangles in place"""
+    center_y = height // 2
+    amps = canvas_peaks(pyramid, position, width, height).tolist()
+    for direction, lane in ((-1, items[0]), (1, items[1])):
+        for i, (item, amp) in enumerate(zip(lane, amps)):
+            canvas.coords(item, i * 3, center_y + direction * amp, i * 3 + 2, center_y)
+
+
+def rasterize_frame(pyramid, position, width, height):
+    """Both lanes rendered from scratch, as after a zoom change"""
+    seconds_per_pixel = SECONDS_VISIBLE / width
+    start = position - width // 2 * seconds_per_pixel
+    columns = pyramid.columns(start, seconds_per_pixel, width)
+    lane = height // 2
+    top = to_ppm(render_rgb(columns, lane, ((255, 136, 0),) * 3, ((255, 190, 90),) * 3, True))
+    bottom = to_ppm(render_rgb(columns, lane, ((0, 102, 204),) * 3, ((80, 160, 240),) * 3, False))
+    return top, bottom
+
+
+def summarize(samples):
+    samples = np.asarray(samples) * 1000.0
+    return {"mean_ms": round(float(samples.mean()), 3),
+            "p95_ms": round(float(np.percentile(samples, 95)), 3)}
+
+
+def time_frames(draw, frames=FRAMES):
+    times = []
+    for frame in range(frames):
+        start = time.perf_counter()
+        draw(frame)
+        times.append(time.perf_counter() - start)
+    return summarize(times)
+
+
+def run(widths=WIDTHS, heights=HEIGHTS, frames=FRAMES):
+    """Return {(width, height): {path: {"mean_ms", "p95_ms"}}}"""
+    pyramid = synthetic_pyramid()
+    try:
+        root = tk.Tk()
+    except tk.TclError:
+        root = None
+    results = {}
+    for height in heights:
+        for width in widths:
+            row = results[(width, height)] = {}
+            row["raster_full"] = time_frames(
+                lambda f: rasterize_frame(pyramid, 60 + f / 60, width, height), frames)
+            if root is not None:
+                row.update(time_display(root, pyramid, width, height, frames))
+    if root is not None:
+        root.destroy()
+    return results
+
+
+def time_display(root, pyramid, width, height, frames):
+    from music_analyzer_dj import SeratoWaveform, WaveformTiles
+    row = {}
+    canvas = tk.Canvas(root, width=width, height=height, bg='#000', highlightthickness=0)
+    canvas.pack()
+
+    def canvas_full(f):
+        draw_canvas_items(canvas, pyramid, 60 + f / 60, width, height)
+        root.update()
+    row["canvas_full"] = time_frames(canvas_full, frames)
+    rectangles = [item for item in canvas.find_all() if canvas.type(item) == "rectangle"]
+    items = (rectangles[:len(rectangles) // 2], rectangles[len(rectangles) // 2:])
+
+    def canvas_scroll(f):
+        move_canvas_items(canvas, items, pyramid, 60 + (f + frames) / 60, width, height)
+        root.update()
+    row["canvas_scroll"] = time_frames(canvas_scroll, frames)
+    canvas.delete("all")
+
+    lanes = [WaveformTiles(canvas, SeratoWaveform.TOP_PALETTE, SeratoWaveform.TOP_RMS_PALETTE, True),
+             WaveformTiles(canvas, SeratoWaveform.BOTTOM_PALETTE, SeratoWaveform.BOTTOM_RMS_PALETTE,
+                           False)]
+
+    def tiles(f, full):
+        for lane, top in zip(lanes, (0, height // 2)):
+            if full:
+                lane.key = None # Forget the rasterized tiles, as a zoom change does
+            lane.update(pyramid, 60 + f / 60, SECONDS_VISIBLE / width, width // 2,
+                        top, height // 2, width)
+        root.update()
+    row["tiles_full"] = time_frames(lambda f: tiles(f, True), frames)
+    row["tiles_scroll"] = time_frames(lambda f: tiles(f + frames, False), frames)
+    canvas.destroy()
+    return row
+
+
+def main():
+    results = run()
+    paths = sorted({path for row in results.values() for path in row})
+    print(f"{'size':>10}  " + "  ".join(f"{path:>24}" for path in paths))
+    for (width, height), row in results.items():
+        cells = [f"{row[p]['mean_ms']:>9.2f} ms (p95 {row[p]['p95_ms']:>6.2f})" if p in row
+                 else f"{'n/a':>24}" for p in paths]
+        print(f"{width:>5}x{height:<4}  " + "  ".join(cells))
+    if not any("canvas_full" in row for row in results.values()):
+        print("No display available: canvas and tile paths skipped")
+
+
+if __name__ == "__main__":
+    main()
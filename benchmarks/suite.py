@@ -0,0 +1,355 @@
+"""Benchmark suite over synthetic audio and libraries, with a results history
+
+Run from the repository root:
+
+    python benchmarks/suite.py [--quick] [--only search,sort] [--check]
+
+Measures analysis throughput (and BPM/key accuracy against the known
+synthetic values), cache-hit re-scan time, library search latency, sort
+time, waveform rendering and the mixer's audio callback cost, on 10k and
+100k-track libraries where size matters. Nothing touches a display or a
+sound device, so it runs on a headless Linux box or in CI.
+
+Each run is appended as one JSON line to benchmarks/history.jsonl (or
+--history): commit, machine and a flat {metric: value} dict. Metrics
+ending in _ms or _s are times, lower is better; _per_s are rates, higher
+is better. Every run is compared with the median of the last five runs on
+the same machine and mode, and metrics more than --threshold worse are
+reported as regressions; with --check that makes the exit status 1.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import synthetic  # noqa: E402
+from dj_engine.analysis import AnalysisEngine  # noqa: E402
+from dj_engine.playback import Mixer, NullSink  # noqa: E402
+from dj_engine.profiler import LatencyHistogram  # noqa: E402
+from dj_engine.scanner import FolderScanner  # noqa: E402
+from dj_engine.store import AnalysisStore, fingerprint  # noqa: E402
+from dj_engine.waveform import WaveformPyramid, render_rgb, to_ppm  # noqa: E402
+
+HISTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "history.jsonl")
+BASELINE_RUNS = 5
+# Differences below these are timer noise, never regressions
+NOISE_FLOOR = {"_ms": 0.5, "_s": 0.005}
+REPEATS = 20
+QUERIES = ("d", "de", "dee", "deep", "night house", "ele", "artist:soul", "album:12",
+           "bpm:124-128", "key:8A", "deep bpm:120-130 key:8A,9A", "length:3:00-5:00",
+           "xyzzy")
+SORT_COLUMNS = ("song", "artist", "bpm", "length", "key")
+
+
+def percentiles(times):
+    times = np.asarray(times) * 1e3
+    return round(float(np.percentile(times, 50)), 4), round(float(np.percentile(times, 99)), 4)
+
+
+def bench_analysis(folder, quick):
+    """Files and audio seconds analyzed per second, and accuracy of the results"""
+    tracks = synthetic.audio_set(os.path.join(folder, "audio"), 6 if quick else 12,
+                                 seconds=30 if quick else None)
+    by_path = {track["path"]: track for track in tracks}
+    engine = AnalysisEngine()
+    started = time.perf_counter()
+    engine.start(list(by_path))
+    results, errors = [], 0
+    while True:
+        event = engine.events.get()
+        if event[0] == "done":
+            break
+        if event[0] == "result":
+            results.append(event[2])
+        else:
+            errors += 1
+    elapsed = time.perf_counter() - started
+    bpm_hits = sum(abs(result["bpm"] - by_path[result["path"]]["bpm"]) < 0.5 for result in results)
+    key_hits = sum(result["key"] == by_path[result["path"]]["camelot"] for result in results)
+    return {
+        "analysis.files_per_s": round(len(results) / elapsed, 3),
+        "analysis.audio_seconds_per_s": round(sum(track["seconds"] for track in tracks) / elapsed, 1),
+        "analysis.bpm_accuracy": round(bpm_hits / len(tracks), 3),
+        "analysis.key_accuracy": round(key_hits / len(tracks), 3),
+        "analysis.errors": errors,
+        "analysis.formats": sorted({track["format"] for track in tracks}),
+    }
+
+
+def bench_rescan(folder, quick):
+    """Re-scanning a folder whose every file the analysis store already has"""
+    count = 2000 if quick else 10000
+    music = os.path.join(folder, "rescan")
+    paths = synthetic.tiny_files(music, count)
+    store = AnalysisStore(os.path.join(folder, "rescan.db"))
+    try:
+        store.put_many([dict(zip(("size", "mtime_ns", "content_hash"), fingerprint(path)),
+                             path=path, bpm=120.0) for path in paths])
+        started = time.perf_counter()
+        scanner = FolderScanner()
+        scanner.start(music)
+        found = []
+        while True:
+            event = scanner.events.get()
+            if event[0] == "done":
+                break
+            if event[0] == "batch":
+                found.extend(record["path"] for record in event[1])
+        scanned = time.perf_counter()
+        fresh, stale = store.plan(found)
+        finished = time.perf_counter()
+    finally:
+        store.close()
+    size = f"{count // 1000}k"
+    return {
+        f"rescan.{size}.scan_s": round(scanned - started, 3),
+        f"rescan.{size}.plan_s": round(finished - scanned, 3),
+        f"rescan.{size}.files_per_s": round(len(found) / (finished - started), 1),
+        f"rescan.{size}.cache_hit_rate": round(len(fresh) / max(len(found), 1), 4),
+    }
+
+
+def libraries(quick):
+    for count in (10000,) if quick else (10000, 100000):
+        started = time.perf_counter()
+        library = synthetic.library(count)
+        yield f"{count // 1000}k", library, time.perf_counter() - started
+
+
+def bench_search(library, size, repeats):
+    """Latency of typical queries, including the short prefixes typed first"""
+    results = {}
+    pooled, worst = [], (0.0, "")
+    for query in QUERIES:
+        times = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            library.search(query)
+            times.append(time.perf_counter() - started)
+        pooled.extend(times)
+        p99 = percentiles(times)[1]
+        if p99 > worst[0]:
+            worst = (p99, query)
+    results[f"search.{size}.p50_ms"], results[f"search.{size}.p99_ms"] = percentiles(pooled)
+    results[f"search.{size}.slowest_query"] = worst[1]
+    return results
+
+
+def bench_sort(library, size, repeats):
+    """Sorting after the column changed (a full argsort) and re-sorting from the cache"""
+    results = {}
+    some_path = library.paths[len(library.paths) // 2]
+    for column in SORT_COLUMNS:
+        cold, warm = [], []
+        for repeat in range(repeats):
+            # An edit to the column invalidates its cached order, as an analysis result would
+            if column in library.text:
+                library.update(some_path, **{column: f"Edited {repeat}"})
+            elif column == "key":
+                library.update(some_path, key=synthetic.KEYS[repeat % len(synthetic.KEYS)])
+            else:
+                library.update(some_path, **{column: 100 + repeat})
+            started = time.perf_counter()
+            library.sort_order(column)
+            cold.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            library.sort_order(column, descending=True)
+            warm.append(time.perf_counter() - started)
+        results[f"sort.{size}.{column}.cold_ms"] = percentiles(cold)[0]
+        results[f"sort.{size}.{column}.cached_ms"] = percentiles(warm)[0]
+    return results
+
+
+def bench_waveform(quick):
+    """Building a track's pyramid, and rasterizing a full frame and one tile"""
+    rate, seconds = 22050, 120 if quick else 360
+    samples = synthetic.render_track(128.0, "Am", seconds, rate)
+    builds = []
+    for _ in range(3):
+        started = time.perf_counter()
+        pyramid = WaveformPyramid.from_samples(samples, rate)
+        builds.append(time.perf_counter() - started)
+    palette, rms_palette = ((255, 136, 0),) * 3, ((255, 190, 90),) * 3
+    results = {"waveform.pyramid_build_s": round(min(builds), 4)}
+    for label, width, frames in (("frame_1920", 1920, 30), ("tile_256", 256, 120)):
+        times = []
+        seconds_per_pixel = 8.0 / 1920
+        for frame in range(frames):
+            start = 10.0 + frame * 0.5
+            started = time.perf_counter()
+            columns = pyramid.columns(start, seconds_per_pixel, width)
+            to_ppm(render_rgb(columns, 150, palette, rms_palette, True))
+            times.append(time.perf_counter() - started)
+        results[f"waveform.{label}_p50_ms"], results[f"waveform.{label}_p99_ms"] = percentiles(times)
+    return results
+
+
+def bench_mixer(folder, quick):
+    """Audio callback cost with 2 and 4 synced decks, rendered flat out in bursts"""
+    tracks = synthetic.audio_set(os.path.join(folder, "decks"), 4, seconds=60, formats=["wav16"])
+    results = {}
+    for count in (2, 4):
+        mixer = Mixer()
+        for index, track in enumerate(tracks[:count]):
+            deck = mixer.add_deck()
+            deck.load(track["path"])
+            deck.set_beatgrid(track["bpm"], 0.0)
+            deck.set_sync(index > 0)
+            deck.play()
+        sink = NullSink(mixer, realtime=False)
+        bursts = 3 if quick else 8
+        burst_blocks = int(4.0 * mixer.sample_rate / mixer.block_size) # 4 s of audio
+        elapsed = 0.0
+        for burst in range(bursts):
+            # Let the feeders refill so the callback is measured, not the decoder
+            for deck in mixer.decks:
+                deck.wait_buffered(5.0)
+            if burst == 0:
+                sink.run_blocks(10) # Sync locks and the resampler warms up
+                mixer.latency = LatencyHistogram()
+                underruns = mixer.underruns
+            started = time.perf_counter()
+            sink.run_blocks(burst_blocks)
+            elapsed += time.perf_counter() - started
+        latency = mixer.latency.summary()
+        budget = mixer.block_size / mixer.sample_rate
+        mean = elapsed / (bursts * burst_blocks)
+        results[f"mixer.{count}decks.mean_ms"] = round(mean * 1e3, 4)
+        # A power-of-two bucket bound, and one preemption moves it: shown, not compared
+        results[f"mixer.{count}decks.p99_bucket"] = round(latency["p99_ms"], 4)
+        results[f"mixer.{count}decks.budget_percent"] = round(100 * mean / budget, 2)
+        results[f"mixer.{count}decks.underruns"] = mixer.underruns - underruns
+        mixer.close()
+    return results
+
+
+def run(quick=False, only=None):
+    only = only or {"analysis", "rescan", "search", "sort", "waveform", "mixer"}
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        steps = (("analysis", lambda: bench_analysis(folder, quick)),
+                 ("rescan", lambda: bench_rescan(folder, quick)),
+                 ("waveform", lambda: bench_waveform(quick)),
+                 ("mixer", lambda: bench_mixer(folder, quick)))
+        for name, step in steps:
+            if name in only:
+                print(f"running {name}...", file=sys.stderr)
+                results.update(step())
+        if only & {"search", "sort"}:
+            for size, library, build in libraries(quick):
+                print(f"running search/sort on {size} tracks...", file=sys.stderr)
+                results[f"library.{size}.build_s"] = round(build, 3)
+                if "search" in only:
+                    results.update(bench_search(library, size, REPEATS))
+                if "sort" in only:
+                    results.update(bench_sort(library, size, REPEATS))
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True,
+                              capture_output=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    runs = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                runs.append(json.loads(line))
+            except ValueError:
+                continue # A torn line from an interrupted run
+    return runs
+
+
+def direction(metric):
+    """+1 if higher is better, -1 if lower is better, 0 for informational values"""
+    if metric.endswith("_per_s"):
+        return 1
+    if metric.endswith(("_ms", "_s")):
+        return -1
+    return 0
+
+
+def compare(results, history, threshold):
+    """[(metric, value, baseline, change)] for numeric metrics with a baseline"""
+    rows = []
+    for metric, value in results.items():
+        sense = direction(metric)
+        baseline = [run["results"][metric] for run in history[-BASELINE_RUNS:]
+                    if isinstance(run["results"].get(metric), (int, float))]
+        if not sense or not baseline or not isinstance(value, (int, float)):
+            continue
+        median = statistics.median(baseline)
+        floor = next((noise for suffix, noise in NOISE_FLOOR.items() if metric.endswith(suffix)), 0)
+        if median == 0 or abs(value - median) <= floor:
+            change = 0.0
+        else:
+            change = sense * (value - median) / median
+        rows.append((metric, value, median, change, change < -threshold))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--quick", action="store_true",
+                        help="smaller inputs: 10k library only, fewer and shorter tracks")
+    parser.add_argument("--only", default="",
+                        help="comma separated: analysis, rescan, search, sort, waveform, mixer")
+    parser.add_argument("--history", default=HISTORY, help="JSON lines file runs are appended to")
+    parser.add_argument("--no-save", action="store_true", help="compare but don't append this run")
+    parser.add_argument("--threshold", type=float, default=0.5,
+                        help="fraction worse than the baseline that counts as a regression")
+    parser.add_argument("--check", action="store_true", help="exit with status 1 on a regression")
+    args = parser.parse_args()
+    only = {name.strip() for name in args.only.split(",") if name.strip()}
+
+    record = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": git_commit(),
+        "machine": platform.node(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "cpus": os.cpu_count(),
+        "quick": args.quick,
+        "results": run(args.quick, only),
+    }
+    history = [run for run in load_history(args.history)
+               if run.get("machine") == record["machine"] and run.get("quick") == args.quick]
+    rows = {row[0]: row for row in compare(record["results"], history, args.threshold)}
+
+    for metric, value in record["results"].items():
+        line = f"{metric:<40} {value!s:>14}"
+        if metric in rows:
+            _, _, baseline, change, regressed = rows[metric]
+            line += f"  baseline {baseline!s:>10}  {change:+7.1%}{'  REGRESSION' if regressed else ''}"
+        print(line)
+    regressions = [row[0] for row in rows.values() if row[4]]
+    if history:
+        print(f"\n{len(regressions)} regressions against the median of the last "
+              f"{min(len(history), BASELINE_RUNS)} runs")
+    if not args.no_save:
+        with open(args.history, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+    return 1 if args.check and regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+"""Deterministic synthetic audio and library metadata for the benchmarks
+
+Everything here is generated from fixed seeds, so two runs on any machine
+produce the same files and the same libraries, and timings are comparable
+across commits.
+
+Audio tracks are click tracks over a chord progression: a kick on every
+beat at a known BPM, and I-IV-V-I (major) or i-iv-V-i (minor) chords that
+establish a known key. Formats are the WAV variants the built-in decoder
+reads; FLAC and MP3 are added when ffmpeg is on the PATH.
+"""
+import os
+import shutil
+import struct
+import subprocess
+
+import numpy as np
+
+from dj_engine.harmonic import to_camelot
+from dj_engine.library import LibraryIndex
+
+# name -> (sample rate, channels, sample width in bytes, float samples)
+WAV_FORMATS = {
+    "wav16": (44100, 2, 2, False),
+    "wav24": (48000, 2, 3, False),
+    "float32": (44100, 2, 4, True),
+    "mono22k": (22050, 1, 2, False),
+}
+FFMPEG_FORMATS = {"flac": ("-c:a", "flac"), "mp3": ("-c:a", "libmp3lame", "-b:a", "192k")}
+KEYS = ("C", "Am", "G", "Em", "D", "Bm", "F", "Dm", "Bb", "Gm", "Eb", "F#m")
+BPMS = (90.0, 100.0, 112.0, 120.0, 124.0, 126.0, 128.0, 132.0, 140.0, 150.0, 160.0, 174.0)
+LENGTHS = (30, 60, 90, 120, 180) # seconds
+
+NOTES = {"C": 0, "C#": 1, "D": 2, "Eb": 3, "E": 4, "F": 5, "F#": 6, "G": 7, "Ab": 8,
+         "A": 9, "Bb": 10, "B": 11}
+# Chord roots (semitones above the tonic) and third size, one chord per bar
+MAJOR_CHORDS = ((0, 4), (5, 4), (7, 4), (0, 4))
+MINOR_CHORDS = ((0, 3), (5, 3), (7, 4), (0, 3)) # Major V for the leading tone
+
+
+def render_track(bpm, key, seconds, rate=44100):
+    """Mono float32 samples: a kick on every beat over the key's chords"""
+    rng = np.random.default_rng(int(bpm * 100) + NOTES[key.rstrip("m")] * 7 + seconds)
+    t = np.arange(int(seconds * rate)) / rate
+    beat_phase = (t * bpm / 60.0) % 1.0
+    samples = 0.5 * np.exp(-beat_phase * 12) * np.sin(2 * np.pi * 55 * t)
+    tonic = NOTES[key.rstrip("m")]
+    chords = MINOR_CHORDS if key.endswith("m") else MAJOR_CHORDS
+    bar = (t * bpm / 240.0).astype(np.int64) % len(chords)
+    for index, (root, third) in enumerate(chords):
+        where = bar == index
+        for interval in (0, third, 7, 12):
+            # MIDI 48 is C3; partials at 1x and 2x give the chroma some body
+            freq = 440.0 * 2 ** ((48 + tonic + root + interval - 69) / 12)
+            samples[where] += 0.06 * (np.sin(2 * np.pi * freq * t[where])
+                                      + 0.4 * np.sin(4 * np.pi * freq * t[where]))
+    samples += 0.01 * rng.standard_normal(len(t))
+    return (samples / max(np.abs(samples).max(), 1e-9) * 0.9).astype(np.float32)
+
+
+def write_wav(path, samples, rate, channels=2, width=2, floating=False):
+    """Write mono samples as a PCM (or IEEE float) WAV with the given layout"""
+    frames = np.repeat(samples[:, None], channels, axis=1)
+    if floating:
+        data, tag = frames.astype("<f4").tobytes(), 3
+    elif width == 3:
+        ints = (frames.reshape(-1) * 8388607).astype("<i4")
+        data, tag = ints.view(np.uint8).reshape(-1, 4)[:, :3].tobytes(), 1
+    else:
+        data, tag = (frames * 32767).astype("<i2").tobytes(), 1
+    block_align = channels * width
+    with open(path, "wb") as out:
+        out.write(b"RIFF" + struct.pack("<I", 36 + len(data)) + b"WAVE")
+        out.write(b"fmt " + struct.pack("<IHHIIHH", 16, tag, channels, rate,
+                                        rate * block_align, block_align, width * 8))
+        out.write(b"data" + struct.pack("<I", len(data)) + data)
+
+
+def audio_set(folder, count=12, seconds=None, formats=None):
+    """Write count tracks cycling through BPMS, KEYS, LENGTHS and formats
+
+    Returns [{"path", "bpm", "key", "camelot", "seconds", "format"}]. The
+    same count always gives the same tracks; with seconds set every track
+    has that length.
+    """
+    formats = list(formats or WAV_FORMATS)
+    if formats == list(WAV_FORMATS) and shutil.which("ffmpeg"):
+        formats += list(FFMPEG_FORMATS)
+    os.makedirs(folder, exist_ok=True)
+    tracks = []
+    for index in range(count):
+        bpm, key = BPMS[index % len(BPMS)], KEYS[(index * 5) % len(KEYS)]
+        length = seconds or LENGTHS[index % len(LENGTHS)]
+        fmt = formats[index % len(formats)]
+        name = f"{index:04d} {bpm:g}bpm {key}"
+        if fmt in WAV_FORMATS:
+            rate, channels, width, floating = WAV_FORMATS[fmt]
+            path = os.path.join(folder, name + ".wav")
+            write_wav(path, render_track(bpm, key, length, rate), rate, channels, width, floating)
+        else:
+            source = os.path.join(folder, name + ".tmp.wav")
+            write_wav(source, render_track(bpm, key, length), 44100)
+            path = os.path.join(folder, f"{name}.{fmt}")
+            subprocess.run(["ffmpeg", "-v", "error", "-y", "-i", source,
+                            *FFMPEG_FORMATS[fmt], path], check=True)
+            os.remove(source)
+        tracks.append({"path": path, "bpm": bpm, "key": key, "camelot": to_camelot(key),
+                       "seconds": length, "format": fmt})
+    return tracks
+
+
+def tiny_files(folder, count, per_folder=250):
+    """count very short 8 kHz WAVs in artist folders, for scan and cache benchmarks"""
+    samples = np.zeros(400, dtype=np.float32)
+    paths = []
+    for index in range(count):
+        sub = os.path.join(folder, f"Artist {index // per_folder:03d}")
+        if index % per_folder == 0:
+            os.makedirs(sub, exist_ok=True)
+        paths.append(os.path.join(sub, f"{index:06d}.wav"))
+        write_wav(paths[-1], samples, 8000, channels=1)
+    return paths
+
+
+WORDS = ("love", "night", "deep", "house", "dance", "fire", "dream", "light", "city", "soul",
+         "summer", "bass", "heart", "rhythm", "electric", "midnight", "gold", "wave", "rise",
+         "shadow", "feel", "groove", "sky", "storm", "echo", "neon", "wild", "move", "lost", "time")
+
+
+def metadata(count, seed=0):
+    """count deterministic library records: path, song, artist, album and numbers"""
+    rng = np.random.default_rng(seed)
+    words = np.array(WORDS)
+    song_words = rng.integers(0, len(words), size=(count, 3))
+    artists = rng.integers(0, max(count // 20, 1), size=count)
+    albums = rng.integers(0, max(count // 10, 1), size=count)
+    bpms = np.round(rng.uniform(70, 180, size=count), 1)
+    lengths = rng.integers(90, 600, size=count)
+    bitrates = rng.choice([128, 192, 256, 320], size=count)
+    keys = rng.integers(0, len(KEYS), size=count)
+    records = []
+    for i in range(count):
+        song = " ".join(words[song_words[i]]).title()
+        artist = f"{WORDS[artists[i] % len(WORDS)].title()} Artist {artists[i]}"
+        records.append({
+            "path": f"/music/{artist}/Album {albums[i]}/{i:06d} {song}.mp3",
+            "song": song, "artist": artist, "album": f"Album {albums[i]}",
+            "bpm": float(bpms[i]), "length": int(lengths[i]), "bitrate": int(bitrates[i]),
+            "key": KEYS[keys[i]], "plays": int(i % 7),
+        })
+    return records
+
+
+def library(count, seed=0):
+    """LibraryIndex holding metadata(count, seed), with its search index built"""
+    index = LibraryIndex()
+    for record in metadata(count, seed):
+        fields = dict(record)
+        index.add(fields.pop("path"), **fields)
+    index.freeze()
+    return index
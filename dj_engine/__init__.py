@@ -0,0 +1,4 @@
+"""Audio analysis and library engine for Music Analyzer DJ
+
+Nothing in this package imports tkinter, so it can be used headless.
+"""
@@ -0,0 +1,388 @@
+"""Track analysis (BPM, beatgrid, key, loudness, waveform) and the parallel engine"""
+import os
+import queue
+import threading
+import time
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from .decode import open_decoder
+from .harmonic import KEY_CODES
+from .profiler import PROFILER
+from .store import fingerprint
+from .waveform import PyramidBuilder
+
+ANALYSIS_RATE = 22050
+FRAME_SIZE = 2048
+HOP_SIZE = 512
+MIN_BPM = 70.0
+MAX_BPM = 180.0
+LOUDNESS_BLOCK = 0.4 # seconds
+# Samples decoded per step: whole waveform columns and loudness blocks, ~25 s
+STREAM_CHUNK = 256 * 8820 // 4
+# Log-compressed flux fires as soon as an onset enters the analysis window,
+# well before it reaches the centre (calibrated on click tracks)
+ONSET_LATENCY = 0.75 * FRAME_SIZE / ANALYSIS_RATE
+
+# Krumhansl-Kessler key profiles
+MAJOR_PROFILE = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
+MINOR_PROFILE = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
+
+
+def _key_templates():
+    """(24, 12) profiles for every tonic, z-scored, in KEY_CODES order"""
+    rolled = np.array([np.roll(profile, tonic) for profile in (MAJOR_PROFILE, MINOR_PROFILE)
+                       for tonic in range(12)])
+    rolled -= rolled.mean(axis=1, keepdims=True)
+    return rolled / np.linalg.norm(rolled, axis=1, keepdims=True)
+
+
+KEY_TEMPLATES = _key_templates()
+
+
+def analyze_file(path, profile=False):
+    """Analyze one audio file; runs inside a worker process
+
+    The track is decoded and analyzed STREAM_CHUNK samples at a time, so
+    memory stays flat however long it is. With profile set, the result
+    carries "spans": (name, start, duration, pid) timings for the profiler.
+    """
+    started = time.perf_counter()
+    spans = []
+    # Fingerprint first so a file edited mid-analysis is re-analyzed next time
+    size, mtime_ns, content_hash = fingerprint(path)
+    decoder = open_decoder(path, ANALYSIS_RATE)
+    rate = decoder.sample_rate
+    spectral = SpectralAccumulator(rate)
+    waveform = PyramidBuilder(rate)
+    loudness_block = int(rate * LOUDNESS_BLOCK)
+    powers = []
+    try:
+        blocks = decoder.iter_blocks(STREAM_CHUNK, mono=True)
+        while True:
+            decode_started = time.perf_counter()
+            samples = next(blocks, None)
+            if profile:
+                spans.append(("analysis.decode", decode_started,
+                              time.perf_counter() - decode_started, os.getpid()))
+            if samples is None:
+                break
+            spectral.feed(samples)
+            waveform.feed(samples)
+            powers.append(block_powers(samples, loudness_block))
+        frames = decoder.frames
+    finally:
+        decoder.close()
+    flux, chroma = spectral.finish()
+    bpm, first_beat = estimate_tempo(flux, rate / HOP_SIZE)
+    result = {
+        "path": path,
+        "size": size,
+        "mtime_ns": mtime_ns,
+        "content_hash": content_hash,
+        "duration": frames / rate,
+        "bpm": bpm,
+        "beatgrid": {"bpm": bpm, "first_beat": first_beat},
+        "key": estimate_key(chroma),
+        "loudness": gated_loudness(np.concatenate(powers) if powers else np.zeros(0)),
+        "waveform": waveform.finish().to_bytes(),
+    }
+    if profile:
+        spans.append(("analysis", started, time.perf_counter() - started, os.getpid()))
+        result["spans"] = spans
+    return result
+
+
+def frame_signal(samples, frame_size=FRAME_SIZE, hop=HOP_SIZE):
+    """Strided (frames, frame_size) view of samples, zero padded to one frame"""
+    if len(samples) < frame_size:
+        samples = np.pad(samples, (0, frame_size - len(samples)))
+    view = np.lib.stride_tricks.sliding_window_view(samples, frame_size)
+    return view[::hop]
+
+
+def spectral_features(samples, rate):
+    """Spectral-flux onset envelope and summed chroma in one STFT pass"""
+    accumulator = SpectralAccumulator(rate)
+    accumulator.feed(samples)
+    return accumulator.finish()
+
+
+class SpectralAccumulator:
+    """Streaming STFT: feed consecutive chunks, then finish() -> (flux, chroma)
+
+    The samples after the last complete hop are carried into the next
+    chunk, so the frames are exactly those of one pass over the whole track.
+    """
+    def __init__(self, rate, chunk_frames=1024):
+        self.chunk_frames = chunk_frames
+        self.window = np.hanning(FRAME_SIZE).astype(np.float32)
+        self.chroma_map = _chroma_matrix(np.fft.rfftfreq(FRAME_SIZE, 1.0 / rate))
+        self.chroma = np.zeros(12)
+        self._flux = []
+        self._previous = None
+        self._tail = np.zeros(0, dtype=np.float32)
+
+    def feed(self, samples):
+        samples = np.concatenate([self._tail, np.asarray(samples, dtype=np.float32)])
+        if len(samples) < FRAME_SIZE:
+            self._tail = samples
+            return
+        frames = frame_signal(samples)
+        self._tail = samples[len(frames) * HOP_SIZE:]
+        for start in range(0, len(frames), self.chunk_frames):
+            self._transform(frames[start:start + self.chunk_frames])
+
+    def finish(self):
+        if self._previous is None:
+            # Shorter than one frame: analyze it zero padded
+            self._transform(frame_signal(self._tail))
+        return np.concatenate(self._flux), self.chroma
+
+    def _transform(self, frames):
+        mags = np.abs(np.fft.rfft(frames * self.window, axis=1)).astype(np.float32)
+        self.chroma += self.chroma_map @ (mags ** 2).sum(axis=0)
+        logmag = np.log1p(100.0 * mags)
+        if self._previous is None:
+            self._previous = logmag[:1]
+        diff = np.diff(np.vstack([self._previous, logmag]), axis=0)
+        self._flux.append(np.maximum(diff, 0.0).sum(axis=1))
+        self._previous = logmag[-1:]
+
+
+def _chroma_matrix(freqs, fmin=55.0, fmax=5000.0):
+    """(12, bins) matrix folding FFT bins onto pitch classes"""
+    matrix = np.zeros((12, len(freqs)))
+    valid = (freqs >= fmin) & (freqs <= fmax)
+    midi = 69 + 12 * np.log2(freqs[valid] / 440.0)
+    pitch_class = np.round(midi).astype(int) % 12
+    matrix[pitch_class, np.nonzero(valid)[0]] = 1.0
+    return matrix
+
+
+def estimate_tempo(flux, frame_rate):
+    """Return (bpm, first_beat_seconds) from an onset envelope"""
+    if len(flux) < 4 or not flux.any():
+        return 0.0, 0.0
+    env = flux - flux.mean()
+    # Autocorrelation via FFT gives a coarse period estimate
+    n = 1 << int(np.ceil(np.log2(2 * len(env))))
+    spectrum = np.fft.rfft(env, n)
+    acf = np.fft.irfft(spectrum * np.conj(spectrum), n)[:len(env)]
+    min_lag = int(frame_rate * 60.0 / MAX_BPM)
+    max_lag = min(int(np.ceil(frame_rate * 60.0 / MIN_BPM)), len(acf) - 1)
+    if max_lag <= min_lag:
+        return 0.0, 0.0
+    lags = np.arange(min_lag, max_lag + 1)
+    bpms = 60.0 * frame_rate / lags
+    # Mild preference for the usual dance-music range around 120
+    weight = np.exp(-0.5 * (np.log2(bpms / 120.0) / 0.9) ** 2)
+    lag = lags[np.argmax(acf[lags] * weight)]
+    # An integer lag only brackets the tempo, so comb-score the bracket coarse then fine
+    bpm, _ = _comb_search(flux, frame_rate, 60.0 * frame_rate / (lag + 1),
+                          60.0 * frame_rate / max(lag - 1, 1), 0.25)
+    bpm, phase = _comb_search(flux, frame_rate, bpm - 0.3, bpm + 0.3, 0.01)
+    period = 60.0 / bpm
+    first_beat = (phase / frame_rate + ONSET_LATENCY) % period
+    return round(float(bpm), 2), round(float(first_beat), 4)
+
+
+def _comb_search(flux, frame_rate, low_bpm, high_bpm, step, phases=48):
+    """Score a pulse train against every beat in the track for each candidate BPM
+
+    Returns (bpm, phase_in_frames) of the best scoring candidate.
+    """
+    candidates = np.arange(low_bpm, high_bpm + step / 2, step)
+    grid = np.arange(len(flux))
+    best = (-1.0, candidates[0], 0.0)
+    for bpm in candidates:
+        period = 60.0 * frame_rate / bpm
+        beats = np.arange(0.0, len(flux) - period, period)
+        if len(beats) == 0:
+            continue
+        offsets = np.linspace(0.0, period, phases, endpoint=False)
+        positions = offsets[:, None] + beats[None, :]
+        scores = np.interp(positions, grid, flux).mean(axis=1)
+        idx = int(np.argmax(scores))
+        if scores[idx] > best[0]:
+            best = (scores[idx], bpm, offsets[idx])
+    return best[1], best[2]
+
+
+def estimate_key(chroma):
+    """Camelot code ("8A") of the best matching key for a summed chroma vector"""
+    return estimate_keys(np.asarray(chroma)[None, :])[0]
+
+
+def estimate_keys(chromas):
+    """Camelot codes for a batch of chroma vectors shaped (n, 12)
+
+    Correlation against all 24 key profiles is one matrix product: rows are
+    centred and normalized, so the dot product is Pearson's r.
+    """
+    chromas = np.asarray(chromas, dtype=np.float64)
+    centred = chromas - chromas.mean(axis=1, keepdims=True)
+    norms = np.linalg.norm(centred, axis=1, keepdims=True)
+    scores = (centred / np.where(norms > 0, norms, 1.0)) @ KEY_TEMPLATES.T
+    best = np.argmax(scores, axis=1)
+    return [KEY_CODES[index] if norm > 0 else "" for index, norm in zip(best, norms[:, 0])]
+
+
+def loudness_db(samples, rate, block_seconds=LOUDNESS_BLOCK):
+    """Gated RMS loudness in dBFS (LUFS-style gating, no K-weighting)"""
+    return gated_loudness(block_powers(samples, int(rate * block_seconds)))
+
+
+def block_powers(samples, block):
+    """Mean power of each complete block; a trailing partial block is ignored"""
+    usable = len(samples) - len(samples) % block
+    return np.mean(samples[:usable].reshape(-1, block).astype(np.float64) ** 2, axis=1)
+
+
+def gated_loudness(power):
+    """Loudness in dBFS from per-block powers with absolute and relative gates"""
+    if len(power) == 0:
+        return -70.0
+    levels = 10 * np.log10(np.maximum(power, 1e-12))
+    gated = power[levels > -70.0]
+    if len(gated) == 0:
+        return -70.0
+    relative = 10 * np.log10(gated.mean()) - 10.0
+    gated = gated[10 * np.log10(gated) > relative]
+    return round(float(10 * np.log10(gated.mean())), 2)
+
+
+class AnalysisEngine:
+    """Fans analyze_file out over a process pool, one worker per core
+
+    Results stream into ``events`` as ("result", path, data),
+    ("error", path, message) and finally ("done", cancelled). The GUI
+    drains them from the Tk main loop with drain(). Cancelling keeps the
+    unfinished paths in ``pending`` so resume() carries on from there, and
+    add() queues more paths onto a run in progress.
+    """
+    def __init__(self, jobs=None):
+        self.jobs = jobs or os.cpu_count() or 1
+        self.events = queue.Queue()
+        self.pending = {}  # path -> None, kept in submission order
+        self.total = 0
+        self.completed = 0
+        self.failed = 0 # Of completed, how many gave an error event
+        self._todo = deque()
+        self._lock = threading.Lock()
+        self._accepting = False  # dispatcher still takes paths from add()
+        self._cancel = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, paths):
+        """Analyze paths from scratch (any previous run must be finished)"""
+        if self.running:
+            raise RuntimeError("Analysis already running")
+        self.pending = dict.fromkeys(paths)
+        self.total = len(self.pending)
+        self.completed = self.failed = 0
+        self._launch()
+
+    def add(self, paths):
+        """Queue more paths, starting a run if none is active"""
+        new = [path for path in dict.fromkeys(paths) if path not in self.pending]
+        if not new:
+            return
+        with self._lock:
+            if self._accepting:
+                self.pending.update(dict.fromkeys(new))
+                self.total += len(new)
+                self._todo.extend(new)
+                return
+        # The last dispatcher has stopped taking paths but may still be shutting
+        # its pool down; let it finish so its "done" and counters land first
+        self.wait()
+        if not self.pending:
+            self.total = self.completed = self.failed = 0
+        self.pending.update(dict.fromkeys(new))
+        self.total += len(new)
+        self._launch()
+
+    def resume(self):
+        """Continue a cancelled run; returns False if nothing is left"""
+        if self.running or not self.pending:
+            return False
+        self._launch()
+        return True
+
+    def cancel(self):
+        """Stop submitting work; files already being analyzed still finish"""
+        self._cancel.set()
+
+    def wait(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def drain(self, limit=500):
+        """Non-blocking fetch of up to limit events"""
+        events = []
+        try:
+            while len(events) < limit:
+                events.append(self.events.get_nowait())
+        except queue.Empty:
+            pass
+        return events
+
+    def _launch(self):
+        self._cancel.clear()
+        self._todo = deque(self.pending)
+        self._accepting = True
+        self._thread = threading.Thread(target=self._dispatch, name="analysis-dispatch",
+                                        daemon=True)
+        self._thread.start()
+
+    def _dispatch(self):
+        todo = self._todo
+        in_flight = {}
+        # spawn keeps the workers clear of the Tk connection and our threads
+        context = multiprocessing.get_context("spawn")
+        try:
+            with ProcessPoolExecutor(max_workers=self.jobs, mp_context=context) as pool:
+                while True:
+                    # A bounded window keeps cancel responsive and memory flat on 40k files
+                    while todo and len(in_flight) < self.jobs * 2 and not self._cancel.is_set():
+                        path = todo.popleft()
+                        in_flight[pool.submit(analyze_file, path, PROFILER.enabled)] = path
+                    if not in_flight:
+                        with self._lock:
+                            if not todo or self._cancel.is_set():
+                                self._accepting = False
+                                break
+                        continue
+                    done, _ = wait(in_flight, timeout=0.25, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        path = in_flight.pop(future)
+                        try:
+                            result = future.result()
+                            for name, started, duration, pid in result.pop("spans", ()):
+                                PROFILER.record(name, "analysis", started, duration, tid=pid,
+                                                thread_name=f"analysis worker {pid}")
+                            self.events.put(("result", path, result))
+                        except BrokenProcessPool:
+                            raise
+                        except Exception as exc:
+                            with self._lock:
+                                self.failed += 1
+                            self.events.put(("error", path, str(exc)))
+                        with self._lock:
+                            self.pending.pop(path, None)
+                            self.completed += 1
+        except BrokenProcessPool as exc:
+            self._accepting = False
+            self._cancel.set()
+            self.events.put(("error", None, f"Analysis workers died: {exc}"))
+        finally:
+            self.events.put(("done", self._cancel.is_set()))
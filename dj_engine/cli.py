@@ -0,0 +1,155 @@
+"""Headless batch analysis: python -m dj_engine analyze FOLDER... [--jobs N] [--out DB]
+
+Runs the GUI's AnalysisEngine over every audio file under the given
+folders (or the given files), writes results to the same analysis store
+the GUI reads, and prints one JSON object per line to stdout:
+
+    {"type": "result", "path": ..., "cached": false, "bpm": ..., "key": ..., ...}
+    {"type": "error", "path": ..., "message": ...}
+    {"type": "summary", "analyzed": ..., "cached": ..., "errors": ..., "seconds": ...}
+
+Files the store already has an up-to-date result for are reported as
+cached rather than analyzed again, unless --force is given. Nothing here
+imports tkinter.
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+
+from .analysis import AnalysisEngine
+from .decode import is_audio_file
+from .scanner import list_directory
+from .store import AnalysisStore, default_store_path
+
+REPORTED = ("duration", "bpm", "key", "loudness", "beatgrid")
+FLUSH_EVERY = 200 # Results per store transaction
+
+
+def positive_int(text):
+    """argparse type for counts that must be at least 1"""
+    try:
+        value = int(text)
+    except ValueError:
+        value = 0
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive whole number, not {text!r}")
+    return value
+
+
+def find_audio(paths):
+    """Audio files among paths, walking folders (hidden ones are skipped like the GUI scan)"""
+    found, folders = [], []
+    for path in paths:
+        if os.path.isdir(path):
+            folders.append(os.path.abspath(path))
+        elif not os.path.exists(path):
+            print(f"warning: {path} does not exist", file=sys.stderr)
+        elif is_audio_file(path):
+            found.append(os.path.abspath(path))
+    while folders:
+        try:
+            subfolders, files = list_directory(folders.pop())
+        except OSError as exc:
+            print(f"warning: {exc}", file=sys.stderr)
+            continue
+        folders.extend(subfolders)
+        found.extend(path for path, size, mtime_ns in files)
+    return sorted(set(found))
+
+
+def _plain(value):
+    """JSON-safe value: numpy scalars as Python numbers, NaN/inf as null"""
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, dict):
+        return {key: _plain(item) for key, item in value.items()}
+    return value
+
+
+def _result(result, cached):
+    record = {"type": "result", "path": result["path"], "cached": cached}
+    record.update((name, result.get(name)) for name in REPORTED)
+    return record
+
+
+def emit(record, out=sys.stdout):
+    out.write(json.dumps(_plain(record), ensure_ascii=False) + "\n")
+
+
+def analyze(paths, jobs=None, store_path=None, force=False, out=sys.stdout):
+    """Analyze paths headlessly; returns the summary dict"""
+    started = time.perf_counter()
+    store = AnalysisStore(store_path)
+    try:
+        files = find_audio(paths)
+        fresh, stale = ([], files) if force else store.plan(files)
+        for result in store.get_many(fresh, waveform=False):
+            emit(_result(result, cached=True), out)
+        out.flush()
+        analyzed = errors = 0
+        if stale:
+            engine = AnalysisEngine(jobs)
+            engine.start(stale)
+            batch = []
+            try:
+                while True:
+                    event = engine.events.get()
+                    if event[0] == "done":
+                        break
+                    if event[0] == "result":
+                        batch.append(event[2])
+                        analyzed += 1
+                        emit(_result(event[2], cached=False), out)
+                    else:
+                        errors += 1
+                        emit({"type": "error", "path": event[1], "message": event[2]}, out)
+                    out.flush()
+                    if len(batch) >= FLUSH_EVERY:
+                        store.put_many(batch)
+                        batch = []
+            finally:
+                # Keep whatever finished, even when interrupted
+                store.put_many(batch)
+                if engine.running:
+                    engine.cancel()
+                    engine.wait()
+        seconds = time.perf_counter() - started
+        summary = {"type": "summary", "files": len(files), "analyzed": analyzed,
+                   "cached": len(fresh), "errors": errors, "seconds": round(seconds, 3),
+                   "files_per_second": round(analyzed / seconds, 2) if seconds > 0 else 0.0,
+                   "store": store.path}
+        emit(summary, out)
+        return summary
+    finally:
+        store.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m dj_engine",
+                                     description="Music Analyzer DJ batch tools (no GUI)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    command = commands.add_parser("analyze", help="analyze folders or files, printing JSON lines")
+    command.add_argument("paths", nargs="+", help="folders to walk or audio files")
+    command.add_argument("--jobs", type=positive_int, default=None,
+                         help="worker processes (default: one per core)")
+    command.add_argument("--out", default=None,
+                         help=f"analysis store to fill (default: {default_store_path()})")
+    command.add_argument("--force", action="store_true",
+                         help="re-analyze files the store already has")
+    args = parser.parse_args(argv)
+    try:
+        summary = analyze(args.paths, args.jobs, args.out, args.force)
+    except KeyboardInterrupt:
+        return 130
+    except BrokenPipeError:
+        # The reader went away (e.g. piped into head); don't fail again flushing stdout
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+    # Files neither analyzed nor cached mean the run itself broke (e.g. the workers died)
+    unfinished = summary["files"] - summary["analyzed"] - summary["cached"] - summary["errors"]
+    return 1 if summary["errors"] or unfinished else 0
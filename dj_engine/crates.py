@@ -0,0 +1,174 @@
+"""Smart crates: rule sets over library fields, kept as materialized results
+
+A crate's members are computed once with vectorized masks over the
+LibraryIndex columns and from then on maintained from the library's change
+notifications. Each rule names the fields it reads, so a change only
+re-tests the crates that depend on the fields that changed, and only for
+the one track that changed.
+
+Rules are plain tuples so they store as JSON:
+
+    ("range", field, low, high)   numeric field in [low, high]; None is open
+    ("key", [codes])              Camelot key in the list
+    ("contains", field, text)     text column matches every word, like search
+"""
+import numpy as np
+
+from .harmonic import key_number, to_camelot
+from .library import WORD
+
+# Above this many pending changes, rebuilding a crate with masks beats testing each track
+REBUILD_FRACTION = 0.05
+
+
+def rule_fields(rule):
+    return {"key"} if rule[0] == "key" else {rule[1]}
+
+
+def _word_matches(needle, text):
+    """A search term matching text: a word prefix, or a substring from three letters on"""
+    words = WORD.findall(text.lower())
+    return any(word.startswith(needle) or (len(needle) >= 3 and needle in word)
+               for word in words)
+
+
+class SmartCrate:
+    """A named rule set; a track belongs when it matches every rule"""
+    def __init__(self, name, rules):
+        self.name = name
+        self.rules = [tuple(rule) for rule in rules]
+        self.fields = set().union(*map(rule_fields, self.rules))
+        self.members = set() # Track ids, maintained by SmartCrates
+        self._sorted = None # Cached sorted id array
+
+    def mask(self, library, count):
+        """Members among the first count ids, as one boolean array"""
+        selected = library.alive[:count].copy()
+        for rule in self.rules:
+            if rule[0] == "range":
+                column = library.numeric[rule[1]][:count]
+                if rule[2] is not None:
+                    selected &= column >= rule[2]
+                if rule[3] is not None:
+                    selected &= column <= rule[3]
+                selected &= ~np.isnan(column)
+            elif rule[0] == "key":
+                numbers = [key_number(to_camelot(code)) for code in rule[1]]
+                selected &= np.isin(library.keys[:count], [n for n in numbers if n])
+            elif rule[0] == "contains":
+                for word in WORD.findall(rule[2].lower()):
+                    hits = np.zeros(count, dtype=bool)
+                    library.text_index[rule[1]].match(word, hits)
+                    selected &= hits
+        return selected
+
+    def matches(self, library, track_id):
+        """The same test as mask(), for one track"""
+        if not library.alive[track_id]:
+            return False
+        for rule in self.rules:
+            if rule[0] == "range":
+                value = library.numeric[rule[1]][track_id]
+                if np.isnan(value) or (rule[2] is not None and value < rule[2]) \
+                        or (rule[3] is not None and value > rule[3]):
+                    return False
+            elif rule[0] == "key":
+                numbers = {key_number(to_camelot(code)) for code in rule[1]}
+                if library.keys[track_id] not in numbers - {0}:
+                    return False
+            elif rule[0] == "contains":
+                text = library.text[rule[1]][track_id]
+                if not all(_word_matches(word, text) for word in WORD.findall(rule[2].lower())):
+                    return False
+        return True
+
+    def ids(self):
+        """Members as a sorted id array (cached until membership changes)"""
+        if self._sorted is None:
+            self._sorted = np.array(sorted(self.members), dtype=np.int64)
+        return self._sorted
+
+    def to_json(self):
+        return {"name": self.name, "rules": [list(rule) for rule in self.rules]}
+
+
+class SmartCrates:
+    """All smart crates over one LibraryIndex
+
+    Library changes are only recorded when they happen (track id -> changed
+    fields); refresh() applies them, re-testing each changed track against
+    the crates that read one of its changed fields. When a bulk load leaves
+    more pending changes than REBUILD_FRACTION of the library, affected
+    crates are rebuilt with masks instead.
+    """
+    def __init__(self, library):
+        self.library = library
+        self.crates = {} # name -> SmartCrate
+        self.by_field = {} # field -> crates with a rule on it
+        self.pending = {} # track id -> changed fields, or None once removed
+        library.watchers.append(self.track_changed)
+
+    def __contains__(self, name):
+        return name in self.crates
+
+    def __iter__(self):
+        return iter(self.crates.values())
+
+    def track_changed(self, track_id, fields):
+        if fields is None or self.pending.get(track_id, ()) is None:
+            self.pending[track_id] = None
+        else:
+            self.pending.setdefault(track_id, set()).update(fields)
+
+    def add(self, name, rules):
+        """Create or replace a crate and materialize it"""
+        if not rules:
+            raise ValueError("A smart crate needs at least one rule")
+        self.remove(name)
+        self.refresh() # Bring the other crates up to date first
+        crate = SmartCrate(name, rules)
+        count = len(self.library.paths)
+        crate.members = set(np.flatnonzero(crate.mask(self.library, count)).tolist())
+        self.crates[name] = crate
+        for field in crate.fields:
+            self.by_field.setdefault(field, []).append(crate)
+        return crate
+
+    def remove(self, name):
+        crate = self.crates.pop(name, None)
+        if crate is not None:
+            for field in crate.fields:
+                self.by_field[field].remove(crate)
+
+    def ids(self, name):
+        self.refresh()
+        return self.crates[name].ids()
+
+    def refresh(self):
+        """Apply pending library changes to every affected crate"""
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, {}
+        library = self.library
+        if len(pending) > REBUILD_FRACTION * max(len(library.paths), 1):
+            fields = set().union(*(f for f in pending.values() if f is not None))
+            removed = any(f is None for f in pending.values())
+            count = len(library.paths)
+            for crate in self.crates.values():
+                if removed or crate.fields & fields:
+                    crate.members = set(np.flatnonzero(crate.mask(library, count)).tolist())
+                    crate._sorted = None
+            return
+        for track_id, fields in pending.items():
+            if fields is None:
+                crates = self.crates.values()
+            else:
+                crates = {id(c): c for f in fields for c in self.by_field.get(f, ())}.values()
+            for crate in crates:
+                member = track_id in crate.members
+                if crate.matches(library, track_id) != member:
+                    if member:
+                        crate.members.discard(track_id)
+                    else:
+                        crate.members.add(track_id)
+                    crate._sorted = None
@@ -0,0 +1,47 @@
+"""Beatgrid quantization and hot cue storage
+
+Hot cues are sample offsets (frames at the mixer's sample rate) snapped to
+the analyzed beatgrid, so jumping to one lands exactly on a beat. They are
+stored in the analysis store's cues column as
+{"sample_rate": 44100, "hotcues": {"1": frame, ...}}.
+"""
+HOT_CUES = 4
+LOOP_BEATS = (0.125, 0.25, 0.5, 1, 2, 4, 8, 16)
+
+
+def beat_frames(bpm, sample_rate):
+    return 60.0 * sample_rate / bpm
+
+
+def snap(frame, bpm, first_beat, sample_rate, beats=1.0, rounding=round):
+    """Grid line every `beats` beats nearest to frame; math.floor/ceil pick a side
+
+    Without a beatgrid (bpm 0) the frame is returned unchanged.
+    """
+    if not bpm:
+        return frame
+    step = beat_frames(bpm, sample_rate) * beats
+    origin = first_beat * sample_rate
+    return origin + rounding((frame - origin) / step) * step
+
+
+def hotcue_frame(frame, bpm, first_beat, sample_rate):
+    """Sample offset for a hot cue set at frame: the nearest beat, never before 0"""
+    snapped = snap(frame, bpm, first_beat, sample_rate)
+    if snapped < 0:
+        snapped += beat_frames(bpm, sample_rate)
+    return max(int(round(snapped)), 0)
+
+
+def cues_to_json(hotcues, sample_rate):
+    return {"sample_rate": sample_rate,
+            "hotcues": {str(number): frame for number, frame in sorted(hotcues.items())}}
+
+
+def cues_from_json(data, sample_rate):
+    """Hot cues {number: frame} from stored cues, rescaled to sample_rate"""
+    if not data:
+        return {}
+    scale = sample_rate / data.get("sample_rate", sample_rate)
+    return {int(number): int(round(frame * scale))
+            for number, frame in (data.get("hotcues") or {}).items()}
@@ -0,0 +1,361 @@
+"""Streaming audio decoders for analysis and playback
+
+Decoders hand out PCM in chunks on demand and never hold a whole track in
+memory. WAV files are memory-mapped directly; mp3/flac/m4a are decoded by
+ffmpeg into a sparse, memory-mapped scratch file of float32 frames. Either
+way frame p lives at a fixed byte offset, so seeking is O(1), and pages far
+from the last read are dropped with madvise so resident memory stays within
+``resident_budget`` bytes per decoder regardless of track length.
+"""
+import mmap
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+
+import numpy as np
+
+AUDIO_EXTENSIONS = (".mp3", ".wav", ".flac", ".m4a")
+RESIDENT_BUDGET = 32 * 1024 * 1024
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+class AudioDecodeError(Exception):
+    """Raised when an audio file cannot be decoded"""
+
+
+def is_audio_file(path):
+    return path.lower().endswith(AUDIO_EXTENSIONS)
+
+
+def open_decoder(path, sample_rate=44100):
+    """Stereo float32 decoder for path, resampled to sample_rate"""
+    if path.lower().endswith(".wav"):
+        return WavDecoder(path, sample_rate)
+    return FFmpegDecoder(path, sample_rate)
+
+
+def load_audio(path, sample_rate=None, mono=True):
+    """Decode a whole file to float32 samples in [-1, 1]
+
+    Returns (samples, sample_rate). Samples are 1-D when mono, otherwise
+    shaped (frames, 2). Only for short files; use open_decoder to stream.
+    """
+    decoder = open_decoder(path, sample_rate or 44100)
+    try:
+        samples = decoder.read(0, decoder.frames)
+    finally:
+        decoder.close()
+    if mono:
+        samples = samples.mean(axis=1, dtype=np.float32)
+    return samples, decoder.sample_rate
+
+
+class Decoder:
+    """Base class: random-access reads over a mapped PCM region
+
+    Nothing is opened until the first use of ``frames`` or read(), so a
+    missing or corrupt file raises AudioDecodeError there (on the thread
+    doing the decoding) rather than in the constructor.
+    """
+    def __init__(self, path, sample_rate=44100, resident_budget=RESIDENT_BUDGET):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.resident_budget = resident_budget
+        self._frames = None
+        self._map = None
+        self._resident = None # (low, high) byte span touched since the last trim
+
+    @property
+    def frames(self):
+        if self._frames is None:
+            self._open()
+        return self._frames
+
+    def _open(self):
+        """Map the PCM and set self._frames"""
+        raise NotImplementedError
+
+    def read(self, start, count):
+        """(count, 2) float32 frames from start, zero padded past either end"""
+        raise NotImplementedError
+
+    def iter_blocks(self, block_frames, mono=False):
+        """Yield consecutive blocks covering the whole track"""
+        for start in range(0, self.frames, block_frames):
+            block = self.read(start, min(block_frames, self.frames - start))
+            yield block.mean(axis=1, dtype=np.float32) if mono else block
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def _touch(self, low, high):
+        """Record a read of bytes [low, high) and trim residency over budget"""
+        if self._resident is None:
+            self._resident = (low, high)
+            return
+        span = (min(self._resident[0], low), max(self._resident[1], high))
+        if span[1] - span[0] > self.resident_budget and hasattr(self._map, "madvise"):
+            # Pages stay in the page cache; they just stop counting against our RSS
+            self._map.madvise(mmap.MADV_DONTNEED)
+            span = (low, high)
+        self._resident = span
+
+
+def _convert(raw, fmt, width, channels):
+    """Interleaved little-endian PCM bytes -> float32 (frames, channels)"""
+    if fmt == WAVE_FORMAT_FLOAT and width == 4:
+        data = np.frombuffer(raw, dtype="<f4").astype(np.float32)
+    elif fmt == WAVE_FORMAT_FLOAT and width == 8:
+        data = np.frombuffer(raw, dtype="<f8").astype(np.float32)
+    elif width == 1:
+        data = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif width == 2:
+        data = np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768.0
+    elif width == 3:
+        bytes3 = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        ints = bytes3[:, 0] | (bytes3[:, 1] << 8) | (bytes3[:, 2] << 16)
+        ints = np.where(ints & 0x800000, ints - 0x1000000, ints)
+        data = ints.astype(np.float32) / 8388608.0
+    elif width == 4:
+        data = np.frombuffer(raw, dtype="<i4").astype(np.float32) / 2147483648.0
+    else:
+        raise AudioDecodeError(f"Unsupported sample width: {width}")
+    return data.reshape(-1, channels)
+
+
+def _to_stereo(data):
+    if data.shape[1] == 2:
+        return data
+    if data.shape[1] == 1:
+        return np.repeat(data, 2, axis=1)
+    return np.ascontiguousarray(data[:, :2])
+
+
+class WavDecoder(Decoder):
+    """Memory-mapped WAV reader; converts and resamples only what is read"""
+    def _open(self):
+        try:
+            with open(self.path, "rb") as f:
+                self._parse_header(f)
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as exc:
+            raise AudioDecodeError(f"{os.path.basename(self.path)}: {exc}")
+        self.source_frames = self.data_bytes // self.block_align
+        self.ratio = self.source_rate / self.sample_rate # source frames per output frame
+        self._frames = int(self.source_frames / self.ratio)
+
+    def _parse_header(self, f):
+        name = os.path.basename(self.path)
+        riff = f.read(12)
+        if len(riff) < 12 or riff[:4] != b"RIFF" or riff[8:] != b"WAVE":
+            raise AudioDecodeError(f"{name}: not a RIFF/WAVE file")
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise AudioDecodeError(f"{name}: no data chunk")
+            chunk_id, size = struct.unpack("<4sI", header)
+            if chunk_id == b"fmt ":
+                fmt = f.read(size)
+                f.seek(size & 1, os.SEEK_CUR)
+            elif chunk_id == b"data":
+                if fmt is None:
+                    raise AudioDecodeError(f"{name}: data before fmt chunk")
+                self.data_offset = f.tell()
+                file_size = os.fstat(f.fileno()).st_size
+                self.data_bytes = min(size, file_size - self.data_offset)
+                break
+            else:
+                f.seek(size + (size & 1), os.SEEK_CUR)
+        tag, self.channels, self.source_rate, _, self.block_align, bits = \
+            struct.unpack("<HHIIHH", fmt[:16])
+        if tag == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+            tag = struct.unpack("<H", fmt[24:26])[0]
+        if tag not in (WAVE_FORMAT_PCM, WAVE_FORMAT_FLOAT) or not self.channels:
+            raise AudioDecodeError(f"{name}: unsupported WAV encoding {tag}")
+        self.format = tag
+        self.width = self.block_align // self.channels
+
+    def _source(self, start, count):
+        """(count, 2) frames at the file's own rate, zero padded"""
+        out = np.zeros((count, 2), dtype=np.float32)
+        lo, hi = max(start, 0), min(start + count, self.source_frames)
+        if hi > lo:
+            low = self.data_offset + lo * self.block_align
+            high = self.data_offset + hi * self.block_align
+            self._touch(low, high)
+            data = _convert(self._map[low:high], self.format, self.width, self.channels)
+            out[lo - start:hi - start] = _to_stereo(data)
+        return out
+
+    def read(self, start, count):
+        if self._frames is None:
+            self._open()
+        if self.ratio == 1.0:
+            return self._source(start, count)
+        factor = int(round(self.ratio))
+        if abs(self.ratio - factor) < 1e-9:
+            # Integer decimation: average each group of source frames
+            return self._source(start * factor, count * factor).reshape(count, factor, 2) \
+                .mean(axis=1, dtype=np.float32)
+        # Linear interpolation from just the source frames this block spans
+        positions = (start + np.arange(count)) * self.ratio
+        first = int(positions[0]) if count else 0
+        source = self._source(first, int(positions[-1]) - first + 2 if count else 0)
+        local = positions - first
+        index = local.astype(np.int64)
+        frac = (local - index).astype(np.float32)[:, None]
+        return source[index] * (1.0 - frac) + source[index + 1] * frac
+
+
+class FFmpegDecoder(Decoder):
+    """Decodes compressed formats with ffmpeg into a sparse memory-mapped scratch file
+
+    The scratch file is sized for the whole track up front (it stays sparse
+    until written) and frame p is stored at byte p * 8. Reads extend the
+    running ffmpeg process when they continue where it is; a read far from
+    it restarts ffmpeg with -ss at the requested position, so a seek never
+    waits for everything before it to decode.
+    """
+    FRAME_BYTES = 8 # float32 stereo
+    CHUNK_FRAMES = 1 << 16
+    RESTART_DISTANCE = 20 # seconds; closer reads just let the current process catch up
+
+    def __init__(self, path, sample_rate=44100, resident_budget=RESIDENT_BUDGET):
+        super().__init__(path, sample_rate, resident_budget)
+        self.ffmpeg = None
+        self._scratch = None
+        self._decoded = [] # Sorted, disjoint [start, end) frame ranges in the scratch file
+        self._proc = None
+        self._proc_position = 0 # Next frame the running process will produce
+
+    def _open(self):
+        name = os.path.basename(self.path)
+        self.ffmpeg = shutil.which("ffmpeg")
+        if self.ffmpeg is None:
+            raise AudioDecodeError(f"ffmpeg is required to decode {name}")
+        if not os.path.exists(self.path):
+            raise AudioDecodeError(f"{name}: file not found")
+        frames = self._probe_frames()
+        self._scratch = tempfile.TemporaryFile(prefix="music-analyzer-pcm-")
+        size = max(frames * self.FRAME_BYTES, 1)
+        self._scratch.truncate(size)
+        self._map = mmap.mmap(self._scratch.fileno(), size, access=mmap.ACCESS_READ)
+        self._frames = frames
+
+    def read(self, start, count):
+        out = np.zeros((count, 2), dtype=np.float32)
+        lo, hi = max(start, 0), min(start + count, self.frames)
+        if hi <= lo:
+            return out
+        self._ensure(lo, hi)
+        low, high = lo * self.FRAME_BYTES, hi * self.FRAME_BYTES
+        self._touch(low, high)
+        out[lo - start:hi - start] = np.frombuffer(self._map[low:high],
+                                                   dtype="<f4").reshape(-1, 2)
+        return out
+
+    def close(self):
+        self._stop_process()
+        super().close()
+        if self._scratch is not None:
+            self._scratch.close()
+            self._scratch = None
+
+    def _probe_frames(self):
+        ffprobe = shutil.which("ffprobe")
+        if ffprobe:
+            proc = subprocess.run(
+                [ffprobe, "-v", "error", "-show_entries", "format=duration",
+                 "-of", "default=noprint_wrappers=1:nokey=1", self.path],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            try:
+                return int(float(proc.stdout.strip()) * self.sample_rate)
+            except ValueError:
+                pass
+        # No duration from the container: one sequential decode finds the length
+        total = 0
+        proc = self._spawn(0)
+        while True:
+            chunk = proc.stdout.read(self.CHUNK_FRAMES * self.FRAME_BYTES)
+            if not chunk:
+                break
+            total += len(chunk) // self.FRAME_BYTES
+        self._check_exit(proc)
+        return total
+
+    def _ensure(self, lo, hi):
+        while True:
+            missing = self._first_gap(lo, hi)
+            if missing is None:
+                return
+            if (self._proc is None or missing < self._proc_position
+                    or missing > self._proc_position
+                    + self.RESTART_DISTANCE * self.sample_rate):
+                self._stop_process()
+                self._proc = self._spawn(missing)
+                self._proc_position = missing
+            if not self._pump():
+                # ffmpeg finished early (duration estimate was long): pad with silence
+                self._mark(self._proc_position, self._frames)
+                self._stop_process()
+
+    def _first_gap(self, lo, hi):
+        position = lo
+        for start, end in self._decoded:
+            if start > position:
+                break
+            position = max(position, end)
+        return position if position < hi else None
+
+    def _pump(self):
+        """Write one chunk from the running process into the scratch file"""
+        chunk = self._proc.stdout.read(self.CHUNK_FRAMES * self.FRAME_BYTES)
+        chunk = chunk[:len(chunk) - len(chunk) % self.FRAME_BYTES]
+        if not chunk:
+            self._check_exit(self._proc)
+            return False
+        count = min(len(chunk) // self.FRAME_BYTES, self._frames - self._proc_position)
+        if count <= 0:
+            return False
+        os.pwrite(self._scratch.fileno(), chunk[:count * self.FRAME_BYTES],
+                  self._proc_position * self.FRAME_BYTES)
+        self._mark(self._proc_position, self._proc_position + count)
+        self._proc_position += count
+        return True
+
+    def _mark(self, start, end):
+        ranges = sorted(self._decoded + [(start, end)])
+        merged = [ranges[0]]
+        for s, e in ranges[1:]:
+            if s <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], e))
+            else:
+                merged.append((s, e))
+        self._decoded = merged
+
+    def _spawn(self, start_frame):
+        cmd = [self.ffmpeg, "-v", "error", "-nostdin"]
+        if start_frame:
+            cmd += ["-ss", f"{start_frame / self.sample_rate:.6f}"]
+        cmd += ["-i", self.path, "-f", "f32le", "-ac", "2", "-ar", str(self.sample_rate), "-"]
+        return subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def _check_exit(self, proc):
+        if proc.wait() != 0:
+            message = proc.stderr.read().decode(errors="replace").strip()
+            raise AudioDecodeError(f"{os.path.basename(self.path)}: {message}")
+
+    def _stop_process(self):
+        if self._proc is not None:
+            self._proc.kill()
+            self._proc.wait()
+            self._proc.stdout.close()
+            self._proc.stderr.close()
+            self._proc = None
@@ -0,0 +1,137 @@
+"""Camelot key notation and the harmonic-mixing compatibility index
+
+Camelot codes number the circle of fifths 1-12, with A for minor and B for
+major keys. Two tracks mix harmonically when their codes are equal, one
+step apart on the wheel with the same letter, or the same number with the
+other letter (relative major/minor).
+"""
+import functools
+import re
+
+import numpy as np
+
+NOTE_NUMBERS = {"C": 0, "C#": 1, "DB": 1, "D": 2, "D#": 3, "EB": 3, "E": 4, "F": 5,
+                "F#": 6, "GB": 6, "G": 7, "G#": 8, "AB": 8, "A": 9, "A#": 10,
+                "BB": 10, "B": 11}
+# Camelot wheel number for each pitch class; minor keys are the relative
+# minor of the major key three semitones up
+CAMELOT_MAJOR = (8, 3, 10, 5, 12, 7, 2, 9, 4, 11, 6, 1)
+# Codes in the order of the analysis key profiles: C..B major, then C..B minor
+KEY_CODES = tuple(f"{CAMELOT_MAJOR[pitch]}B" for pitch in range(12)) + \
+    tuple(f"{CAMELOT_MAJOR[(pitch + 3) % 12]}A" for pitch in range(12))
+# Relations in preference order when ranking what can follow a track
+RELATIONS = ("same key", "+1", "-1", "relative")
+
+
+@functools.lru_cache(maxsize=256)
+def to_camelot(key):
+    """Camelot code ("8A") for a key name ("Am", "C", "F#m") or code; "" if unknown"""
+    key = (key or "").strip().upper()
+    match = re.fullmatch(r"(\d{1,2})([AB])", key)
+    if match:
+        number = int(match.group(1))
+        return f"{number}{match.group(2)}" if 1 <= number <= 12 else ""
+    minor = key.endswith("M") and len(key) > 1
+    if key.endswith("MIN"):
+        key, minor = key[:-3], True
+    elif key.endswith("MAJ"):
+        key = key[:-3]
+    elif minor:
+        key = key[:-1]
+    pitch = NOTE_NUMBERS.get(key)
+    if pitch is None:
+        return ""
+    if minor:
+        return f"{CAMELOT_MAJOR[(pitch + 3) % 12]}A"
+    return f"{CAMELOT_MAJOR[pitch]}B"
+
+
+def key_number(code):
+    """1..12 for nA, 13..24 for nB, 0 for an unknown key"""
+    if not code:
+        return 0
+    return int(code[:-1]) + (12 if code[-1] == "B" else 0)
+
+
+def key_code(number):
+    """Inverse of key_number"""
+    if not number:
+        return ""
+    return f"{(number - 1) % 12 + 1}{'B' if number > 12 else 'A'}"
+
+
+def compatible_numbers(number):
+    """Key numbers that mix with number, in RELATIONS order"""
+    wheel, major = (number - 1) % 12, number > 12
+    base = 13 if major else 1
+    return (number, base + (wheel + 1) % 12, base + (wheel - 1) % 12,
+            (wheel + (1 if major else 13)))
+
+
+class CompatibilityIndex:
+    """Answers "what can follow this track" over a LibraryIndex
+
+    Every track with a known key and BPM is placed in one sorted array on
+    key_number * 1000 + bpm, so each compatible key and BPM window is a
+    contiguous range found by binary search; a query costs a handful of
+    searchsorted calls plus the size of the answer, however big the
+    library. The arrays are rebuilt lazily when the library has changed.
+    """
+    def __init__(self, library, tolerance=0.06, half_double=True):
+        self.library = library
+        self.tolerance = tolerance # BPM window as a fraction of the BPM
+        self.half_double = half_double # Also match at double and half tempo
+        self.version = None
+        self.values = np.zeros(0)
+        self.ids = np.zeros(0, dtype=np.int64)
+
+    def refresh(self):
+        library = self.library
+        if self.version == library.version:
+            return
+        count = len(library.paths)
+        keys = library.keys[:count].astype(np.float64)
+        bpms = library.numeric["bpm"][:count]
+        usable = library.alive[:count] & (keys > 0) & (bpms > 0)
+        values = keys[usable] * 1000 + bpms[usable]
+        order = np.argsort(values, kind="stable")
+        self.values = values[order]
+        self.ids = np.flatnonzero(usable)[order]
+        self.version = library.version
+
+    def compatible(self, key, bpm, tolerance=None):
+        """Ids of tracks that mix with key at bpm
+
+        Ordered by relation (same key, +1, -1, relative) and then by how
+        far their tempo is from bpm.
+        """
+        self.refresh()
+        number = key_number(to_camelot(key))
+        if not number or not bpm:
+            return np.zeros(0, dtype=np.int64)
+        tolerance = self.tolerance if tolerance is None else tolerance
+        targets = (bpm, bpm * 2, bpm / 2) if self.half_double else (bpm,)
+        found, ranks, distances = [], [], []
+        for rank, other in enumerate(compatible_numbers(number)):
+            for target in targets:
+                low = np.searchsorted(self.values, other * 1000 + target * (1 - tolerance))
+                high = np.searchsorted(self.values, other * 1000 + target * (1 + tolerance),
+                                       side="right")
+                if high > low:
+                    found.append(self.ids[low:high])
+                    ranks.append(np.full(high - low, rank))
+                    distances.append(np.abs(self.values[low:high] - other * 1000 - target)
+                                     / target)
+        if not found:
+            return np.zeros(0, dtype=np.int64)
+        ids = np.concatenate(found)
+        return ids[np.lexsort((np.concatenate(distances), np.concatenate(ranks)))]
+
+    def follows(self, path, tolerance=None):
+        """Tracks that can follow path, excluding path itself"""
+        track_id = self.library.ids[path]
+        bpm = self.library.numeric["bpm"][track_id]
+        if np.isnan(bpm):
+            return np.zeros(0, dtype=np.int64)
+        ids = self.compatible(key_code(int(self.library.keys[track_id])), bpm, tolerance)
+        return ids[ids != track_id]
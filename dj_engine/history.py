@@ -0,0 +1,262 @@
+"""Play history: an append-only event log plus rollups kept next to it
+
+Deck loads, plays and stops are appended to a plain text log, one short
+line each; paths are written once as "P <id> <path>" and events refer to
+the id:
+
+    1730932800.5 L 1 17      (time, Load/Start/Stop, deck, path id)
+
+record() only queues the event. A flusher thread appends the queued lines
+about once a second and, in the same pass, folds them into rollup tables
+in SQLite (plays per track, sessions and the tracks played in each,
+A -> B transition counts), checkpointing the log offset it has applied.
+Queries read the rollups, never the log, so they stay cheap however long
+the history gets; the log is the source of truth and the rollups can be
+rebuilt from it.
+
+A play counts when a deck starts a track for the first time since it was
+loaded. A session starts when the log is opened or after SESSION_GAP
+seconds without events; a track loaded before such a gap (say before the
+doors open) still counts when it is first played after it.
+"""
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import deque
+
+FLUSH_INTERVAL = 1.0
+SESSION_GAP = 30 * 60
+KINDS = {"load": "L", "play": "S", "stop": "X", "open": "O"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS log_paths (id INTEGER PRIMARY KEY, path TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS track_plays (
+    path TEXT PRIMARY KEY, plays INTEGER NOT NULL, last_played REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY, started REAL NOT NULL, ended REAL NOT NULL, plays INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS session_plays (
+    session INTEGER NOT NULL, position INTEGER NOT NULL, played REAL NOT NULL,
+    deck INTEGER NOT NULL, path TEXT NOT NULL, PRIMARY KEY (session, position));
+CREATE TABLE IF NOT EXISTS transitions (
+    from_path TEXT NOT NULL, to_path TEXT NOT NULL, count INTEGER NOT NULL,
+    PRIMARY KEY (from_path, to_path));
+CREATE TABLE IF NOT EXISTS checkpoint (id INTEGER PRIMARY KEY CHECK (id = 1), offset INTEGER NOT NULL);
+"""
+
+
+def default_history_folder():
+    return os.path.join(os.path.expanduser("~"), ".music_analyzer_dj")
+
+
+class Rollups:
+    """Folds log events into the rollup tables; owned by one thread"""
+    def __init__(self, db):
+        self.db = db
+        self.loaded = {} # deck -> (path, counted)
+        self.session = None # [id, started, ended, plays]
+        self.last_event = None
+        self.last_played = None
+
+    def apply(self, when, kind, deck, path, played):
+        """Apply one event; counted plays are appended to played as (path, total plays)"""
+        if kind == "O":
+            self.end_session()
+            self.loaded = {} # The decks start empty when the app opens
+        elif self.last_event is not None and when - self.last_event > SESSION_GAP:
+            self.end_session()
+        self.last_event = when
+        if kind == "L":
+            self.loaded[deck] = (path, False)
+        elif kind == "S" and self.loaded.get(deck, (None, True))[1] is False:
+            path = self.loaded[deck][0]
+            self.loaded[deck] = (path, True)
+            self.count_play(when, deck, path, played)
+        if self.session is not None:
+            self.session[2] = when
+
+    def count_play(self, when, deck, path, played):
+        db = self.db
+        if self.session is None:
+            cursor = db.execute("INSERT INTO sessions (started, ended, plays) VALUES (?, ?, 0)",
+                                (when, when))
+            self.session = [cursor.lastrowid, when, when, 0]
+            self.last_played = None
+        self.session[3] += 1
+        db.execute("INSERT INTO session_plays VALUES (?, ?, ?, ?, ?)",
+                   (self.session[0], self.session[3], when, deck, path))
+        db.execute("INSERT INTO track_plays VALUES (?, 1, ?) ON CONFLICT(path) DO UPDATE "
+                   "SET plays = plays + 1, last_played = excluded.last_played", (path, when))
+        if self.last_played is not None and self.last_played != path:
+            db.execute("INSERT INTO transitions VALUES (?, ?, 1) ON CONFLICT(from_path, to_path) "
+                       "DO UPDATE SET count = count + 1", (self.last_played, path))
+        self.last_played = path
+        plays = db.execute("SELECT plays FROM track_plays WHERE path = ?", (path,)).fetchone()[0]
+        played.append((path, plays))
+
+    def end_session(self):
+        self.save_session()
+        self.session = None
+        self.last_played = None
+
+    def save_session(self):
+        if self.session is not None:
+            self.db.execute("UPDATE sessions SET ended = ?, plays = ? WHERE id = ?",
+                            (self.session[2], self.session[3], self.session[0]))
+
+
+class PlayLog:
+    """Append-only play history with rollups, written by a background flusher
+
+    Counted plays come back in ``events`` as ("played", path, total plays)
+    once they are on disk, to be drained from the Tk main loop.
+    """
+    def __init__(self, folder=None):
+        self.folder = folder or default_history_folder()
+        os.makedirs(self.folder, exist_ok=True)
+        self.log_path = os.path.join(self.folder, "history.log")
+        self.db_path = os.path.join(self.folder, "history.db")
+        self.events = queue.Queue()
+        self._pending = deque()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        db = sqlite3.connect(self.db_path)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.executescript(SCHEMA)
+        db.commit()
+        self.db = db # Readers' connection, for the Tk thread
+        self.record("open")
+        self._thread = threading.Thread(target=self._run, name="history-flush", daemon=True)
+        self._thread.start()
+
+    def record(self, kind, deck=0, path=None):
+        """Queue a "load", "play" or "stop" for a deck; no I/O happens here"""
+        self._pending.append((round(time.time(), 1), KINDS[kind], deck, path))
+
+    def flush(self, timeout=5.0):
+        """Wait until everything recorded so far is written and rolled up"""
+        done = threading.Event()
+        self._pending.append(done)
+        self._wake.set()
+        done.wait(timeout)
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(10.0)
+        self.db.close()
+
+    def drain(self, limit=500):
+        events = []
+        try:
+            while len(events) < limit:
+                events.append(self.events.get_nowait())
+        except queue.Empty:
+            pass
+        return events
+
+    # Queries over the rollups
+
+    def play_counts(self):
+        """{path: plays} for every track ever played"""
+        return dict(self.db.execute("SELECT path, plays FROM track_plays"))
+
+    def most_played(self, limit=100):
+        return self.db.execute("SELECT path, plays, last_played FROM track_plays "
+                               "ORDER BY plays DESC, last_played DESC LIMIT ?", (limit,)).fetchall()
+
+    def sessions(self, limit=200):
+        """[(id, started, ended, plays)], newest first"""
+        return self.db.execute("SELECT id, started, ended, plays FROM sessions "
+                               "ORDER BY started DESC LIMIT ?", (limit,)).fetchall()
+
+    def session_plays(self, session):
+        """[(played, deck, path)] in play order"""
+        return self.db.execute("SELECT played, deck, path FROM session_plays WHERE session = ? "
+                               "ORDER BY position", (session,)).fetchall()
+
+    def transitions(self, limit=100, from_path=None):
+        """[(from, to, count)], most frequent first; optionally only out of from_path"""
+        if from_path is None:
+            return self.db.execute("SELECT from_path, to_path, count FROM transitions "
+                                   "ORDER BY count DESC LIMIT ?", (limit,)).fetchall()
+        return self.db.execute("SELECT from_path, to_path, count FROM transitions "
+                               "WHERE from_path = ? ORDER BY count DESC LIMIT ?",
+                               (from_path, limit)).fetchall()
+
+    # Flusher thread
+
+    def _run(self):
+        db = sqlite3.connect(self.db_path)
+        path_ids = {path: path_id for path_id, path in db.execute("SELECT id, path FROM log_paths")}
+        rollups = Rollups(db)
+        self._catch_up(db, rollups, path_ids)
+        with open(self.log_path, "ab") as log:
+            while True:
+                self._wake.wait(FLUSH_INTERVAL)
+                self._wake.clear()
+                stopping = self._stop.is_set()
+                self._flush(db, log, rollups, path_ids)
+                if stopping:
+                    break
+        with db:
+            rollups.save_session()
+        db.close()
+
+    def _flush(self, db, log, rollups, path_ids):
+        waiters, lines, played = [], [], []
+        with db:
+            while self._pending:
+                event = self._pending.popleft()
+                if isinstance(event, threading.Event):
+                    waiters.append(event)
+                    continue
+                when, kind, deck, path = event
+                path_id = 0
+                if path is not None:
+                    path_id = path_ids.get(path)
+                    if path_id is None:
+                        path_id = path_ids[path] = len(path_ids) + 1
+                        db.execute("INSERT INTO log_paths VALUES (?, ?)", (path_id, path))
+                        lines.append(f"P {path_id} {path}\n")
+                lines.append(f"{when} {kind} {deck} {path_id}\n")
+                rollups.apply(when, kind, deck, path, played)
+            if lines:
+                log.write("".join(lines).encode("utf-8"))
+                log.flush()
+                rollups.save_session()
+                db.execute("INSERT OR REPLACE INTO checkpoint VALUES (1, ?)", (log.tell(),))
+        for path, plays in played:
+            self.events.put(("played", path, plays))
+        for waiter in waiters:
+            waiter.set()
+
+    def _catch_up(self, db, rollups, path_ids):
+        """Roll up log lines written after the last checkpoint (e.g. before a crash)"""
+        row = db.execute("SELECT offset FROM checkpoint").fetchone()
+        offset = row[0] if row else 0
+        if not os.path.exists(self.log_path) or os.path.getsize(self.log_path) <= offset:
+            return
+        paths = {path_id: path for path, path_id in path_ids.items()}
+        played = []
+        with db, open(self.log_path, "r+b") as log:
+            log.seek(offset)
+            for raw in log:
+                if not raw.endswith(b"\n"):
+                    break # Torn final write
+                offset += len(raw)
+                line = raw.decode("utf-8")
+                if line.startswith("P "):
+                    path_id, path = line[2:-1].split(" ", 1)
+                    paths[int(path_id)] = path
+                    path_ids[path] = int(path_id)
+                    db.execute("INSERT OR IGNORE INTO log_paths VALUES (?, ?)", (int(path_id), path))
+                    continue
+                when, kind, deck, path_id = line.split()
+                rollups.apply(float(when), kind, int(deck), paths.get(int(path_id)), played)
+            log.truncate(offset) # Drop a torn line so new lines start clean
+            rollups.end_session()
+            db.execute("INSERT OR REPLACE INTO checkpoint VALUES (1, ?)", (offset,))
+        for path, plays in played:
+            self.events.put(("played", path, plays))
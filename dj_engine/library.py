@@ -0,0 +1,329 @@
+"""In-memory library index with instant text search and field filters
+
+Queries are whitespace separated terms, all of which must match:
+
+    daft punk            words in song/artist/album starting with (or, from
+                         three letters on, containing) each term
+    artist:daft          the same, restricted to one text column
+    bpm:124-128          numeric ranges; also bpm:>120, bpm:<100, bpm:126
+    length:3:00-5:30     lengths as m:ss or seconds
+    bitrate:320          kbps
+    key:8A  key:Am       Camelot code or key name; key:8A,9A for several
+    plays:>5             play count
+"""
+import bisect
+import itertools
+import re
+
+import numpy as np
+
+from .harmonic import key_number, to_camelot
+
+TEXT_FIELDS = ("song", "artist", "album")
+NUMERIC_FIELDS = ("bpm", "bitrate", "length", "added", "plays") # added: Unix time
+WORD = re.compile(r"\w+")
+FILTER = re.compile(r"^(\w+):(.*)$")
+
+
+def parse_length(text):
+    """Seconds from "m:ss", "h:mm:ss" or plain seconds"""
+    seconds = 0.0
+    for part in text.split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+class TextIndex:
+    """Inverted index for one text column
+
+    Words map to posting sets of track ids, and a trigram -> words map
+    serves substring lookups without scanning the vocabulary.
+
+    For searching, the postings are frozen into one flat id array in sorted
+    word order, so all words sharing a prefix are one contiguous slice found
+    by bisection. Words that gained or lost tracks since the last freeze are
+    checked from their sets, and the frozen slices of words that lost tracks
+    are skipped, until there are enough of them to be worth refreezing.
+    """
+    STALE_LIMIT = 2048
+
+    def __init__(self):
+        self.postings = {}
+        self.trigrams = {}
+        self.vocabulary = [] # sorted words at the last freeze
+        self._slots = {} # frozen word -> its index in vocabulary
+        self._flat = np.zeros(0, dtype=np.int64)
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._stale = set() # words with ids added or removed since the freeze
+        self._dropped = set() # slots of frozen words that lost ids since the freeze
+
+    def add(self, track_id, text):
+        for word in set(WORD.findall(text.lower())):
+            ids = self.postings.get(word)
+            if ids is None:
+                ids = self.postings[word] = set()
+                for gram in _trigrams(word):
+                    self.trigrams.setdefault(gram, set()).add(word)
+            ids.add(track_id)
+            self._stale.add(word)
+
+    def remove(self, track_id, text):
+        for word in set(WORD.findall(text.lower())):
+            ids = self.postings.get(word)
+            if ids is None:
+                continue
+            ids.discard(track_id)
+            slot = self._slots.get(word)
+            if slot is not None:
+                self._dropped.add(slot)
+            if ids:
+                self._stale.add(word)
+            else:
+                del self.postings[word]
+                for gram in _trigrams(word):
+                    self.trigrams[gram].discard(word)
+                self._stale.discard(word)
+
+    def words(self, term):
+        """Words starting with term, or containing it once it has 3+ letters"""
+        self.freeze()
+        start = bisect.bisect_left(self.vocabulary, term)
+        end = bisect.bisect_left(self.vocabulary, term + "\U0010ffff", start)
+        return self.vocabulary[start:end] + self._infix_words(term)
+
+    def match(self, term, mask):
+        """Set mask[id] for every track with a word matching term"""
+        if len(self._stale) + len(self._dropped) > self.STALE_LIMIT:
+            self.freeze()
+        flat, offsets = self._flat, self._offsets
+        start = bisect.bisect_left(self.vocabulary, term)
+        end = bisect.bisect_left(self.vocabulary, term + "\U0010ffff", start)
+        for slot in sorted(slot for slot in self._dropped if start <= slot < end) + [end]:
+            mask[flat[offsets[start]:offsets[slot]]] = True
+            start = slot + 1
+        for word in self._infix_words(term):
+            slot = self._slots.get(word)
+            if slot is not None and slot not in self._dropped:
+                mask[flat[offsets[slot]:offsets[slot + 1]]] = True
+        for word in self._stale:
+            if word.startswith(term) or (len(term) >= 3 and term in word):
+                mask[list(self.postings[word])] = True
+
+    def freeze(self):
+        """Rebuild the flat posting array if anything changed since the last freeze"""
+        if not self._stale and not self._dropped:
+            return
+        words = sorted(self.postings)
+        sizes = np.fromiter((len(self.postings[word]) for word in words), dtype=np.int64,
+                            count=len(words))
+        self._offsets = np.concatenate([[0], np.cumsum(sizes)])
+        self._flat = np.fromiter(itertools.chain.from_iterable(
+            self.postings[word] for word in words), dtype=np.int64, count=int(self._offsets[-1]))
+        self.vocabulary = words
+        self._slots = {word: slot for slot, word in enumerate(words)}
+        self._stale = set()
+        self._dropped = set()
+
+    def _infix_words(self, term):
+        """Words containing term other than at the start (3+ letter terms only)"""
+        if len(term) < 3:
+            return []
+        grams = sorted((self.trigrams.get(gram, set()) for gram in _trigrams(term)), key=len)
+        return [word for word in set.intersection(*grams)
+                if term in word and not word.startswith(term)]
+
+
+class LibraryIndex:
+    """Searchable track table: text columns, numeric columns and Camelot keys
+
+    Tracks get dense integer ids in the order they are added; search()
+    returns matching ids in that order. Numeric columns live in growable
+    NumPy arrays (NaN when unknown) so range filters are single vectorized
+    comparisons.
+
+    Callables in ``watchers`` are told about every change as
+    watcher(track_id, fields), with the set of fields that changed, or
+    None when the track was removed; they must be cheap.
+    """
+    def __init__(self):
+        self.paths = []
+        self.ids = {} # path -> id
+        self.text = {name: [] for name in TEXT_FIELDS}
+        self.text_index = {name: TextIndex() for name in TEXT_FIELDS}
+        self.numeric = {name: np.full(1024, np.nan) for name in NUMERIC_FIELDS}
+        self.keys = np.zeros(1024, dtype=np.int8) # 0 unknown, 1..12 = nA, 13..24 = nB
+        self.alive = np.zeros(1024, dtype=bool)
+        self.version = 0 # Bumped on every change, so views know to refresh
+        self._sort_cache = {} # column -> (version, ascending permutation of all ids)
+        self._changed = set() # columns changed since their order was cached
+        self.watchers = []
+
+    def __len__(self):
+        return int(self.alive[:len(self.paths)].sum())
+
+    def add(self, path, **fields):
+        """Add a track (or update it if the path is already indexed); returns its id"""
+        track_id = self.ids.get(path)
+        if track_id is not None:
+            self.update(path, **fields)
+            return track_id
+        track_id = len(self.paths)
+        self.paths.append(path)
+        self.ids[path] = track_id
+        if track_id >= len(self.alive):
+            self._grow()
+        self.alive[track_id] = True
+        for name in TEXT_FIELDS:
+            self.text[name].append("")
+        # A new id extends every column, so every cached order is out of date
+        self._changed.update(TEXT_FIELDS + NUMERIC_FIELDS + ("key",))
+        self.version += 1
+        self._set_fields(track_id, fields)
+        self._notify(track_id, set(TEXT_FIELDS + NUMERIC_FIELDS + ("key",)))
+        return track_id
+
+    def update(self, path, **fields):
+        """Change some fields of an indexed track, re-indexing only those"""
+        track_id = self.ids[path]
+        self.version += 1
+        changed = self._set_fields(track_id, fields)
+        if changed:
+            self._notify(track_id, changed)
+
+    def _set_fields(self, track_id, fields):
+        """Store field values; returns the names whose value changed"""
+        changed = set()
+        for name, value in fields.items():
+            if name in self.text_index:
+                value = value or ""
+                old = self.text[name][track_id]
+                if value != old:
+                    self.text_index[name].remove(track_id, old)
+                    self.text_index[name].add(track_id, value)
+                    self.text[name][track_id] = value
+                    changed.add(name)
+            elif name in self.numeric:
+                value = np.nan if value is None else float(value)
+                old = self.numeric[name][track_id]
+                if old != value and not (np.isnan(old) and np.isnan(value)):
+                    self.numeric[name][track_id] = value
+                    changed.add(name)
+            elif name == "key":
+                number = key_number(to_camelot(value))
+                if number != self.keys[track_id]:
+                    self.keys[track_id] = number
+                    changed.add(name)
+            else:
+                raise KeyError(f"Unknown library field: {name}")
+        self._changed |= changed
+        return changed
+
+    def _notify(self, track_id, fields):
+        for watcher in self.watchers:
+            watcher(track_id, fields)
+
+    def sort_order(self, column, descending=False):
+        """Live ids sorted by column; unknown values sort last either way
+
+        The full permutation is cached per column and only recomputed after
+        that column changes, so re-sorting or re-filtering is one gather.
+        """
+        count = len(self.paths)
+        cached = self._sort_cache.get(column)
+        if cached is None or column in self._changed:
+            if column in self.text:
+                values = np.array([text.lower() for text in self.text[column]], dtype=str)
+                order = np.argsort(values, kind="stable")
+                known = values[order] != ""
+            else:
+                values = self.numeric[column][:count] if column != "key" else \
+                    np.where(self.keys[:count] > 0, self.keys[:count], np.nan)
+                order = np.argsort(values, kind="stable")
+                known = ~np.isnan(values[order])
+            cached = self._sort_cache[column] = (order[known], order[~known])
+            self._changed.discard(column)
+        known, unknown = cached
+        order = np.concatenate([known[::-1] if descending else known, unknown])
+        return order[self.alive[order]]
+
+    def freeze(self):
+        """Pay for any pending index rebuild now (e.g. after a bulk load) instead of on a keystroke"""
+        for index in self.text_index.values():
+            index.freeze()
+
+    def remove(self, path):
+        track_id = self.ids.pop(path, None)
+        if track_id is None:
+            return
+        self.alive[track_id] = False
+        self.version += 1
+        for name in TEXT_FIELDS:
+            self.text_index[name].remove(track_id, self.text[name][track_id])
+            self.text[name][track_id] = ""
+        self._notify(track_id, None)
+
+    def search(self, query):
+        """Ids of live tracks matching every term of query, in id order"""
+        count = len(self.paths)
+        selected = self.alive[:count].copy()
+        for term in query.split():
+            match = FILTER.match(term)
+            name, value = (match.group(1).lower(), match.group(2)) if match else (None, term)
+            if not value:
+                continue # "bpm:" still being typed
+            if name in self.numeric:
+                selected &= self._numeric_mask(name, value, count)
+            elif name == "key":
+                codes = [key_number(to_camelot(part)) for part in value.split(",")]
+                codes = [code for code in codes if code]
+                if codes:
+                    keys = self.keys[:count]
+                    selected &= np.logical_or.reduce([keys == code for code in codes])
+            else:
+                indexes = [self.text_index[name]] if name in self.text_index else \
+                    list(self.text_index.values())
+                if name not in self.text_index:
+                    value = term # Not a known filter: search the text as typed
+                mask = np.ones(count, dtype=bool)
+                for word in WORD.findall(value.lower()):
+                    hits = np.zeros(count, dtype=bool)
+                    for index in indexes:
+                        index.match(word, hits)
+                    mask &= hits
+                selected &= mask
+            if not selected.any():
+                break
+        return np.flatnonzero(selected)
+
+    def _numeric_mask(self, name, value, count):
+        column = self.numeric[name][:count]
+        parse = parse_length if name == "length" else float
+        try:
+            if value.startswith(">"):
+                return column > parse(value[1:])
+            if value.startswith("<"):
+                return column < parse(value[1:])
+            low, sep, high = value.partition("-")
+            if sep:
+                return (column >= parse(low)) & (column <= parse(high))
+            exact = parse(value)
+        except ValueError:
+            # Half-typed filter: do not narrow the results yet
+            return np.ones(count, dtype=bool)
+        # bpm:126 means 126.x; other columns compare to the nearest unit
+        if name == "bpm":
+            return (column >= exact) & (column < exact + 1)
+        return np.abs(column - exact) < 0.5
+
+    def _grow(self):
+        size = len(self.alive) * 2
+        for name, column in self.numeric.items():
+            grown = np.full(size, np.nan)
+            grown[:len(column)] = column
+            self.numeric[name] = grown
+        self.keys = np.concatenate([self.keys, np.zeros(size - len(self.keys), np.int8)])
+        self.alive = np.concatenate([self.alive, np.zeros(size - len(self.alive), bool)])
+
+
+def _trigrams(word):
+    return {word[i:i + 3] for i in range(len(word) - 2)}
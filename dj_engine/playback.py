@@ -0,0 +1,595 @@
+"""Real-time playback: per-deck decode-ahead feeders, a mixer and output sinks
+
+Threads involved:
+
+* one feeder thread per deck decodes ahead of the playhead into a ring buffer
+* the output callback (sound card thread, or a sink thread for the null and
+  WAV sinks) calls Mixer.render for every block
+* the Tk thread only ever appends transport commands to a deque
+
+deque.append/popleft are atomic under the GIL, so the command queue needs no
+lock and the audio thread never waits on the UI.
+"""
+import math
+import threading
+import time
+import wave
+from collections import deque
+
+import numpy as np
+
+from .cues import beat_frames, snap
+from .decode import AudioDecodeError, open_decoder
+from .profiler import PROFILER, LatencyHistogram
+from .tempo import MasterClock, resample_block
+
+SAMPLE_RATE = 44100
+BLOCK_SIZE = 512
+CHANNELS = 2
+# Silence decoded past the end of a track, so a resampled final block can
+# read its interpolation neighbours
+TAIL_FRAMES = 4096
+# Audio decoded at a jump target before the jump happens
+JUMP_PREFETCH = 32768
+
+
+class RingBuffer:
+    """Position-addressed single-producer/single-consumer ring of stereo frames
+
+    Frame p lives in slot p % capacity. ``window`` is an (owner, first, end)
+    tuple: the decoder the frames came from and the absolute frame positions
+    currently held. It is replaced as a whole so the reader always sees a
+    consistent snapshot without taking a lock.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.data = np.zeros((capacity, CHANNELS), dtype=np.float32)
+        self.window = (None, 0, 0)
+
+    def reset(self, owner, position):
+        self.window = (owner, position, position)
+
+    def write(self, frames, keep_from):
+        """Append frames at the window end; never drops data at or after keep_from"""
+        owner, first, end = self.window
+        count = min(len(frames), self.capacity - (end - max(first, min(keep_from, end))))
+        if count <= 0:
+            return 0
+        slot = end % self.capacity
+        head = min(count, self.capacity - slot)
+        self.data[slot:slot + head] = frames[:head]
+        self.data[:count - head] = frames[head:count]
+        end += count
+        self.window = (owner, max(first, end - self.capacity), end)
+        return count
+
+    def read_into(self, out, owner, position):
+        """Add len(out) frames from position into out; False if not buffered"""
+        current, first, end = self.window
+        count = len(out)
+        if current is not owner or position < first or position + count > end:
+            return False
+        slot = position % self.capacity
+        head = min(count, self.capacity - slot)
+        out[:head] += self.data[slot:slot + head]
+        out[head:] += self.data[:count - head]
+        return True
+
+
+class DeckPlayer:
+    """Transport and decode-ahead buffer for one deck
+
+    The Tk thread calls load/play/pause/seek, which only queue commands.
+    Mixer.render applies them at the start of the next audio block.
+    ``position`` is fractional: at a rate other than 1.0 the playhead
+    falls between source frames and the block is resampled.
+
+    Loops and hot cue jumps are carried out by the audio thread inside
+    the block: render_into splits a block at the exact output frame where
+    the playhead crosses a loop end or a scheduled jump, so the fractional
+    overshoot carries over and the wrap lands within one sample. The
+    feeder decodes a jump target ahead of time into ``jump_buffer``.
+    """
+    def __init__(self, sample_rate=SAMPLE_RATE, ahead_seconds=10.0, history_seconds=5.0):
+        self.sample_rate = sample_rate
+        self.ahead = int(ahead_seconds * sample_rate)
+        self.refill = self.ahead // 2
+        self.history = int(history_seconds * sample_rate)
+        self.ring = RingBuffer(self.ahead + self.history)
+        self.commands = deque()
+
+        # Owned by the audio thread; other threads only read them
+        self.decoder = None
+        self.position = 0.0 # Playhead in source frames
+        self.playing = False
+        self.gain = 1.0
+        self.cue_point = 0
+        self.underruns = 0
+        self.error = None # Last decode error, for the UI to show
+        self.rate = 1.0 # Playback speed; pitch or the master clock sets it
+        self.pitch_rate = 1.0 # Speed chosen with the pitch control
+        self.synced = False
+        self.snap_phase = False # Jump into phase on the next clock update
+        self.track_bpm = 0.0 # From the analyzed beatgrid; 0 until known
+        self.first_beat = 0.0
+        self.loop = None # (start, end) in source frames while a loop is active
+        self.pending_jump = None # (at, target): at None means as soon as prefetched
+        self.jump_buffer = (None, 0, None) # (decoder, first frame, frames), feeder-filled
+
+        # Set by load() so the feeder can start decoding before the audio
+        # thread picks up the load command
+        self.incoming = None
+        # (decoder, frame count), published by the feeder thread
+        self.track_length = (None, None)
+
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._feeder = threading.Thread(target=self._feed, name="deck-feeder", daemon=True)
+        self._feeder.start()
+
+    # Tk thread API: queue commands only
+    def load(self, path):
+        decoder = open_decoder(path, self.sample_rate)
+        self.incoming = decoder
+        self.commands.append(("load", decoder))
+        self._wake.set()
+
+    def play(self):
+        self.commands.append(("play",))
+
+    def pause(self):
+        self.commands.append(("pause",))
+
+    def cue(self):
+        """Serato CUE: stop and return to the cue point"""
+        self.commands.append(("cue",))
+
+    def seek(self, seconds):
+        self.commands.append(("seek", int(seconds * self.sample_rate)))
+        self._wake.set()
+
+    def skip(self, seconds):
+        self.commands.append(("skip", int(seconds * self.sample_rate)))
+        self._wake.set()
+
+    def set_gain(self, gain):
+        self.commands.append(("gain", gain))
+
+    def set_pitch(self, percent):
+        """Manual tempo change; also turns SYNC off"""
+        self.commands.append(("pitch", 1.0 + percent / 100.0))
+
+    def set_sync(self, enabled):
+        self.commands.append(("sync", enabled))
+
+    def set_beatgrid(self, bpm, first_beat):
+        self.commands.append(("beatgrid", bpm or 0.0, first_beat or 0.0))
+
+    def set_loop(self, beats):
+        """Loop `beats` beats from the current beat (or beat fraction)"""
+        self.commands.append(("loop", beats))
+
+    def exit_loop(self):
+        self.commands.append(("exit_loop",))
+
+    def jump(self, frame, quantize=True):
+        """Jump to frame; while playing with a beatgrid and quantize on, at the next beat"""
+        self.commands.append(("jump", frame, quantize))
+        self._wake.set()
+
+    @property
+    def seconds(self):
+        return self.position / self.sample_rate
+
+    @property
+    def bpm(self):
+        """Tempo as heard, including pitch and sync"""
+        return self.track_bpm * self.rate
+
+    def beats(self):
+        """Beats since the first beat of the grid at the playhead"""
+        return (self.position / self.sample_rate - self.first_beat) * self.track_bpm / 60.0
+
+    @property
+    def track_frames(self):
+        decoder, frames = self.track_length
+        return frames if decoder is self.decoder else None
+
+    @property
+    def duration(self):
+        return (self.track_frames or 0) / self.sample_rate
+
+    def wait_buffered(self, seconds=1.0, timeout=10.0):
+        """Block until the loaded track is buffered ahead (offline rendering)"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            decoder, frames = self.track_length
+            owner, first, end = self.ring.window
+            if (decoder is self.incoming and owner is decoder
+                    and end >= min(int(seconds * self.sample_rate), frames)):
+                return True
+            time.sleep(0.005)
+        return False
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+        self._feeder.join(1.0)
+
+    # Audio thread
+    def apply_commands(self):
+        while self.commands:
+            command = self.commands.popleft()
+            name = command[0]
+            if name == "load":
+                self.decoder = command[1]
+                self.position = 0.0
+                self.cue_point = 0
+                self.playing = False
+                self.track_bpm = self.first_beat = 0.0
+                self.loop = self.pending_jump = None
+            elif name == "play":
+                self.playing = self.decoder is not None
+                self.snap_phase = self.synced
+            elif name == "pause":
+                self.playing = False
+            elif name == "cue":
+                self.playing = False
+                self.move_to(self.cue_point)
+            elif name == "seek":
+                self.move_to(max(command[1], 0))
+            elif name == "skip":
+                self.move_to(max(self.position + command[1], 0))
+            elif name == "gain":
+                self.gain = command[1]
+            elif name == "pitch":
+                self.synced = False
+                self.rate = self.pitch_rate = command[1]
+            elif name == "sync":
+                self.synced = command[1]
+                if self.synced:
+                    self.snap_phase = not self.playing
+                else:
+                    # Keep the synced tempo, like letting go of a platter
+                    self.pitch_rate = self.rate
+            elif name == "beatgrid":
+                self.track_bpm, self.first_beat = command[1], command[2]
+            elif name == "loop":
+                self.start_loop(command[1])
+            elif name == "exit_loop":
+                self.loop = None
+            elif name == "jump":
+                frame, quantize = command[1], command[2]
+                if not self.playing:
+                    self.move_to(frame)
+                elif quantize and self.track_bpm:
+                    at = snap(self.position, self.track_bpm, self.first_beat,
+                              self.sample_rate, rounding=math.ceil)
+                    self.pending_jump = (at, frame)
+                else:
+                    self.pending_jump = (None, frame)
+
+    def move_to(self, frame):
+        """Put the playhead at frame; leaving an active loop turns it off"""
+        self.position = frame
+        self.pending_jump = None
+        if self.loop and not self.loop[0] <= frame < self.loop[1]:
+            self.loop = None
+
+    def start_loop(self, beats):
+        if not self.track_bpm:
+            return # Loops need a beatgrid
+        length = beat_frames(self.track_bpm, self.sample_rate) * beats
+        # Start on the grid line at or before the playhead, so nothing jumps now
+        start = snap(self.position, self.track_bpm, self.first_beat, self.sample_rate,
+                     min(beats, 1.0), math.floor)
+        self.loop = (start, start + length)
+
+    def next_wrap(self):
+        """(source frame the playhead wraps at, where it goes, is a jump), or None"""
+        wraps = []
+        if self.pending_jump is not None:
+            at, target = self.pending_jump
+            owner, first, data = self.jump_buffer
+            if at is not None:
+                wraps.append((at, target, True))
+            elif owner is self.decoder and first == max(int(target) - 2, 0):
+                # Unquantized jumps wait until the target is prefetched
+                wraps.append((self.position, target, True))
+        if self.loop is not None:
+            wraps.append((self.loop[1], self.loop[0], False))
+        return min(wraps) if wraps else None
+
+    def render_into(self, out):
+        """Mix this deck's next block into out (audio thread)"""
+        self.apply_commands()
+        if not self.playing:
+            return
+        frames = len(out)
+        track_frames = self.track_frames
+        if track_frames is not None and self.position >= track_frames:
+            self.playing = False
+            return
+        done = 0
+        while done < frames:
+            count = frames - done
+            wrap = self.next_wrap()
+            if wrap is not None:
+                at, target, is_jump = wrap
+                if self.position >= at:
+                    # Carry the fractional overshoot past the wrap point over
+                    overshoot = self.position - at
+                    if is_jump:
+                        self.move_to(target)
+                    self.position = target + overshoot
+                    continue
+                # Output frames before the playhead reaches the wrap point
+                count = min(count, math.ceil((at - self.position) / self.rate))
+            block = self.read_block(count)
+            if block is None:
+                # Data not decoded yet: play silence and hold position
+                self.underruns += 1
+                if PROFILER.enabled:
+                    PROFILER.count("underruns")
+                self.snap_phase = self.synced # Silent, so it may jump back into phase
+                break
+            if self.gain != 1.0:
+                block *= self.gain
+            out[done:done + count] += block
+            self.position += count * self.rate
+            done += count
+        # Let the feeder sleep until half its lead is used, so it decodes in
+        # large chunks instead of taking the GIL once per block
+        owner, first, end = self.ring.window
+        if done < frames or self.pending_jump or end - self.position < self.refill:
+            self._wake.set()
+
+    def read_block(self, frames):
+        """The next frames output frames at the current rate, or None if not buffered"""
+        position, rate = self.position, self.rate
+        if rate == 1.0 and position == int(position):
+            block = np.zeros((frames, CHANNELS), dtype=np.float32)
+            return block if self.read_source(block, int(position)) else None
+        # Source span the interpolator touches: one frame before, two after
+        start = int(position) - 1
+        source = np.zeros((int((frames - 1) * rate) + 5, CHANNELS), dtype=np.float32)
+        skip = max(-start, 0)
+        if not self.read_source(source[skip:], start + skip):
+            return None
+        return resample_block(source, position - start, rate, frames)
+
+    def read_source(self, out, start):
+        """Add source frames from start into out, from the ring or the jump prefetch"""
+        if self.ring.read_into(out, self.decoder, start):
+            return True
+        owner, first, data = self.jump_buffer
+        if owner is not self.decoder or start < first or start + len(out) > first + len(data):
+            return False
+        out += data[start - first:start - first + len(out)]
+        return True
+
+    # Feeder thread
+    def _feed(self):
+        decoder = None
+        chunk = BLOCK_SIZE * 64
+        while not self._stop.is_set():
+            if self.incoming is not decoder:
+                # Only this thread reads decoders, so the old one can go now
+                if decoder is not None:
+                    decoder.close()
+                decoder = self.incoming
+                self.ring.reset(decoder, 0)
+                self.error = None
+                try:
+                    self.track_length = (decoder, decoder.frames)
+                except (AudioDecodeError, OSError) as exc:
+                    # An empty track: the audio thread stops it straight away
+                    self.error = str(exc)
+                    self.track_length = (decoder, 0)
+            if decoder is None:
+                self._wait()
+                continue
+            # Until the audio thread applies the load command, prefetch from the start
+            current = self.decoder is decoder
+            position = int(self.position) if current else 0
+            jump, loop = (self.pending_jump, self.loop) if current else (None, None)
+            try:
+                if jump is not None:
+                    self._prefetch_jump(decoder, jump[1])
+            except (AudioDecodeError, OSError) as exc:
+                self.error = str(exc)
+            owner, first, end = self.ring.window
+            if not first <= position <= end:
+                # Jumped outside the buffered window; keep the frame before the
+                # playhead for the resampler
+                end = max(position - 2, 0)
+                self.ring.reset(decoder, end)
+            target = min(position + self.ahead, self.track_length[1] + TAIL_FRAMES)
+            keep_from = position - self.history
+            if loop is not None:
+                # Hold the whole loop so every wrap finds its start buffered
+                keep_from = min(keep_from, int(loop[0]) - 2)
+                target = min(target, int(loop[1]) + chunk)
+            if end < target:
+                count = min(target - end, chunk)
+                try:
+                    with PROFILER.span("decode", "audio"):
+                        block = decoder.read(end, count)
+                    self.ring.write(block, keep_from)
+                except (AudioDecodeError, OSError) as exc:
+                    # Treat the track as ending here rather than retrying forever
+                    self.error = str(exc)
+                    self.track_length = (decoder, end)
+                continue
+            self._wait()
+        if decoder is not None:
+            decoder.close()
+
+    def _prefetch_jump(self, decoder, target):
+        first = max(int(target) - 2, 0)
+        owner, start, data = self.jump_buffer
+        if owner is not decoder or start != first:
+            self.jump_buffer = (decoder, first, decoder.read(first, JUMP_PREFETCH))
+
+    def _wait(self):
+        self._wake.wait(0.05)
+        self._wake.clear()
+
+
+class Mixer:
+    """Sums every deck into one output block; Mixer.render is the audio callback"""
+    def __init__(self, sample_rate=SAMPLE_RATE, block_size=BLOCK_SIZE):
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        self.decks = []
+        self.master_gain = 1.0
+        self.latency = LatencyHistogram()
+        self.clock = MasterClock(sample_rate)
+
+    def add_deck(self, **options):
+        deck = DeckPlayer(self.sample_rate, **options)
+        self.decks.append(deck)
+        return deck
+
+    def render(self, frames=None):
+        started = time.perf_counter()
+        out = np.zeros((frames or self.block_size, CHANNELS), dtype=np.float32)
+        for deck in self.decks:
+            deck.apply_commands()
+        self.clock.update(self.decks, len(out))
+        for deck in self.decks:
+            deck.render_into(out)
+        if self.master_gain != 1.0:
+            out *= self.master_gain
+        np.clip(out, -1.0, 1.0, out=out)
+        elapsed = time.perf_counter() - started
+        self.latency.add(elapsed)
+        if PROFILER.enabled:
+            PROFILER.record("audio.render", "audio", started, elapsed)
+        return out
+
+    @property
+    def underruns(self):
+        return sum(deck.underruns for deck in self.decks)
+
+    def stats(self):
+        stats = self.latency.summary()
+        stats["underruns"] = self.underruns
+        return stats
+
+    def close(self):
+        for deck in self.decks:
+            deck.close()
+
+
+class NullSink:
+    """Pulls blocks from the mixer on its own thread and discards them
+
+    With realtime=True blocks are paced like a sound card would pull them and
+    late wake-ups are counted in ``xruns``; otherwise it runs flat out, which
+    is what benchmarks want. Subclasses override consume().
+    """
+    def __init__(self, mixer, realtime=True):
+        self.mixer = mixer
+        self.realtime = realtime
+        self.xruns = 0
+        self.blocks = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="audio-out", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def run_blocks(self, count):
+        """Render count blocks synchronously on the calling thread"""
+        for _ in range(count):
+            self.consume(self.mixer.render())
+            self.blocks += 1
+
+    def consume(self, block):
+        pass
+
+    def _run(self):
+        period = self.mixer.block_size / self.mixer.sample_rate
+        deadline = time.perf_counter()
+        while not self._stop.is_set():
+            self.consume(self.mixer.render())
+            self.blocks += 1
+            if not self.realtime:
+                continue
+            deadline += period
+            delay = deadline - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -period:
+                # More than a block late: a real device would have glitched
+                self.xruns += 1
+                deadline = time.perf_counter()
+
+
+class WavFileSink(NullSink):
+    """Writes the mixer output to a 16-bit WAV file (headless runs and CI)"""
+    def __init__(self, mixer, path, realtime=False):
+        super().__init__(mixer, realtime)
+        self.wav = wave.open(path, "wb")
+        self.wav.setnchannels(CHANNELS)
+        self.wav.setsampwidth(2)
+        self.wav.setframerate(mixer.sample_rate)
+
+    def consume(self, block):
+        self.wav.writeframes((block * 32767).astype("<i2").tobytes())
+
+    def stop(self):
+        super().stop()
+        self.wav.close()
+
+
+class SoundDeviceSink:
+    """Plays through the sound card via the optional sounddevice package"""
+    def __init__(self, mixer):
+        import sounddevice
+        self.mixer = mixer
+        self.xruns = 0
+        self.stream = sounddevice.OutputStream(
+            samplerate=mixer.sample_rate, blocksize=mixer.block_size,
+            channels=CHANNELS, dtype="float32", callback=self._callback)
+
+    def _callback(self, outdata, frames, time_info, status):
+        if status.output_underflow:
+            self.xruns += 1
+        outdata[:] = self.mixer.render(frames)
+
+    def start(self):
+        self.stream.start()
+
+    def stop(self):
+        self.stream.stop()
+        self.stream.close()
+
+
+def open_sink(mixer, kind="auto", path=None):
+    """Create an output sink: "device", "null", "wav" or "auto" (device if available)"""
+    if kind == "wav":
+        return WavFileSink(mixer, path)
+    if kind in ("device", "auto"):
+        try:
+            return SoundDeviceSink(mixer)
+        except Exception:
+            if kind == "device":
+                raise
+    return NullSink(mixer)
+
+
+def format_time(seconds):
+    """mm:ss.t as shown on the deck displays"""
+    tenths = int(round(max(seconds, 0.0) * 10))
+    minutes, tenths = divmod(tenths, 600)
+    return f"{minutes:02d}:{tenths // 10:02d}.{tenths % 10}"
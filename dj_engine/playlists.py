@@ -0,0 +1,473 @@
+"""Streaming playlist readers and writers: M3U/M3U8, PLS, Serato crates, Rekordbox XML
+
+Readers are generators of entry dicts with a "path" and whatever else the
+format carries ("title", "artist", "album", "duration", "bpm", "key"), so a
+100k-entry export is never held in memory. Writers take an iterable of the
+same dicts and write as they go.
+
+Entries are matched to library tracks in bulk by PathResolver, which looks
+paths up in the LibraryIndex rather than stat()ing each one.
+"""
+import os
+import queue
+import re
+import struct
+import threading
+import xml.etree.ElementTree as ET
+from urllib.parse import quote, unquote
+
+PLAYLIST_EXTENSIONS = (".m3u", ".m3u8", ".pls", ".crate", ".xml")
+SERATO_VERSION = "1.0/Serato ScratchLive Crate"
+SERATO_COLUMNS = ("song", "artist", "bpm", "key")
+WINDOWS_DRIVE = re.compile(r"^/?([A-Za-z]:[\\/])")
+FILE_URL = re.compile(r"^file:(//(localhost)?)?")
+XML_ATTRIBUTE = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;",
+                              "\n": "&#10;", "\r": "&#13;", "\t": "&#9;"})
+PLS_KEY = re.compile(r"^(File|Title|Length)(\d+)$", re.IGNORECASE)
+
+
+class PlaylistError(Exception):
+    """Raised for files that are not the playlist format they claim to be"""
+
+
+def read_playlist(path, **options):
+    """Entries of any supported playlist, picked by extension"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".m3u", ".m3u8"):
+        return read_m3u(path)
+    if ext == ".pls":
+        return read_pls(path)
+    if ext == ".crate":
+        return read_serato_crate(path, **options)
+    if ext == ".xml":
+        return read_rekordbox(path, **options)
+    raise PlaylistError(f"Unsupported playlist format: {ext}")
+
+
+def write_playlist(path, entries, name=None):
+    """Write entries in the format picked by path's extension"""
+    ext = os.path.splitext(path)[1].lower()
+    name = name or os.path.splitext(os.path.basename(path))[0]
+    if ext in (".m3u", ".m3u8"):
+        return write_m3u(path, entries)
+    if ext == ".pls":
+        return write_pls(path, entries)
+    if ext == ".crate":
+        return write_serato_crate(path, entries)
+    if ext == ".xml":
+        return write_rekordbox(path, entries, name)
+    raise PlaylistError(f"Unsupported playlist format: {ext}")
+
+
+def _local_path(location, folder):
+    """A playlist location as a local path; relative ones are taken from folder"""
+    if location.startswith("file:"):
+        location = unquote(FILE_URL.sub("", location, 1))
+    drive = WINDOWS_DRIVE.match(location)
+    if drive:
+        return location[drive.start(1):]
+    if os.path.isabs(location):
+        return location
+    return os.path.normpath(os.path.join(folder, location))
+
+
+def _decode_line(raw, utf8):
+    if utf8:
+        return raw.decode("utf-8", errors="replace")
+    try:
+        return raw.decode("utf-8")
+    except UnicodeDecodeError:
+        return raw.decode("cp1252", errors="replace")
+
+
+def _label(text):
+    """{"title", "artist"} from an "Artist - Title" label"""
+    artist, sep, title = text.partition(" - ")
+    return {"title": title, "artist": artist} if sep else {"title": text, "artist": None}
+
+
+def read_m3u(path):
+    """Entries of an M3U/M3U8 playlist, with #EXTINF duration and "Artist - Title" if present"""
+    folder = os.path.dirname(os.path.abspath(path))
+    utf8 = path.lower().endswith(".m3u8")
+    info = {}
+    with open(path, "rb") as f:
+        for raw in f:
+            line = _decode_line(raw, utf8).lstrip("\ufeff").strip()
+            if not line:
+                continue
+            if line.startswith("#EXTINF:"):
+                duration, _, label = line[8:].partition(",")
+                info = _label(label)
+                try:
+                    info["duration"] = max(float(duration.split()[0]), 0) or None
+                except (ValueError, IndexError):
+                    pass
+            elif not line.startswith("#"):
+                yield dict(info, path=_local_path(line, folder))
+                info = {}
+
+
+def write_m3u(path, entries):
+    """Extended M3U, always UTF-8; returns the number of entries written"""
+    count = 0
+    with open(path, "w", encoding="utf-8", newline="\n") as f:
+        f.write("#EXTM3U\n")
+        for entry in entries:
+            label = " - ".join(filter(None, (entry.get("artist"), entry.get("title"))))
+            duration = entry.get("duration")
+            f.write(f"#EXTINF:{int(round(duration)) if duration else -1},"
+                    f"{label or os.path.basename(entry['path'])}\n{entry['path']}\n")
+            count += 1
+    return count
+
+
+def read_pls(path):
+    """Entries of a PLS playlist
+
+    An entry is complete once a line for the next index turns up, so only
+    one entry is held at a time for the usual File1, Title1, Length1, File2...
+    order.
+    """
+    folder = os.path.dirname(os.path.abspath(path))
+    current, entry = None, {}
+    with open(path, "rb") as f:
+        for raw in f:
+            key, sep, value = _decode_line(raw, False).strip().partition("=")
+            match = PLS_KEY.match(key) if sep else None
+            if not match:
+                continue
+            field, index = match.group(1).lower(), int(match.group(2))
+            if index != current:
+                if entry.get("path"):
+                    yield entry
+                current, entry = index, {}
+            if field == "file":
+                entry["path"] = _local_path(value, folder)
+            elif field == "title":
+                entry.update(_label(value))
+            else:
+                try:
+                    entry["duration"] = max(float(value), 0) or None
+                except ValueError:
+                    pass
+    if entry.get("path"):
+        yield entry
+
+
+def write_pls(path, entries):
+    count = 0
+    with open(path, "w", encoding="utf-8", newline="\n") as f:
+        f.write("[playlist]\n")
+        for count, entry in enumerate(entries, 1):
+            f.write(f"File{count}={entry['path']}\n")
+            title = " - ".join(filter(None, (entry.get("artist"), entry.get("title"))))
+            if title:
+                f.write(f"Title{count}={title}\n")
+            duration = entry.get("duration")
+            f.write(f"Length{count}={int(round(duration)) if duration else -1}\n")
+        f.write(f"NumberOfEntries={count}\nVersion=2\n")
+    return count
+
+
+def _serato_chunk(tag, payload):
+    return tag + struct.pack(">I", len(payload)) + payload
+
+
+def _serato_text(text):
+    return text.encode("utf-16-be")
+
+
+def read_serato_crate(path, root=os.sep):
+    """Entries of a Serato .crate file
+
+    Crates are a flat run of (4-byte tag, big-endian length, payload)
+    chunks; each track is an "otrk" chunk holding a "ptrk" chunk with the
+    path in UTF-16 relative to the drive's root, which is given as root.
+    Other chunks are skipped without being read.
+    """
+    with open(path, "rb") as f:
+        header = f.read(8)
+        if len(header) < 8 or header[:4] != b"vrsn":
+            raise PlaylistError(f"{os.path.basename(path)} is not a Serato crate")
+        f.seek(struct.unpack(">I", header[4:])[0], os.SEEK_CUR)
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                break
+            tag, length = header[:4], struct.unpack(">I", header[4:])[0]
+            if tag != b"otrk":
+                f.seek(length, os.SEEK_CUR)
+                continue
+            payload = f.read(length)
+            pos = 0
+            while pos + 8 <= len(payload):
+                inner = struct.unpack(">I", payload[pos + 4:pos + 8])[0]
+                if payload[pos:pos + 4] == b"ptrk":
+                    location = payload[pos + 8:pos + 8 + inner].decode("utf-16-be", errors="replace")
+                    yield {"path": _local_path(location, root)}
+                    break
+                pos += 8 + inner
+
+
+def write_serato_crate(path, entries, root=os.sep):
+    """Serato crate with paths relative to root (the drive the tracks live on)"""
+    count = 0
+    with open(path, "wb") as f:
+        f.write(_serato_chunk(b"vrsn", _serato_text(SERATO_VERSION)))
+        f.write(_serato_chunk(b"osrt", _serato_chunk(b"tvcn", _serato_text("song"))
+                              + _serato_chunk(b"brev", b"\x00")))
+        for column in SERATO_COLUMNS:
+            f.write(_serato_chunk(b"ovct", _serato_chunk(b"tvcn", _serato_text(column))
+                                  + _serato_chunk(b"tvcw", _serato_text("0"))))
+        for entry in entries:
+            location = entry["path"]
+            location = location[len(root):] if location.startswith(root) \
+                else os.path.relpath(os.path.abspath(location), root)
+            location = location.replace(os.sep, "/")
+            f.write(_serato_chunk(b"otrk", _serato_chunk(b"ptrk", _serato_text(location))))
+            count += 1
+    return count
+
+
+def _rekordbox_entry(attrib):
+    entry = {"path": _local_path(attrib["Location"], os.sep),
+             "title": attrib.get("Name") or None, "artist": attrib.get("Artist") or None,
+             "album": attrib.get("Album") or None, "key": attrib.get("Tonality") or None}
+    for name, field in (("duration", "TotalTime"), ("bpm", "AverageBpm")):
+        try:
+            entry[name] = float(attrib[field]) or None
+        except (KeyError, ValueError):
+            entry[name] = None
+    return entry
+
+
+def read_rekordbox(path, playlist=None):
+    """Entries of a Rekordbox XML collection, or of one of its playlists
+
+    Parsed with iterparse, dropping every element once it has been read, so
+    memory stays flat however big the collection is. A playlist is named
+    by its path of folder names, e.g. "Sets/Friday"; its tracks refer to
+    collection TrackIDs, so reading one keeps an id -> entry map.
+    """
+    stack, folders = [], []
+    by_id = {} if playlist is not None else None
+    found = False
+    for event, elem in ET.iterparse(path, events=("start", "end")):
+        if event == "start":
+            if elem.tag == "NODE" and stack and stack[-1].tag in ("NODE", "PLAYLISTS"):
+                folders.append(elem.get("Name", ""))
+            stack.append(elem)
+            continue
+        stack.pop()
+        parent = stack[-1] if stack else None
+        if elem.tag == "TRACK" and parent is not None and parent.tag == "COLLECTION":
+            if elem.get("Location"):
+                if by_id is None:
+                    yield _rekordbox_entry(elem.attrib)
+                else:
+                    by_id[elem.get("TrackID")] = _rekordbox_entry(elem.attrib)
+        elif elem.tag == "TRACK" and parent is not None and parent.tag == "NODE":
+            if by_id is not None and "/".join(folders[1:]) == playlist:
+                found = True
+                key = elem.get("Key")
+                entry = by_id.get(key) if elem.get("KeyType", parent.get("KeyType")) != "1" \
+                    else {"path": _local_path(key, os.sep)}
+                if entry:
+                    yield entry
+        elif elem.tag == "NODE" and folders:
+            folders.pop()
+        if parent is not None:
+            parent.remove(elem)
+    if playlist is not None and not found:
+        raise PlaylistError(f"No playlist {playlist!r} in {os.path.basename(path)}")
+
+
+def rekordbox_playlists(path):
+    """Playlist names ("Folder/Playlist") in a Rekordbox XML file"""
+    names, folders, stack = [], [], []
+    for event, elem in ET.iterparse(path, events=("start", "end")):
+        if event == "start":
+            if elem.tag == "NODE" and stack and stack[-1].tag in ("NODE", "PLAYLISTS"):
+                folders.append(elem.get("Name", ""))
+                if elem.get("Type") == "1":
+                    names.append("/".join(folders[1:]))
+            stack.append(elem)
+            continue
+        stack.pop()
+        if elem.tag == "NODE" and folders:
+            folders.pop()
+        if stack:
+            stack[-1].remove(elem)
+    return names
+
+
+def _location(path):
+    if not os.path.isabs(path):
+        path = os.path.abspath(path)
+    path = path.replace(os.sep, "/")
+    if not path.startswith("/"):
+        path = "/" + path # Windows drive letter
+    return "file://localhost" + quote(path, safe="/:")
+
+
+def write_rekordbox(path, entries, name="music-analyzer-dj"):
+    """Rekordbox XML with every entry in the collection and one playlist of them all
+
+    The collection's Entries count comes first in the file, so entries must
+    be a sequence here rather than a one-shot iterator.
+    """
+    with open(path, "w", encoding="utf-8", newline="\n") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<DJ_PLAYLISTS Version="1.0.0">\n'
+                '  <PRODUCT Name="music-analyzer-dj" Version="1.0" Company=""/>\n'
+                f'  <COLLECTION Entries="{len(entries)}">\n')
+        for track_id, entry in enumerate(entries, 1):
+            attrib = {"TrackID": track_id, "Name": entry.get("title"),
+                      "Artist": entry.get("artist"), "Album": entry.get("album"),
+                      "TotalTime": int(round(entry["duration"])) if entry.get("duration") else None,
+                      "AverageBpm": f"{entry['bpm']:.2f}" if entry.get("bpm") else None,
+                      "Tonality": entry.get("key"), "Location": _location(entry["path"])}
+            f.write("    <TRACK " + " ".join(f'{k}="{str(v).translate(XML_ATTRIBUTE)}"'
+                                             for k, v in attrib.items() if v is not None) + "/>\n")
+        f.write("  </COLLECTION>\n  <PLAYLISTS>\n"
+                '    <NODE Type="0" Name="ROOT" Count="1">\n'
+                f'      <NODE Name="{name.translate(XML_ATTRIBUTE)}" Type="1" KeyType="0" '
+                f'Entries="{len(entries)}">\n')
+        for track_id in range(1, len(entries) + 1):
+            f.write(f'        <TRACK Key="{track_id}"/>\n')
+        f.write("      </NODE>\n    </NODE>\n  </PLAYLISTS>\n</DJ_PLAYLISTS>\n")
+    return len(entries)
+
+
+class PlaylistWorker:
+    """Reads and writes playlist files off the Tk thread
+
+    Events arrive in ``events`` as ("read", path, [track paths], playlist),
+    ("playlists", path, [names]), ("written", path, count) or ("error",
+    path, message), to be drained from the Tk main loop. Path resolution is
+    left to the caller, since the library belongs to the Tk thread.
+    """
+    def __init__(self):
+        self.events = queue.Queue()
+        self._threads = []
+
+    @property
+    def running(self):
+        self._threads = [thread for thread in self._threads if thread.is_alive()]
+        return bool(self._threads)
+
+    def read(self, path, **options):
+        self._start(self._read, path, options)
+
+    def write(self, path, entries, name=None):
+        self._start(self._write, path, entries, name)
+
+    def list_playlists(self, path):
+        """Names of the playlists in a Rekordbox XML file, for picking one to read"""
+        self._start(self._list, path)
+
+    def drain(self, limit=100):
+        events = []
+        try:
+            while len(events) < limit:
+                events.append(self.events.get_nowait())
+        except queue.Empty:
+            pass
+        return events
+
+    def _start(self, target, *args):
+        thread = threading.Thread(target=target, args=args, name="playlist-io", daemon=True)
+        self._threads.append(thread)
+        thread.start()
+
+    def _read(self, path, options):
+        try:
+            paths = [entry["path"] for entry in read_playlist(path, **options)]
+        except Exception as exc:
+            self.events.put(("error", path, str(exc)))
+            return
+        self.events.put(("read", path, paths, options.get("playlist")))
+
+    def _list(self, path):
+        try:
+            names = rekordbox_playlists(path)
+        except Exception as exc:
+            self.events.put(("error", path, str(exc)))
+            return
+        self.events.put(("playlists", path, names))
+
+    def _write(self, path, entries, name):
+        try:
+            count = write_playlist(path, entries, name)
+        except Exception as exc:
+            # A bad entry must still end in an event, or the UI waits on "Exporting..." forever
+            self.events.put(("error", path, str(exc)))
+            return
+        self.events.put(("written", path, count))
+
+
+class PathResolver:
+    """Matches playlist paths to LibraryIndex track ids in bulk, without touching the disk
+
+    An exact path is a dict lookup. Paths that miss are retried with
+    separators and case normalized, then by file name, preferring the
+    library track that shares the most trailing folders, so a playlist
+    made on another machine or drive letter still finds its tracks. The
+    fallback tables are built on the first miss and kept until the
+    library changes.
+    """
+    def __init__(self, library):
+        self.library = library
+        self._version = None
+        self._normalized = {}
+        self._by_name = {}
+
+    def resolve(self, paths):
+        """Track ids aligned with paths; None where the library has no match"""
+        ids = self.library.ids
+        resolved = [ids.get(path) for path in paths]
+        misses = [i for i, track_id in enumerate(resolved) if track_id is None]
+        if misses:
+            self._build()
+            for i in misses:
+                resolved[i] = self._fallback(paths[i])
+        return resolved
+
+    def _build(self):
+        if self._version == self.library.version:
+            return
+        self._version = self.library.version
+        self._normalized, self._by_name = {}, {}
+        for path, track_id in self.library.ids.items():
+            key = _normalize(path)
+            self._normalized.setdefault(key, track_id)
+            self._by_name.setdefault(key.rsplit("/", 1)[-1], []).append((key, track_id))
+
+    def _fallback(self, path):
+        key = _normalize(path)
+        track_id = self._normalized.get(key)
+        if track_id is not None:
+            return track_id
+        candidates = self._by_name.get(key.rsplit("/", 1)[-1])
+        if not candidates:
+            return None
+        if len(candidates) == 1:
+            return candidates[0][1]
+        parts = key.split("/")
+        scored = sorted(((_shared_tail(parts, other.split("/")), track_id)
+                         for other, track_id in candidates), reverse=True)
+        # Only take a file name match when one candidate is the closest
+        return scored[0][1] if scored[0][0] > scored[1][0] else None
+
+
+def _normalize(path):
+    return path.replace("\\", "/").casefold()
+
+
+def _shared_tail(a, b):
+    count = 0
+    for x, y in zip(reversed(a), reversed(b)):
+        if x != y:
+            break
+        count += 1
+    return count
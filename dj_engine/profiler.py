@@ -0,0 +1,212 @@
+"""Timers and counters around the hot paths, exportable as a Chrome trace
+
+One process-wide PROFILER, off by default. Instrumented code either wraps
+a function with @PROFILER.timed(...), uses ``with PROFILER.span(...)``, or
+times itself and calls PROFILER.record() when PROFILER.enabled is set.
+Disabled, a timed call costs one attribute check and span() hands back a
+shared do-nothing context manager, so the audio thread pays nothing.
+
+Enabled, every span goes into a bounded deque (appends are atomic under the
+GIL, so any thread may record without a lock) and into per-name totals.
+export_chrome_trace() writes the deque in the Trace Event Format that
+chrome://tracing and Perfetto open.
+"""
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+MAX_EVENTS = 200000 # About an hour of audio callbacks plus UI spans
+FRAME_BUDGET = 1 / 60
+
+
+class LatencyHistogram:
+    """Power-of-two histogram of durations in microseconds"""
+    BUCKETS = 16  # 1us .. 32ms, last bucket catches everything slower
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.total = 0
+        self.worst = 0.0
+
+    def add(self, seconds):
+        micros = seconds * 1e6
+        bucket = min(max(int(micros).bit_length() - 1, 0), self.BUCKETS - 1)
+        self.counts[bucket] += 1
+        self.total += 1
+        if seconds > self.worst:
+            self.worst = seconds
+
+    def percentile(self, fraction):
+        """Upper bound (seconds) of the bucket holding the given fraction of calls"""
+        if not self.total:
+            return 0.0
+        needed = fraction * self.total
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= needed:
+                return (1 << (bucket + 1)) / 1e6
+        return self.worst
+
+    def summary(self):
+        return {
+            "calls": self.total,
+            "p50_ms": self.percentile(0.5) * 1e3,
+            "p99_ms": self.percentile(0.99) * 1e3,
+            "worst_ms": self.worst * 1e3,
+            "buckets_us": {1 << b: c for b, c in enumerate(self.counts) if c},
+        }
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("profiler", "name", "category", "started")
+
+    def __init__(self, profiler, name, category):
+        self.profiler = profiler
+        self.name = name
+        self.category = category
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, self.category, self.started,
+                             time.perf_counter() - self.started)
+        return False
+
+
+class Profiler:
+    """Spans (name, category, start, duration, thread) and named counters"""
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        # ("X", name, category, start, duration, tid) spans and ("C", name, value, time) counters
+        self.events = deque(maxlen=MAX_EVENTS)
+        self.totals = {} # name -> LatencyHistogram of durations
+        self.counters = {} # name -> value
+        self.thread_names = {} # tid -> name, for the trace
+        self.frames = LatencyHistogram() # Intervals between UI frames
+        self.dropped_frames = 0
+        self.last_frame = None
+        self.started = time.perf_counter()
+
+    def enable(self):
+        if not self.enabled:
+            self.reset()
+            self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def span(self, name, category="ui"):
+        """Context manager timing its body; a shared no-op while disabled"""
+        return _Span(self, name, category) if self.enabled else NULL_SPAN
+
+    def timed(self, name, category="ui"):
+        """Decorator timing every call of a function while enabled"""
+        def decorate(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                started = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.record(name, category, started, time.perf_counter() - started)
+            return wrapper
+        return decorate
+
+    def record(self, name, category, started, duration, tid=None, thread_name=None):
+        """Add a finished span; started is a time.perf_counter() value
+
+        tid defaults to the calling thread; spans timed in another process
+        pass its pid (perf_counter is system-wide) and a thread_name.
+        """
+        if tid is None:
+            tid = threading.get_ident()
+        if tid not in self.thread_names:
+            self.thread_names[tid] = thread_name or threading.current_thread().name
+        self.events.append(("X", name, category, started, duration, tid))
+        histogram = self.totals.get(name)
+        if histogram is None:
+            histogram = self.totals.setdefault(name, LatencyHistogram())
+        histogram.add(duration)
+
+    def count(self, name, value=1):
+        """Add to a counter, logging its new value for the trace"""
+        total = self.counters[name] = self.counters.get(name, 0) + value
+        self.events.append(("C", name, total, time.perf_counter()))
+
+    def gauge(self, name, value):
+        """Set a counter to a sampled value such as a queue depth"""
+        self.counters[name] = value
+        self.events.append(("C", name, value, time.perf_counter()))
+
+    def frame(self):
+        """Mark one UI frame; a gap of two budgets or more counts as a dropped frame"""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        if self.last_frame is not None:
+            interval = now - self.last_frame
+            self.frames.add(interval)
+            if interval >= 2 * FRAME_BUDGET:
+                self.dropped_frames += int(interval / FRAME_BUDGET) - 1
+            self.events.append(("C", "frame_ms", round(interval * 1e3, 2), now))
+        self.last_frame = now
+
+    def stats(self):
+        """{name: summary} for every span name, plus frame stats and counters"""
+        spans = {}
+        for name, histogram in list(self.totals.items()):
+            summary = histogram.summary()
+            summary.pop("buckets_us")
+            spans[name] = summary
+        frames = self.frames.summary()
+        frames.pop("buckets_us")
+        frames["dropped"] = self.dropped_frames
+        return {"spans": spans, "frames": frames, "counters": dict(self.counters)}
+
+    def export_chrome_trace(self, path):
+        """Write the recorded events as Chrome Trace Event Format JSON; returns the event count"""
+        pid = os.getpid()
+        origin = self.started
+        trace = [{"name": "process_name", "ph": "M", "pid": pid, "tid": 0,
+                  "args": {"name": "music-analyzer-dj"}}]
+        trace.extend({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                      "args": {"name": name}} for tid, name in list(self.thread_names.items()))
+        for event in list(self.events):
+            if event[0] == "X":
+                _, name, category, started, duration, tid = event
+                trace.append({"name": name, "cat": category, "ph": "X", "pid": pid, "tid": tid,
+                              "ts": round((started - origin) * 1e6, 1),
+                              "dur": round(duration * 1e6, 1)})
+            else:
+                _, name, value, when = event
+                trace.append({"name": name, "ph": "C", "pid": pid, "tid": 0,
+                              "ts": round((when - origin) * 1e6, 1), "args": {name: value}})
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms",
+                       "otherData": self.stats()}, f)
+        return len(trace)
+
+
+PROFILER = Profiler()
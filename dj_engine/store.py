@@ -0,0 +1,269 @@
+"""Persistent analysis store keyed by path, size, mtime and a partial content hash"""
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from .harmonic import to_camelot
+
+HASH_CHUNK = 64 * 1024
+# Bump when analysis results change shape; older rows are then re-analyzed
+STORE_VERSION = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    content_hash TEXT NOT NULL,
+    duration REAL,
+    bpm REAL,
+    key TEXT,
+    loudness REAL,
+    beatgrid TEXT,
+    cues TEXT,
+    waveform BLOB,
+    analyzed_at REAL
+)
+"""
+
+CRATES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS smart_crates (
+    name TEXT PRIMARY KEY,
+    rules TEXT NOT NULL
+)
+"""
+
+PLAYLIST_CRATES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS crate_tracks (
+    crate TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    PRIMARY KEY (crate, position)
+)
+"""
+
+FIELDS = ("path", "size", "mtime_ns", "content_hash", "duration", "bpm", "key",
+          "loudness", "beatgrid", "cues", "waveform", "analyzed_at")
+
+
+def default_store_path():
+    return os.path.join(os.path.expanduser("~"), ".music_analyzer_dj", "analysis.db")
+
+
+def fingerprint(path, stat=None):
+    """Return (size, mtime_ns, hash) for a file
+
+    The hash covers the size plus the first, middle and last 64 KiB, which
+    is enough to tell a re-encoded or retagged file from a merely touched
+    one without reading the whole thing.
+    """
+    stat = stat or os.stat(path)
+    digest = hashlib.blake2b(str(stat.st_size).encode(), digest_size=16)
+    with open(path, "rb") as f:
+        digest.update(f.read(HASH_CHUNK))
+        if stat.st_size > 3 * HASH_CHUNK:
+            f.seek(stat.st_size // 2)
+            digest.update(f.read(HASH_CHUNK))
+        if stat.st_size > 2 * HASH_CHUNK:
+            f.seek(-HASH_CHUNK, os.SEEK_END)
+            digest.update(f.read(HASH_CHUNK))
+    return stat.st_size, stat.st_mtime_ns, digest.hexdigest()
+
+
+class AnalysisStore:
+    """SQLite cache of analysis results (BPM, key, beatgrid, cues, waveform)"""
+    def __init__(self, path=None):
+        self.path = path or default_store_path()
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.db = sqlite3.connect(self.path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(SCHEMA)
+        self.db.execute(CRATES_SCHEMA)
+        self.db.execute(PLAYLIST_CRATES_SCHEMA)
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        if version == 2:
+            # Version 3 stores keys as Camelot codes; nothing else changed
+            rows = self.db.execute("SELECT path, key FROM tracks WHERE key IS NOT NULL")
+            self.db.executemany("UPDATE tracks SET key = ? WHERE path = ?",
+                                [(to_camelot(key), path) for path, key in rows.fetchall()])
+            self.db.execute(f"PRAGMA user_version = {STORE_VERSION}")
+        elif version != STORE_VERSION:
+            # Size -1 never matches a file, so plan() reports every row stale;
+            # cue points survive because re-analysis does not overwrite them
+            self.db.execute("UPDATE tracks SET size = -1")
+            self.db.execute(f"PRAGMA user_version = {STORE_VERSION}")
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def plan(self, paths):
+        """Split paths into (fresh, stale)
+
+        Fresh paths have a stored result for the file as it is on disk.
+        A size/mtime match is trusted outright; on an mtime-only change the
+        partial hash decides, so touched-but-identical files stay cached.
+        Unreadable paths are dropped from both lists.
+        """
+        paths = list(paths)
+        known = {}
+        # Look up just these paths, so planning a scan batch costs the batch, not the store
+        for start in range(0, len(paths), 500):
+            chunk = paths[start:start + 500]
+            known.update((row[0], row[1:]) for row in self.db.execute(
+                "SELECT path, size, mtime_ns, content_hash FROM tracks WHERE path IN (%s)"
+                % ",".join("?" * len(chunk)), chunk))
+        fresh, stale, touched = [], [], []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            row = known.get(path)
+            if row is None or row[0] != stat.st_size:
+                stale.append(path)
+            elif row[1] == stat.st_mtime_ns:
+                fresh.append(path)
+            else:
+                try:
+                    size, mtime_ns, content_hash = fingerprint(path, stat)
+                except OSError:
+                    continue
+                if content_hash == row[2]:
+                    touched.append((mtime_ns, path))
+                    fresh.append(path)
+                else:
+                    stale.append(path)
+        if touched:
+            with self.db:
+                self.db.executemany("UPDATE tracks SET mtime_ns = ? WHERE path = ?", touched)
+        return fresh, stale
+
+    def get(self, path):
+        rows = self.get_many([path])
+        return rows[0] if rows else None
+
+    def get_many(self, paths, waveform=True):
+        """Stored results for paths, in no particular order"""
+        fields = FIELDS if waveform else tuple(f for f in FIELDS if f != "waveform")
+        sql = f"SELECT {', '.join(fields)} FROM tracks WHERE path IN (%s)"
+        results = []
+        paths = list(paths)
+        for start in range(0, len(paths), 500):
+            chunk = paths[start:start + 500]
+            cursor = self.db.execute(sql % ",".join("?" * len(chunk)), chunk)
+            results.extend(self._to_result(fields, row) for row in cursor)
+        return results
+
+    def put_many(self, results):
+        """Insert or replace analysis results in one transaction"""
+        now = time.time()
+        rows = [(
+            result["path"], result["size"], result["mtime_ns"], result["content_hash"],
+            result.get("duration"), result.get("bpm"), result.get("key"),
+            result.get("loudness"), json.dumps(result.get("beatgrid")),
+            json.dumps(result.get("cues") or {}), result.get("waveform"), now,
+        ) for result in results]
+        # Re-analysis replaces everything except the user's cue points
+        updates = ", ".join(f"{name} = excluded.{name}" for name in FIELDS
+                            if name not in ("path", "cues"))
+        with self.db:
+            self.db.executemany(
+                f"INSERT INTO tracks ({', '.join(FIELDS)}) "
+                f"VALUES ({', '.join('?' * len(FIELDS))}) "
+                f"ON CONFLICT(path) DO UPDATE SET {updates}", rows)
+
+    def put(self, result):
+        self.put_many([result])
+
+    def get_cues(self, path):
+        row = self.db.execute("SELECT cues FROM tracks WHERE path = ?", (path,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def set_cues(self, path, cues):
+        with self.db:
+            self.db.execute("UPDATE tracks SET cues = ? WHERE path = ?",
+                            (json.dumps(cues), path))
+
+    def set_beatgrid(self, path, beatgrid):
+        """Replace an analyzed beatgrid (and the BPM it implies) with a hand-set one"""
+        with self.db:
+            self.db.execute("UPDATE tracks SET bpm = ?, beatgrid = ? WHERE path = ?",
+                            (beatgrid["bpm"], json.dumps(beatgrid), path))
+
+    def refresh_fingerprints(self, paths):
+        """Re-fingerprint files whose tags were rewritten, keeping their analysis
+
+        Only call this for changes that leave the audio alone; anything else
+        should go through plan() and be re-analyzed.
+        """
+        rows = []
+        for path in paths:
+            try:
+                rows.append(fingerprint(path) + (path,))
+            except OSError:
+                continue
+        with self.db:
+            self.db.executemany("UPDATE tracks SET size = ?, mtime_ns = ?, content_hash = ? "
+                                "WHERE path = ?", rows)
+
+    def smart_crates(self):
+        """[(name, rules)] for every saved smart crate"""
+        return [(name, json.loads(rules)) for name, rules in
+                self.db.execute("SELECT name, rules FROM smart_crates ORDER BY name")]
+
+    def save_smart_crate(self, name, rules):
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO smart_crates (name, rules) VALUES (?, ?)",
+                            (name, json.dumps(rules)))
+
+    def crates(self):
+        """Names of the saved (non-smart) crates"""
+        return [name for (name,) in
+                self.db.execute("SELECT DISTINCT crate FROM crate_tracks ORDER BY crate")]
+
+    def crate_paths(self, name):
+        return [path for (path,) in self.db.execute(
+            "SELECT path FROM crate_tracks WHERE crate = ? ORDER BY position", (name,))]
+
+    def save_crate(self, name, paths):
+        """Replace a crate's tracks with paths, in order"""
+        with self.db:
+            self.db.execute("DELETE FROM crate_tracks WHERE crate = ?", (name,))
+            self.db.executemany("INSERT INTO crate_tracks (crate, position, path) VALUES (?, ?, ?)",
+                                ((name, position, path) for position, path in enumerate(paths)))
+
+    def prune(self, folder, present):
+        """Drop entries under folder that a fresh scan did not find"""
+        prefix = os.path.join(folder, "")
+        present = set(present)
+        rows = self.db.execute("SELECT path FROM tracks WHERE substr(path, 1, ?) = ?",
+                               (len(prefix), prefix))
+        gone = [(path,) for (path,) in rows if path not in present]
+        if gone:
+            with self.db:
+                self.db.executemany("DELETE FROM tracks WHERE path = ?", gone)
+        return len(gone)
+
+    def evict_missing(self):
+        """Drop entries for files that no longer exist anywhere"""
+        gone = [(path,) for (path,) in self.db.execute("SELECT path FROM tracks")
+                if not os.path.exists(path)]
+        if gone:
+            with self.db:
+                self.db.executemany("DELETE FROM tracks WHERE path = ?", gone)
+        return len(gone)
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM tracks").fetchone()[0]
+
+    @staticmethod
+    def _to_result(fields, row):
+        result = dict(zip(fields, row))
+        for name in ("beatgrid", "cues"):
+            result[name] = json.loads(result[name]) if result[name] else None
+        return result
@@ -0,0 +1,300 @@
+"""Tag and header readers for ID3 (mp3), FLAC, MP4/M4A and WAV
+
+read_tags() only reads the metadata regions of a file (headers, the ID3
+tag, FLAC metadata blocks, the MP4 moov atom), never the audio itself, so
+it costs a few small reads per file even on network shares.
+"""
+import os
+import struct
+
+MPEG_BITRATES = {
+    # (version, layer) -> kbps by index; version 1 = MPEG-1, 2 = MPEG-2/2.5
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+MPEG_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+ID3_FRAMES = {"TIT2": "title", "TPE1": "artist", "TALB": "album",
+              "TT2": "title", "TP1": "artist", "TAL": "album"}
+VORBIS_FIELDS = {"TITLE": "title", "ARTIST": "artist", "ALBUM": "album"}
+MP4_FIELDS = {b"\xa9nam": "title", b"\xa9ART": "artist", b"\xa9alb": "album"}
+MP4_CONTAINERS = (b"moov", b"udta", b"ilst", b"trak", b"mdia")
+WAV_INFO = {b"INAM": "title", b"IART": "artist", b"IPRD": "album"}
+MP3_SCAN = 64 * 1024 # How far past the ID3 tag to look for the first frame
+
+
+class TagError(Exception):
+    """Raised when a file's headers cannot be parsed"""
+
+
+def read_tags(path):
+    """Return {"title", "artist", "album", "bitrate" (kbps), "duration" (s)}
+
+    Fields the file does not carry are None.
+    """
+    tags = dict.fromkeys(("title", "artist", "album", "bitrate", "duration"))
+    ext = os.path.splitext(path)[1].lower()
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        try:
+            if ext == ".mp3":
+                _read_mp3(f, size, tags)
+            elif ext == ".flac":
+                _read_flac(f, size, tags)
+            elif ext in (".m4a", ".mp4", ".aac"):
+                _read_mp4(f, size, tags)
+            elif ext == ".wav":
+                _read_wav(f, size, tags)
+        except (struct.error, IndexError, ValueError) as exc:
+            raise TagError(f"{os.path.basename(path)}: {exc}")
+    if tags["duration"] and not tags["bitrate"]:
+        tags["bitrate"] = int(size * 8 / tags["duration"] / 1000)
+    return tags
+
+
+def _decode_text(data):
+    """ID3 text frame payload: encoding byte, then the text"""
+    if not data:
+        return ""
+    encoding, raw = data[0], data[1:]
+    if encoding == 1:
+        text = raw.decode("utf-16", errors="replace")
+    elif encoding == 2:
+        text = raw.decode("utf-16-be", errors="replace")
+    elif encoding == 3:
+        text = raw.decode("utf-8", errors="replace")
+    else:
+        text = raw.decode("latin-1")
+    return text.split("\x00")[0].strip()
+
+
+def _synchsafe(data):
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+
+def _read_mp3(f, size, tags):
+    header = f.read(10)
+    audio_start = 0
+    if header[:3] == b"ID3" and len(header) == 10:
+        version, flags = header[3], header[5]
+        tag_size = _synchsafe(header[6:10])
+        audio_start = 10 + tag_size + (10 if flags & 0x10 else 0)
+        _parse_id3v2(f.read(tag_size), version, flags, tags)
+    if not tags["title"] and size > 128:
+        f.seek(-128, os.SEEK_END)
+        v1 = f.read(128)
+        if v1[:3] == b"TAG":
+            for name, start in (("title", 3), ("artist", 33), ("album", 63)):
+                value = v1[start:start + 30].split(b"\x00")[0].decode("latin-1").strip()
+                tags[name] = tags[name] or value or None
+    f.seek(audio_start)
+    data = f.read(MP3_SCAN)
+    _parse_mpeg(data, size - audio_start, tags)
+
+
+def _parse_id3v2(data, version, flags, tags):
+    pos = 0
+    if version >= 3 and flags & 0x40: # Extended header
+        ext = struct.unpack(">I", data[:4])[0]
+        pos = _synchsafe(data[:4]) if version == 4 else ext + 4
+    id_len, header_len = (3, 6) if version == 2 else (4, 10)
+    while pos + header_len <= len(data):
+        frame_id = data[pos:pos + id_len]
+        if not frame_id.strip(b"\x00"):
+            break # Padding
+        if version == 2:
+            frame_size = int.from_bytes(data[pos + 3:pos + 6], "big")
+        elif version == 4:
+            frame_size = _synchsafe(data[pos + 4:pos + 8])
+        else:
+            frame_size = struct.unpack(">I", data[pos + 4:pos + 8])[0]
+        body = data[pos + header_len:pos + header_len + frame_size]
+        pos += header_len + frame_size
+        name = ID3_FRAMES.get(frame_id.decode("latin-1"))
+        if name:
+            tags[name] = _decode_text(body) or None
+        elif frame_id in (b"TLEN", b"TLE") and not tags["duration"]:
+            try:
+                tags["duration"] = int(_decode_text(body)) / 1000.0 or None
+            except ValueError:
+                pass
+
+
+def _parse_mpeg(data, audio_bytes, tags):
+    """Bitrate and duration from the first MPEG audio frame (and its Xing/VBRI header)"""
+    pos = data.find(b"\xff")
+    while 0 <= pos < len(data) - 4:
+        b1, b2, b3 = data[pos + 1], data[pos + 2], data[pos + 3]
+        version_bits, layer_bits = (b1 >> 3) & 3, (b1 >> 1) & 3
+        bitrate_index, rate_index = b2 >> 4, (b2 >> 2) & 3
+        if (b1 & 0xE0 == 0xE0 and version_bits != 1 and layer_bits
+                and 0 < bitrate_index < 15 and rate_index < 3):
+            break
+        pos = data.find(b"\xff", pos + 1)
+    else:
+        return
+    version = 1 if version_bits == 3 else 2
+    layer = 4 - layer_bits
+    bitrate = MPEG_BITRATES[(version, layer)][bitrate_index]
+    rate = MPEG_RATES[version_bits][rate_index]
+    samples_per_frame = 384 if layer == 1 else (1152 if layer == 2 or version == 1 else 576)
+    mono = (b3 >> 6) == 3
+    # Xing/Info header sits after the side information in the first frame
+    side = (17 if mono else 32) if version == 1 else (9 if mono else 17)
+    frames = None
+    xing = pos + 4 + side
+    if data[xing:xing + 4] in (b"Xing", b"Info"):
+        if struct.unpack(">I", data[xing + 4:xing + 8])[0] & 1:
+            frames = struct.unpack(">I", data[xing + 8:xing + 12])[0]
+    elif data[pos + 36:pos + 40] == b"VBRI":
+        frames = struct.unpack(">I", data[pos + 50:pos + 54])[0]
+    if frames:
+        duration = frames * samples_per_frame / rate
+        tags["bitrate"] = int(round(audio_bytes * 8 / duration / 1000)) if duration else bitrate
+    else:
+        # Constant bitrate: the file size gives the length
+        duration = audio_bytes * 8 / (bitrate * 1000)
+        tags["bitrate"] = bitrate
+    tags["duration"] = tags["duration"] or duration
+
+
+def _read_flac(f, size, tags):
+    if f.read(4) != b"fLaC":
+        raise ValueError("not a FLAC stream")
+    last = False
+    while not last:
+        header = f.read(4)
+        if len(header) < 4:
+            break
+        last = bool(header[0] & 0x80)
+        block_type = header[0] & 0x7F
+        length = int.from_bytes(header[1:], "big")
+        if block_type == 0: # STREAMINFO
+            info = f.read(length)
+            packed = int.from_bytes(info[10:18], "big")
+            rate = packed >> 44
+            total = packed & 0xFFFFFFFFF
+            if rate and total:
+                tags["duration"] = total / rate
+        elif block_type == 4: # VORBIS_COMMENT
+            _parse_vorbis(f.read(length), tags)
+        else:
+            f.seek(length, os.SEEK_CUR)
+
+
+def _parse_vorbis(data, tags):
+    vendor = struct.unpack("<I", data[:4])[0]
+    pos = 4 + vendor
+    count = struct.unpack("<I", data[pos:pos + 4])[0]
+    pos += 4
+    for _ in range(count):
+        length = struct.unpack("<I", data[pos:pos + 4])[0]
+        comment = data[pos + 4:pos + 4 + length].decode("utf-8", errors="replace")
+        pos += 4 + length
+        key, _, value = comment.partition("=")
+        name = VORBIS_FIELDS.get(key.upper())
+        if name and not tags[name]:
+            tags[name] = value.strip() or None
+
+
+def _read_mp4(f, size, tags):
+    """Walk top-level atoms to moov, then parse it from memory"""
+    pos = 0
+    while pos + 8 <= size:
+        f.seek(pos)
+        atom_size, kind = struct.unpack(">I4s", f.read(8))
+        header = 8
+        if atom_size == 1:
+            atom_size = struct.unpack(">Q", f.read(8))[0]
+            header = 16
+        elif atom_size == 0:
+            atom_size = size - pos
+        if atom_size < header:
+            raise ValueError("bad atom size")
+        if kind == b"moov":
+            _parse_atoms(f.read(atom_size - header), tags)
+            return
+        pos += atom_size
+
+
+def _parse_atoms(data, tags):
+    pos = 0
+    while pos + 8 <= len(data):
+        atom_size, kind = struct.unpack(">I4s", data[pos:pos + 8])
+        if atom_size < 8:
+            break
+        body = data[pos + 8:pos + atom_size]
+        pos += atom_size
+        if kind in MP4_CONTAINERS:
+            _parse_atoms(body, tags)
+        elif kind == b"meta":
+            _parse_atoms(body[4:], tags) # Full atom: skip version and flags
+        elif kind == b"mvhd":
+            if body[0] == 1:
+                timescale, duration = struct.unpack(">IQ", body[20:32])
+            else:
+                timescale, duration = struct.unpack(">II", body[12:20])
+            if timescale:
+                tags["duration"] = duration / timescale
+        elif kind in MP4_FIELDS and body[4:8] == b"data":
+            # data atom: size, "data", type, locale, then the UTF-8 value
+            data_size = struct.unpack(">I", body[:4])[0]
+            tags[MP4_FIELDS[kind]] = body[16:data_size].decode("utf-8", errors="replace") or None
+        elif kind == b"esds" and not tags["bitrate"]:
+            _parse_esds(body, tags)
+
+
+def _parse_esds(body, tags):
+    """Average bitrate from the decoder config descriptor"""
+    pos = body.find(b"\x04", 4) # DecoderConfigDescriptor tag
+    if pos < 0:
+        return
+    pos += 1
+    while body[pos] & 0x80: # Variable-length size bytes
+        pos += 1
+    pos += 1
+    average = struct.unpack(">I", body[pos + 9:pos + 13])[0]
+    if average:
+        tags["bitrate"] = average // 1000
+
+
+def _read_wav(f, size, tags):
+    riff = f.read(12)
+    if riff[:4] != b"RIFF" or riff[8:] != b"WAVE":
+        raise ValueError("not a RIFF/WAVE file")
+    byte_rate = None
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            break
+        chunk_id, length = struct.unpack("<4sI", header)
+        if chunk_id == b"fmt ":
+            fmt = f.read(length)
+            byte_rate = struct.unpack("<I", fmt[8:12])[0]
+            tags["bitrate"] = byte_rate * 8 // 1000
+            f.seek(length & 1, os.SEEK_CUR)
+        elif chunk_id == b"data":
+            if byte_rate:
+                tags["duration"] = min(length, size - f.tell()) / byte_rate
+            f.seek(length + (length & 1), os.SEEK_CUR)
+        elif chunk_id == b"LIST" and length >= 4:
+            _parse_info(f.read(length), tags)
+            f.seek(length & 1, os.SEEK_CUR)
+        else:
+            f.seek(length + (length & 1), os.SEEK_CUR)
+
+
+def _parse_info(data, tags):
+    if data[:4] != b"INFO":
+        return
+    pos = 4
+    while pos + 8 <= len(data):
+        chunk_id, length = struct.unpack("<4sI", data[pos:pos + 8])
+        value = data[pos + 8:pos + 8 + length]
+        pos += 8 + length + (length & 1)
+        name = WAV_INFO.get(chunk_id)
+        if name:
+            tags[name] = value.split(b"\x00")[0].decode("latin-1").strip() or None
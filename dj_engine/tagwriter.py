@@ -0,0 +1,305 @@
+"""Batch ID3v2 tag writer for MP3 files
+
+write_tags() changes only the frames it is given and keeps every other
+frame as it was. When the new tag fits in the space the old one occupied
+(frames plus padding) it is rewritten in place and the audio is never
+touched. Otherwise the file is rebuilt in a temporary file next to it,
+with room to spare for next time, and renamed over the original, so a
+crash leaves either the old file or the new one.
+
+TagWriter runs write_tags() for many files on a thread pool; tag writing
+is almost all I/O, so the threads overlap well.
+"""
+import json
+import os
+import queue
+import shutil
+import struct
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from .tags import TagError, _synchsafe
+
+# Field -> ID3 text frame; comment and cues have frames of their own
+TEXT_FRAMES = {"title": b"TIT2", "artist": b"TPE1", "album": b"TALB",
+               "bpm": b"TBPM", "key": b"TKEY"}
+WRITABLE = tuple(TEXT_FRAMES) + ("comment", "cues")
+CUES_DESCRIPTION = "MUSIC_ANALYZER_DJ_CUES" # TXXX frame holding the cues JSON
+PADDING = 4096 # Spare room left in a rebuilt tag so later edits fit in place
+COPY_CHUNK = 1024 * 1024
+COMMENT_KEY = (b"eng", "") # (language, description) of the comment frame we write
+
+
+def write_tags(path, changes):
+    """Apply changes ({field: value}, None removes a field) to path's ID3 tag
+
+    Returns ("in place" or "rewritten", bytes written).
+    """
+    unknown = set(changes) - set(WRITABLE)
+    if unknown:
+        raise TagError(f"{os.path.basename(path)}: cannot write {', '.join(sorted(unknown))}")
+    if os.path.splitext(path)[1].lower() != ".mp3":
+        raise TagError(f"{os.path.basename(path)}: only MP3 (ID3v2) tags can be written")
+    try:
+        with open(path, "rb") as f:
+            header = f.read(10)
+            version, flags, frames, space, audio_start = 3, 0, [], 0, 0
+            if header[:3] == b"ID3" and len(header) == 10:
+                version, flags = header[3], header[5]
+                if version not in (3, 4):
+                    raise TagError(f"{os.path.basename(path)}: ID3v2.{version} tags are not supported")
+                space = _synchsafe(header[6:10])
+                audio_start = 10 + space + (10 if flags & 0x10 else 0)
+                frames = _split_frames(f.read(space), version, flags)
+        frames = _apply(frames, changes, version)
+        body = b"".join(_pack_frame(frame_id, frame_flags, data, version)
+                        for frame_id, frame_flags, data in frames)
+    except (struct.error, IndexError, ValueError) as exc:
+        raise TagError(f"{os.path.basename(path)}: {exc}")
+    # Unsynchronised tags and tags with a footer are rebuilt rather than patched
+    if space and len(body) <= space and not flags & 0x90:
+        tag = _pack_header(version, space) + body + bytes(space - len(body))
+        with open(path, "r+b") as f:
+            f.write(tag)
+        return "in place", len(tag)
+    size = len(body) + PADDING
+    tag = _pack_header(version, size) + body + bytes(PADDING)
+    return "rewritten", _replace_file(path, tag, audio_start)
+
+
+def _split_frames(data, version, flags):
+    """[(frame id, flags, payload)] of a v2.3/v2.4 tag body"""
+    pos = 0
+    if flags & 0x40: # Extended header: dropped on rewrite
+        size = struct.unpack(">I", data[:4])[0]
+        pos = _synchsafe(data[:4]) if version == 4 else size + 4
+    frames = []
+    while pos + 10 <= len(data):
+        frame_id = data[pos:pos + 4]
+        if not frame_id.strip(b"\x00"):
+            break # Padding
+        if version == 4:
+            size = _synchsafe(data[pos + 4:pos + 8])
+        else:
+            size = struct.unpack(">I", data[pos + 4:pos + 8])[0]
+        frames.append((frame_id, data[pos + 8:pos + 10], data[pos + 10:pos + 10 + size]))
+        pos += 10 + size
+    return frames
+
+
+def _apply(frames, changes, version):
+    replaced = {}
+    for name, value in changes.items():
+        if name in TEXT_FRAMES:
+            replaced[(TEXT_FRAMES[name], None)] = \
+                None if value in (None, "") else _encoded(_format(name, value), version)
+        elif name == "comment":
+            # Language, an empty description, then the comment itself
+            replaced[(b"COMM", COMMENT_KEY)] = None if not value else \
+                _encoded(COMMENT_KEY[1], version, prefix=COMMENT_KEY[0], terminated=True,
+                         suffix=str(value))
+        elif name == "cues":
+            replaced[(b"TXXX", CUES_DESCRIPTION)] = None if not value else \
+                _encoded(CUES_DESCRIPTION, version, terminated=True,
+                         suffix=json.dumps(value, separators=(",", ":")))
+    kept = [frame for frame in frames if _frame_key(frame, replaced) not in replaced]
+    return kept + [(key[0], b"\x00\x00", data) for key, data in replaced.items()
+                   if data is not None]
+
+
+def _frame_key(frame, replaced):
+    frame_id, flags, data = frame
+    if frame_id == b"TXXX" and (frame_id, CUES_DESCRIPTION) in replaced:
+        # Only our own TXXX frame is replaced; others are kept
+        text = _decode_plain(data).split("\x00")[0]
+        return (frame_id, text) if text == CUES_DESCRIPTION else None
+    if frame_id == b"COMM":
+        # Comments are told apart by language and description (iTunNORM and friends)
+        if len(data) < 4:
+            return None
+        return (frame_id, (data[1:4], _decode_plain(data[:1] + data[4:]).split("\x00")[0]))
+    return (frame_id, None)
+
+
+def _decode_plain(data):
+    if not data:
+        return ""
+    encoding, raw = data[0], data[1:]
+    codec = {0: "latin-1", 1: "utf-16", 2: "utf-16-be", 3: "utf-8"}.get(encoding, "latin-1")
+    return raw.decode(codec, errors="replace")
+
+
+def _format(name, value):
+    if name == "bpm":
+        return str(int(round(float(value))))
+    return str(value)
+
+
+def _encoded(text, version, prefix=b"", terminated=False, suffix=None):
+    """Encoding byte, optional language, text (NUL-terminated if asked), optional second text
+
+    v2.4 tags use UTF-8; v2.3 has no UTF-8, so non-Latin-1 text goes in UTF-16.
+    """
+    parts = [text] + ([suffix] if suffix is not None else [])
+    if version == 4:
+        encoding, codec, nul = 3, "utf-8", b"\x00"
+    elif all(part.isascii() or _latin1(part) for part in parts):
+        encoding, codec, nul = 0, "latin-1", b"\x00"
+    else:
+        encoding, codec, nul = 1, "utf-16", b"\x00\x00"
+    data = bytes([encoding]) + prefix + text.encode(codec)
+    if terminated:
+        data += nul
+    if suffix is not None:
+        data += suffix.encode(codec)
+    return data
+
+
+def _latin1(text):
+    try:
+        text.encode("latin-1")
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+def _pack_frame(frame_id, flags, data, version):
+    size = _to_synchsafe(len(data)) if version == 4 else struct.pack(">I", len(data))
+    return frame_id + size + flags + data
+
+
+def _pack_header(version, size):
+    return b"ID3" + bytes([version, 0, 0]) + _to_synchsafe(size)
+
+
+def _to_synchsafe(value):
+    if value >= 1 << 28:
+        raise TagError("tag too large")
+    return bytes([(value >> 21) & 0x7F, (value >> 14) & 0x7F, (value >> 7) & 0x7F, value & 0x7F])
+
+
+def _replace_file(path, tag, audio_start):
+    """Write tag + the audio from audio_start to a temp file and rename it over path"""
+    folder = os.path.dirname(os.path.abspath(path))
+    fd, temp = tempfile.mkstemp(prefix=".retag-", suffix=".mp3", dir=folder)
+    try:
+        with os.fdopen(fd, "wb") as out, open(path, "rb") as source:
+            out.write(tag)
+            source.seek(audio_start)
+            shutil.copyfileobj(source, out, COPY_CHUNK)
+            written = out.tell()
+            out.flush()
+            os.fsync(out.fileno())
+        shutil.copymode(path, temp)
+        os.replace(temp, path)
+    except BaseException:
+        try:
+            os.unlink(temp)
+        except OSError:
+            pass
+        raise
+    return written
+
+
+class TagWriter:
+    """Writes tag edits for many files on a thread pool
+
+    Events arrive in ``events`` as ("written", path, mode), ("error", path,
+    message) and finally ("done", cancelled), to be drained from the Tk
+    main loop like FolderScanner's.
+    """
+    def __init__(self, workers=8):
+        self.workers = workers
+        self.events = queue.Queue()
+        self.total = 0
+        self.files = 0
+        self.errors = 0
+        self.bytes_written = 0
+        self.in_place = 0
+        self.started = None
+        self.finished = None
+        self._cancel = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def files_per_second(self):
+        elapsed = self.elapsed
+        return self.files / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def megabytes_per_second(self):
+        elapsed = self.elapsed
+        return self.bytes_written / elapsed / 1e6 if elapsed > 0 else 0.0
+
+    def start(self, edits):
+        """Write edits, a {path: {field: value}} dict or (path, changes) pairs"""
+        if self.running:
+            raise RuntimeError("Tag writing already running")
+        edits = list(edits.items() if isinstance(edits, dict) else edits)
+        self.total = len(edits)
+        self.files = self.errors = self.bytes_written = self.in_place = 0
+        self.started = time.perf_counter()
+        self.finished = None
+        self._cancel.clear()
+        self._thread = threading.Thread(target=self._run, args=(edits,),
+                                        name="tag-writer", daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def wait(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def drain(self, limit=500):
+        """Non-blocking fetch of up to limit events"""
+        events = []
+        try:
+            while len(events) < limit:
+                events.append(self.events.get_nowait())
+        except queue.Empty:
+            pass
+        return events
+
+    def _run(self, edits):
+        pending = list(reversed(edits))
+        in_flight = {}
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers,
+                                    thread_name_prefix="tag-write") as pool:
+                while (in_flight or pending) and not self._cancel.is_set():
+                    while pending and len(in_flight) < self.workers * 4:
+                        path, changes = pending.pop()
+                        in_flight[pool.submit(write_tags, path, changes)] = path
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        path = in_flight.pop(future)
+                        try:
+                            mode, written = future.result()
+                        except Exception as exc:
+                            # Whatever goes wrong with one file, the rest still get written
+                            self.errors += 1
+                            self.events.put(("error", path, str(exc)))
+                            continue
+                        self.files += 1
+                        self.bytes_written += written
+                        self.in_place += mode == "in place"
+                        self.events.put(("written", path, mode))
+                for future in in_flight:
+                    future.cancel()
+        finally:
+            self.finished = time.perf_counter()
+            self.events.put(("done", self._cancel.is_set()))
@@ -0,0 +1,95 @@
+"""Master tempo clock and the variable-speed resampling stage
+
+Everything here runs on the audio thread, once per block. Decks play at a
+``rate`` (1.0 = original speed); pitch and SYNC only ever change that
+rate, and the resampler turns rate into output frames.
+"""
+import numpy as np
+
+PHASE_BLOCKS = 8 # Blocks over which a phase error is nudged out
+MAX_NUDGE = 0.04 # Largest temporary speed change used to nudge phase
+
+
+def resample_block(source, offset, rate, frames):
+    """frames output frames read from source at offset + n * rate
+
+    source is a (count, 2) array that must cover offset - 1 to
+    offset + frames * rate + 2; 4-point Hermite interpolation over the
+    whole block in a handful of array operations (varispeed: pitch moves
+    with tempo, like a turntable).
+    """
+    positions = offset + np.arange(frames) * rate
+    index = positions.astype(np.int64)
+    frac = (positions - index).astype(np.float32)[:, None]
+    xm1, x0, x1, x2 = (source[index - 1], source[index], source[index + 1],
+                       source[index + 2])
+    c1 = 0.5 * (x1 - xm1)
+    c2 = xm1 - 2.5 * x0 + 2.0 * x1 - 0.5 * x2
+    c3 = 0.5 * (x2 - xm1) + 1.5 * (x0 - x1)
+    return ((c3 * frac + c2) * frac + c1) * frac + x0
+
+
+def phase_error(master_beats, deck_beats):
+    """How far deck trails the master in beats, wrapped to [-0.5, 0.5)"""
+    return (master_beats - deck_beats + 0.5) % 1.0 - 0.5
+
+
+class MasterClock:
+    """Shared tempo and beat phase that synced decks follow
+
+    The master is the deck that was playing first with a beatgrid and is
+    not itself synced; while it plays the clock reads tempo and phase from
+    its playhead, and when nothing qualifies the clock free-runs at the
+    last tempo. update() runs at the start of every audio block, after
+    transport commands are applied and before any deck renders, so every
+    deck is compared at the same sample.
+    """
+    def __init__(self, sample_rate):
+        self.sample_rate = sample_rate
+        self.master = None
+        self.bpm = 0.0
+        self.beat = 0.0 # Beats since the master's first beat, at block start
+
+    def update(self, decks, frames):
+        master = self.master
+        if not self._qualifies(master, synced_ok=True):
+            master = next((deck for deck in decks if self._qualifies(deck)), None)
+            self.master = master
+        if master is not None:
+            self.bpm = master.track_bpm * master.rate
+            self.beat = master.beats()
+        for deck in decks:
+            if deck.synced and deck is not master and deck.track_bpm and self.bpm:
+                self.follow(deck, frames)
+            elif deck.playing:
+                deck.snap_phase = False # Only a silent deck may jump
+        if master is None and self.bpm:
+            self.beat += frames / self.sample_rate * self.bpm / 60.0
+
+    def follow(self, deck, frames):
+        """Set a synced deck's rate so its tempo and beat phase match the clock"""
+        # Match at half or double time when that is closer, e.g. 87 against 174
+        multiple = min((0.5, 1.0, 2.0),
+                       key=lambda m: abs(np.log(self.bpm * m / deck.track_bpm)))
+        target = self.bpm * multiple / deck.track_bpm
+        frames_per_beat = 60.0 * self.sample_rate / deck.track_bpm
+        error = phase_error(self.beat * multiple, deck.beats()) * frames_per_beat
+        if deck.snap_phase:
+            # Deck is silent (just started or synced while paused): jump straight into phase
+            if deck.position + error < 0:
+                error += frames_per_beat
+            deck.position += error
+            deck.snap_phase = False
+            error = 0.0
+        if not deck.playing:
+            deck.rate = target
+            return
+        # Spread the remaining error over a few blocks, within a small speed change
+        nudge = error / (frames * PHASE_BLOCKS)
+        nudge = min(max(nudge, -MAX_NUDGE * target), MAX_NUDGE * target)
+        deck.rate = target + nudge
+
+    @staticmethod
+    def _qualifies(deck, synced_ok=False):
+        return (deck is not None and deck.playing and bool(deck.track_bpm)
+                and (synced_ok or not deck.synced))
@@ -0,0 +1,192 @@
+"""Multi-resolution waveform overviews (min/max/RMS plus low/mid/high band energy)"""
+import struct
+import zlib
+
+import numpy as np
+
+BASE_BLOCK = 256  # samples per column at level 0
+LEVEL_FACTOR = 4
+LOW_CUTOFF = 250.0
+HIGH_CUTOFF = 4000.0
+CHANNELS = ("min", "max", "rms", "low", "mid", "high")
+HEADER = struct.Struct("<4sIHI")
+MAGIC = b"WPY1"
+
+
+class WaveformPyramid:
+    """Peak pyramid for one track, stored as int8 arrays
+
+    Level 0 has one column per BASE_BLOCK samples and every further level
+    folds LEVEL_FACTOR columns into one, so any zoom can be served from a
+    level with at most LEVEL_FACTOR columns per pixel. ``levels[k]`` is an
+    int8 array shaped (6, columns) in CHANNELS order; min/max span -127..127,
+    the rest 0..127.
+    """
+    def __init__(self, level0, rate, base_block=BASE_BLOCK):
+        self.rate = rate
+        self.base_block = base_block
+        self.levels = [level0]
+        while self.levels[-1].shape[1] > LEVEL_FACTOR:
+            self.levels.append(_fold(self.levels[-1]))
+
+    @classmethod
+    def from_samples(cls, samples, rate, base_block=BASE_BLOCK):
+        """Build the pyramid from mono float samples in one vectorized pass"""
+        builder = PyramidBuilder(rate, base_block)
+        builder.feed(samples)
+        return builder.finish()
+
+    @property
+    def duration(self):
+        return self.levels[0].shape[1] * self.base_block / self.rate
+
+    def level_for(self, samples_per_pixel):
+        """Coarsest level that still has at least one column per pixel"""
+        level = 0
+        block = self.base_block
+        while (level + 1 < len(self.levels)
+               and block * LEVEL_FACTOR <= samples_per_pixel):
+            level += 1
+            block *= LEVEL_FACTOR
+        return level, block
+
+    def columns(self, start_seconds, seconds_per_pixel, width):
+        """(6, width) int8 columns for a view starting at start_seconds
+
+        Work is proportional to width, not to the number of samples shown.
+        Pixels before the start or past the end of the track are zero.
+        """
+        samples_per_pixel = max(seconds_per_pixel * self.rate, 1e-9)
+        level, block = self.level_for(samples_per_pixel)
+        data = self.levels[level]
+        edges = (start_seconds * self.rate + np.arange(width + 1) * samples_per_pixel) / block
+        edges = np.floor(edges).astype(np.int64)
+        out = np.zeros((len(CHANNELS), width), dtype=np.int8)
+        valid = (edges[:-1] >= 0) & (edges[:-1] < data.shape[1])
+        if not valid.any():
+            return out
+        first, last = np.flatnonzero(valid)[[0, -1]]
+        starts = edges[first:last + 1]
+        # Slice so the last pixel only reduces its own columns, not the rest of the track
+        stop = max(min(edges[last + 1], data.shape[1]), starts[-1] + 1)
+        view = data[:, :stop]
+        # reduceat repeats a column when zoomed past level 0 (start == next start)
+        out[0, first:last + 1] = np.minimum.reduceat(view[0], starts)
+        out[1:, first:last + 1] = np.maximum.reduceat(view[1:], starts, axis=1)
+        return out
+
+    def to_bytes(self):
+        """Compact serialization; only level 0 is kept, the rest is rebuilt on load"""
+        level0 = self.levels[0]
+        header = HEADER.pack(MAGIC, self.rate, self.base_block, level0.shape[1])
+        return header + zlib.compress(level0.tobytes(), 6)
+
+    @classmethod
+    def from_bytes(cls, blob):
+        magic, rate, base_block, count = HEADER.unpack_from(blob)
+        if magic != MAGIC:
+            raise ValueError("Not a waveform pyramid")
+        raw = zlib.decompress(blob[HEADER.size:])
+        level0 = np.frombuffer(raw, dtype=np.int8).reshape(len(CHANNELS), count)
+        return cls(level0, rate, base_block)
+
+
+class PyramidBuilder:
+    """Builds a WaveformPyramid from mono samples fed in consecutive chunks
+
+    Min/max/RMS are quantized as each chunk arrives; only the three band
+    energies per column are kept as floats until finish(), because they are
+    normalized against the loudest column of the whole track.
+    """
+    def __init__(self, rate, base_block=BASE_BLOCK):
+        self.rate = rate
+        self.base_block = base_block
+        self.window = np.hanning(base_block).astype(np.float32)
+        freqs = np.fft.rfftfreq(base_block, 1.0 / rate)
+        self.band_masks = ((freqs > 0) & (freqs < LOW_CUTOFF),
+                           (freqs >= LOW_CUTOFF) & (freqs < HIGH_CUTOFF),
+                           freqs >= HIGH_CUTOFF)
+        self._tail = np.zeros(0, dtype=np.float32)
+        self._levels = []
+        self._bands = []
+
+    def feed(self, samples):
+        samples = np.concatenate([self._tail, np.asarray(samples, dtype=np.float32)])
+        usable = len(samples) - len(samples) % self.base_block
+        self._tail = samples[usable:]
+        if usable:
+            self._add_blocks(samples[:usable].reshape(-1, self.base_block))
+
+    def finish(self):
+        if len(self._tail) or not self._levels:
+            block = np.zeros(self.base_block, dtype=np.float32)
+            block[:len(self._tail)] = self._tail
+            self._tail = np.zeros(0, dtype=np.float32)
+            self._add_blocks(block[None, :])
+        level0 = np.concatenate(self._levels, axis=1)
+        bands = np.sqrt(np.concatenate(self._bands, axis=1))
+        peak = bands.max(axis=1, keepdims=True)
+        level0[3:] = _quantize(bands / np.where(peak > 0, peak, 1.0))
+        return WaveformPyramid(level0, self.rate, self.base_block)
+
+    def _add_blocks(self, blocks):
+        spectrum = np.abs(np.fft.rfft(blocks * self.window, axis=1)) ** 2
+        self._bands.append(np.stack([spectrum[:, mask].sum(axis=1)
+                                     for mask in self.band_masks]).astype(np.float32))
+        level = np.zeros((len(CHANNELS), len(blocks)), dtype=np.int8)
+        level[0] = _quantize(blocks.min(axis=1))
+        level[1] = _quantize(blocks.max(axis=1))
+        level[2] = _quantize(np.sqrt(np.mean(blocks ** 2, axis=1)))
+        self._levels.append(level)
+
+
+def _quantize(values):
+    return np.clip(np.round(values * 127.0), -127, 127).astype(np.int8)
+
+
+def _fold(level):
+    """Next pyramid level: LEVEL_FACTOR columns become one"""
+    count = -(-level.shape[1] // LEVEL_FACTOR)
+    padded = np.zeros((level.shape[0], count * LEVEL_FACTOR), dtype=np.int16)
+    padded[:, :level.shape[1]] = level
+    grouped = padded.reshape(level.shape[0], count, LEVEL_FACTOR)
+    folded = np.empty((level.shape[0], count), dtype=np.int8)
+    folded[0] = grouped[0].min(axis=1)
+    folded[1] = grouped[1].max(axis=1)
+    folded[2] = np.sqrt(np.mean(grouped[2].astype(np.float32) ** 2, axis=1)).astype(np.int8)
+    folded[3:] = grouped[3:].mean(axis=2).astype(np.int8)
+    return folded
+
+
+def render_rgb(columns, height, palette, rms_palette, grow_up):
+    """Rasterize (6, width) columns into an (height, width, 3) uint8 image
+
+    Each column is filled from the baseline to its peak in the colour of its
+    dominant band, with the RMS body in the matching rms_palette colour.
+    grow_up puts the baseline at the bottom row (top half of the display).
+    """
+    width = columns.shape[1]
+    # int32: 127 * height overflows int16 once a lane is taller than 258 px
+    peaks = np.maximum(-columns[0].astype(np.int32), columns[1])
+    peak_rows = peaks * height // 127
+    rms_rows = columns[2].astype(np.int32) * height // 127
+    bands = np.argmax(columns[3:], axis=0)
+    distance = np.arange(height, dtype=np.int32)[:, None]
+    if grow_up:
+        distance = distance[::-1]
+    # Pixel class 0 = background, 1 = peak, 2 = RMS body; one gather from a
+    # per-column colour table is far cheaper than masked assignments
+    pixel_class = (distance < peak_rows).view(np.uint8) + (distance < rms_rows).view(np.uint8)
+    table = np.concatenate([
+        np.zeros((width, 3), dtype=np.uint8),
+        np.asarray(palette, dtype=np.uint8)[bands],
+        np.asarray(rms_palette, dtype=np.uint8)[bands],
+    ])
+    index = pixel_class.astype(np.int32) * width + np.arange(width, dtype=np.int32)
+    return np.take(table, index, axis=0)
+
+
+def to_ppm(image):
+    """Binary PPM bytes, which Tk's PhotoImage loads without per-pixel parsing"""
+    height, width = image.shape[:2]
+    return b"P6 %d %d 255\n" % (width, height) + image.tobytes()
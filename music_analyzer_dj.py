@@ -1,8 +1,70 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, simpledialog
 import os
-import random
 import math
+import time
+
+import numpy as np
+
+from dj_engine.analysis import AnalysisEngine
+from dj_engine.crates import SmartCrates
+from dj_engine.cues import HOT_CUES, LOOP_BEATS, cues_from_json, cues_to_json, hotcue_frame
+from dj_engine.harmonic import CompatibilityIndex, key_code, to_camelot
+from dj_engine.history import PlayLog
+from dj_engine.library import LibraryIndex
+from dj_engine.playback import Mixer, open_sink, format_time
+from dj_engine.playlists import PLAYLIST_EXTENSIONS, PathResolver, PlaylistWorker
+from dj_engine.profiler import PROFILER
+from dj_engine.scanner import FolderScanner, scan_file
+from dj_engine.store import AnalysisStore
+from dj_engine.tagwriter import TagWriter
+from dj_engine.waveform import WaveformPyramid, render_rgb, to_ppm
+
+class RefreshScheduler:
+    """One root.after loop that redraws whatever was marked dirty, once per frame
+    
+    Handlers call mark(draw) instead of redrawing; a draw marked several
+    times before the next frame runs once, with the union of the parts
+    it was marked for (None means all of it). Pollers added with
+    every_frame() run at the start of each frame and mark what changed.
+    A frame never waits less than it took, so the UI thread holds the
+    GIL at most half the time and the deck feeders keep decoding.
+    """
+    def __init__(self, root, interval=16):
+        self.root = root
+        self.interval = interval / 1000
+        self.pollers = []
+        self.dirty = {} # draw -> set of parts, or None for everything
+        self.running = False
+    
+    def every_frame(self, poll):
+        self.pollers.append(poll)
+    
+    def mark(self, draw, part=None):
+        if part is None:
+            self.dirty[draw] = None
+        elif draw not in self.dirty:
+            self.dirty[draw] = {part}
+        elif self.dirty[draw] is not None:
+            self.dirty[draw].add(part)
+    
+    def start(self):
+        if not self.running:
+            self.running = True
+            self.root.after(int(self.interval * 1000), self.frame)
+    
+    def frame(self):
+        started = time.perf_counter()
+        PROFILER.frame()
+        for poll in self.pollers:
+            poll()
+        dirty, self.dirty = self.dirty, {}
+        for draw, parts in dirty.items():
+            draw(parts)
+        elapsed = time.perf_counter() - started
+        delay = max(self.interval - elapsed, elapsed)
+        self.root.after(max(int(delay * 1000), 1), self.frame)
+
 
 class SeratoDeck:
     """Serato DJ style deck with circular BPM display and hot cues"""
@@ -12,8 +74,24 @@ class SeratoDeck:
         self.is_playing = False
         self.current_track = None # Stores the filename
         self.full_track_path = None # Stores the full path for loading
-        self.bpm = 127.0
+        self.bpm = 127.0 # Tempo as heard, after pitch and sync
+        self.track_bpm = 127.0 # Analyzed tempo of the loaded track
         self.pitch = 0.0
+        self.synced = False
+        self.key = ""
+        self.beatgrid = None # {"bpm", "first_beat"} from analysis
+        self.on_load = None # Called with the deck after a track is loaded
+        self.on_cues_changed = None # Called with the deck when hot cues change
+        self.on_history = None # Called with the deck and "play" or "stop"
+        self.scheduler = None # RefreshScheduler that coalesces redraws, set by the app
+        self.shown_time = None # Text in time_label, so unchanged frames skip it
+        self.shown_error = None # Player error last put in track_artist_label
+        self.hotcues = {} # Hot cue number -> sample offset, snapped to the beatgrid
+        self.loop_beats = None # Size of the active loop
+        self.waveform = None # WaveformPyramid of the loaded track
+        self.position = 0.0 # Playhead position in seconds
+        self.duration = 0.0
+        self.player = None # DeckPlayer in the audio engine
         self.setup_ui(parent)
     
     def setup_ui(self, parent):
@@ -47,8 +125,9 @@ class SeratoDeck:
         bpm_time_frame = tk.Frame(header, bg='#0a0a0a')
         bpm_time_frame.pack(side=tk.RIGHT, padx=10)
         
-        tk.Label(bpm_time_frame, text=str(int(self.bpm)), 
-                font=("Arial", 16, "bold"), fg="#00ff00", bg='#0a0a0a').pack()
+        self.bpm_label = tk.Label(bpm_time_frame, text=str(int(self.bpm)),
+                                  font=("Arial", 16, "bold"), fg="#00ff00", bg='#0a0a0a')
+        self.bpm_label.pack()
         
         self.time_label = tk.Label(bpm_time_frame, text="04:14.90",
                                    font=("Courier", 10), fg="white", bg='#0a0a0a')
@@ -58,12 +137,14 @@ class SeratoDeck:
         hotcue_frame = tk.Frame(self.frame, bg='#1a1a1a')
         hotcue_frame.pack(fill=tk.X, padx=5, pady=5)
         
-        cue_colors = ['#ff0000', '#0000ff', '#00ff00', '#ffff00'] # Red, Blue, Green, Yellow
-        for i in range(1, 5):
+        self.cue_colors = ['#ff0000', '#0000ff', '#00ff00', '#ffff00'] # Red, Blue, Green, Yellow
+        self.hotcue_buttons = {}
+        for i in range(1, HOT_CUES + 1):
             cue_btn = tk.Button(hotcue_frame, text=str(i), font=("Arial", 10, "bold"),
-                               bg=cue_colors[i-1], fg='black', width=4, height=2,
+                               bg='#333', fg=self.cue_colors[i-1], width=4, height=2,
                                relief=tk.FLAT, command=lambda x=i: self.set_hotcue(x))
             cue_btn.pack(side=tk.LEFT, padx=2)
+            self.hotcue_buttons[i] = cue_btn
         
         tk.Button(hotcue_frame, text="X", font=("Arial", 10, "bold"),
                  bg='#666', fg='white', width=4, height=2,
@@ -77,15 +158,18 @@ class SeratoDeck:
         self.bpm_canvas = tk.Canvas(bpm_display_frame, bg='#0a0a0a', 
                                     width=160, height=160, highlightthickness=0)
         self.bpm_canvas.pack(expand=True)
+        self.bpm_items = {} # Name -> canvas item, created on first draw
+        self.bpm_texts = {} # Name -> text the item shows
         self.draw_circular_bpm()
         
         # Transport controls
         transport = tk.Frame(self.frame, bg='#1a1a1a')
         transport.pack(fill=tk.X, padx=5, pady=5)
         
-        tk.Button(transport, text="SYNC", font=("Arial", 8, "bold"),
-                 bg='#0066cc', fg='white', width=6, relief=tk.FLAT,
-                 command=self.sync).pack(side=tk.LEFT, padx=2)
+        self.sync_btn = tk.Button(transport, text="SYNC", font=("Arial", 8, "bold"),
+                                  bg='#0066cc', fg='white', width=6, relief=tk.FLAT,
+                                  command=self.sync)
+        self.sync_btn.pack(side=tk.LEFT, padx=2)
         
         tk.Button(transport, text="◀◀", font=("Arial", 10),
                  bg='#333', fg='white', width=4, relief=tk.FLAT,
@@ -100,14 +184,24 @@ class SeratoDeck:
                  bg='#333', fg='white', width=4, relief=tk.FLAT,
                  command=self.fast_forward).pack(side=tk.LEFT, padx=2)
         
+        # Pitch fader, +/-8% like a turntable
+        self.pitch_scale = tk.Scale(self.frame, from_=8.0, to=-8.0, resolution=0.1,
+                                    orient=tk.HORIZONTAL, showvalue=False, length=150,
+                                    bg='#1a1a1a', fg='white', troughcolor='#333',
+                                    highlightthickness=0, command=self.set_pitch)
+        self.pitch_scale.pack(fill=tk.X, padx=5)
+        
         # Loop controls
         loop_frame = tk.Frame(self.frame, bg='#1a1a1a')
         loop_frame.pack(fill=tk.X, padx=5, pady=5)
         
-        for loop_size in ['1/8', '1/4', '1/2', '1', '2', '4', '8', '16']:
-            tk.Button(loop_frame, text=loop_size, font=("Arial", 7),
-                     bg='#333', fg='white', width=3, height=1,
-                     relief=tk.FLAT).pack(side=tk.LEFT, padx=1)
+        self.loop_buttons = {}
+        for loop_size, beats in zip(['1/8', '1/4', '1/2', '1', '2', '4', '8', '16'], LOOP_BEATS):
+            loop_btn = tk.Button(loop_frame, text=loop_size, font=("Arial", 7),
+                                 bg='#333', fg='white', width=3, height=1, relief=tk.FLAT,
+                                 command=lambda b=beats: self.set_loop(b))
+            loop_btn.pack(side=tk.LEFT, padx=1)
+            self.loop_buttons[beats] = loop_btn
         
         # FX and cue buttons
         fx_frame = tk.Frame(self.frame, bg='#1a1a1a')
@@ -121,31 +215,52 @@ class SeratoDeck:
                  bg='#0066cc', fg='white', width=8, height=2,
                  relief=tk.FLAT, command=self.load_track_dialog).pack(side=tk.RIGHT, padx=2)
     
+    @PROFILER.timed("draw_circular_bpm")
     def draw_circular_bpm(self):
-        """Draw Serato-style circular BPM display"""
-        self.bpm_canvas.delete("all")
-        
-        cx, cy = 80, 80
-        radius = 70
-        
-        # Outer circle
-        self.bpm_canvas.create_oval(cx-radius, cy-radius, cx+radius, cy+radius,
-                                    outline='#444', width=3)
-        
-        # BPM text
-        self.bpm_canvas.create_text(cx, cy-20, text=f"{self.bpm:.1f}",
-                                   font=("Arial", 24, "bold"), fill='white')
-        
-        # Pitch percentage
-        pitch_text = f"{self.pitch:+.1f}%"
-        self.bpm_canvas.create_text(cx, cy+10, text=pitch_text,
-                                   font=("Arial", 12), fill='#00ff00')
-        
-        # Time display (simulated)
-        self.bpm_canvas.create_text(cx, cy+35, text="01:19.4",
-                                   font=("Courier", 11), fill='white')
-        self.bpm_canvas.create_text(cx, cy+50, text="02:55.5",
-                                   font=("Courier", 11), fill='#666')
+        """Draw Serato-style circular BPM display
+        
+        Items are created once; later calls only update text that changed.
+        """
+        if not self.bpm_items:
+            cx, cy = 80, 80
+            radius = 70
+            
+            # Outer circle
+            self.bpm_canvas.create_oval(cx-radius, cy-radius, cx+radius, cy+radius,
+                                        outline='#444', width=3)
+            
+            self.bpm_items = {
+                "bpm": self.bpm_canvas.create_text(cx, cy-20, font=("Arial", 24, "bold"),
+                                                   fill='white'),
+                "pitch": self.bpm_canvas.create_text(cx, cy+10, font=("Arial", 12),
+                                                     fill='#00ff00'),
+                "elapsed": self.bpm_canvas.create_text(cx, cy+35, font=("Courier", 11),
+                                                       fill='white'),
+                "remaining": self.bpm_canvas.create_text(cx, cy+50, font=("Courier", 11),
+                                                         fill='#666'),
+            }
+        
+        texts = {"bpm": f"{self.bpm:.1f}", "pitch": f"{self.pitch:+.1f}%",
+                 "elapsed": format_time(self.position),
+                 "remaining": format_time(self.duration - self.position)}
+        for name, text in texts.items():
+            if self.bpm_texts.get(name) != text:
+                self.bpm_texts[name] = text
+                self.bpm_canvas.itemconfigure(self.bpm_items[name], text=text)
+    
+    def redraw(self, parts=None):
+        """Bring the time label and BPM display up to date; run by the scheduler"""
+        text = format_time(self.position)
+        if text != self.shown_time:
+            self.shown_time = text
+            self.time_label.config(text=text)
+        self.draw_circular_bpm()
+    
+    def mark_dirty(self):
+        if self.scheduler:
+            self.scheduler.mark(self.redraw)
+        else:
+            self.redraw()
     
     def load_track_dialog(self):
         """Open file dialog to load a track"""
@@ -160,12 +275,51 @@ class SeratoDeck:
         """Load track and update deck display"""
         self.full_track_path = file_path
         self.current_track = os.path.basename(file_path)
+        self.waveform = None
+        self.beatgrid = None
+        self.position = 0.0
+        self.duration = 0.0
+        self.is_playing = False
+        self.play_btn.config(text="▶", bg='#00ff00')
+        self.hotcues = {}
+        self.show_loop(None)
+        self.show_hotcues()
+        if self.player:
+            self.player.load(file_path)
         self.track_name_label.config(text=self.current_track[:25]) # Update track name
         self.track_artist_label.config(text="Artist Name") # Placeholder
-        self.bpm_canvas.delete("all") # Redraw BPM display
-        self.draw_circular_bpm() # Update BPM display with new track info (simulated)
+        self.mark_dirty()
+        if self.on_load:
+            self.on_load(self)
         messagebox.showinfo("Loaded", f"Deck {self.deck_number}: {self.current_track}")
     
+    def apply_analysis(self, result):
+        """Show analysis results (BPM, key, beatgrid) for the loaded track"""
+        if result.get("bpm"):
+            self.track_bpm = result["bpm"]
+            self.bpm = self.track_bpm * (1 + self.pitch / 100)
+        self.key = result.get("key", "")
+        self.beatgrid = result.get("beatgrid")
+        if self.player and self.beatgrid:
+            self.player.set_beatgrid(self.beatgrid["bpm"], self.beatgrid["first_beat"])
+        self.duration = result.get("duration") or self.duration
+        if result.get("waveform"):
+            self.waveform = WaveformPyramid.from_bytes(result["waveform"])
+        self.bpm_label.config(text=str(int(round(self.bpm))))
+        if self.key:
+            self.track_artist_label.config(text=f"Key {self.key}")
+        self.mark_dirty()
+    
+    def set_beatgrid(self, bpm, first_beat):
+        """Use a hand-set beatgrid instead of the analyzed one"""
+        self.beatgrid = {"bpm": bpm, "first_beat": first_beat}
+        self.track_bpm = bpm
+        self.bpm = self.track_bpm * (1 + self.pitch / 100)
+        if self.player:
+            self.player.set_beatgrid(bpm, first_beat)
+        self.bpm_label.config(text=str(int(round(self.bpm))))
+        self.mark_dirty()
+    
     def toggle_play(self):
         if not self.current_track:
             messagebox.showwarning("No Track", "Load a track first!")
@@ -174,32 +328,224 @@ class SeratoDeck:
         self.is_playing = not self.is_playing
         if self.is_playing:
             self.play_btn.config(text="⏸", bg='#ffaa00')
+            if self.player:
+                self.player.play()
         else:
             self.play_btn.config(text="▶", bg='#00ff00')
+            if self.player:
+                self.player.pause()
+        if self.on_history:
+            self.on_history(self, "play" if self.is_playing else "stop")
     
     def cue(self):
+        if self.is_playing and self.on_history:
+            self.on_history(self, "stop")
         self.is_playing = False
         self.play_btn.config(text="▶", bg='#00ff00')
+        if self.player:
+            self.player.cue()
     
     def sync(self):
-        messagebox.showinfo("Sync", f"Deck {self.deck_number}: Synced to master")
+        """Toggle SYNC: the audio engine locks tempo and beat phase to the master deck"""
+        self.synced = not self.synced
+        self.sync_btn.config(bg='#00ccff' if self.synced else '#0066cc')
+        if self.player:
+            self.player.set_sync(self.synced)
+    
+    def set_pitch(self, value):
+        pitch = float(value)
+        if abs(pitch - self.pitch) < 0.06:
+            return # Moved by refresh_transport, not the user
+        self.pitch = pitch
+        if self.synced:
+            self.synced = False
+            self.sync_btn.config(bg='#0066cc')
+        if self.player:
+            self.player.set_pitch(pitch)
     
     def rewind(self):
-        messagebox.showinfo("Rewind", f"Deck {self.deck_number}: Rewind")
+        if self.player:
+            self.player.skip(-5.0)
     
     def fast_forward(self):
-        messagebox.showinfo("Fast Forward", f"Deck {self.deck_number}: Fast Forward")
+        if self.player:
+            self.player.skip(5.0)
+    
+    def refresh_transport(self):
+        """Pull playhead and play state from the audio engine; True if it moved"""
+        if self.player is None:
+            return False
+        error = self.player.error if self.player.decoder is not None else None
+        if error and error != self.shown_error:
+            self.track_artist_label.config(text=error[:40])
+        self.shown_error = error
+        if self.player.duration:
+            self.duration = self.player.duration
+        if self.is_playing and not self.player.playing and not self.player.commands:
+            # Reached the end of the track
+            self.is_playing = False
+            self.play_btn.config(text="▶", bg='#00ff00')
+            if self.on_history:
+                self.on_history(self, "stop")
+        if self.loop_beats and self.player.loop is None and not self.player.commands:
+            self.show_loop(None) # A jump or seek left the loop
+        tempo_changed = False
+        if self.player.track_bpm and not self.player.commands:
+            # SYNC moves the tempo from the audio thread
+            pitch = (self.player.rate - 1.0) * 100
+            if abs(pitch - self.pitch) >= 0.05:
+                self.pitch = pitch
+                self.pitch_scale.set(round(pitch, 1))
+            bpm = self.player.bpm
+            if abs(bpm - self.bpm) >= 0.05:
+                self.bpm = bpm
+                self.bpm_label.config(text=str(int(round(bpm))))
+                tempo_changed = True
+        position = self.player.seconds
+        if position == self.position and not tempo_changed:
+            return False
+        self.position = position
+        self.mark_dirty()
+        return True
     
     def set_hotcue(self, number):
-        messagebox.showinfo("Hot Cue", f"Deck {self.deck_number}: Hot cue {number} set")
+        """Jump to hot cue number, or set it on the beat nearest the playhead"""
+        if not self.current_track or self.player is None:
+            return
+        if number in self.hotcues:
+            # The audio thread makes the jump on the next beat
+            self.player.jump(self.hotcues[number])
+            return
+        grid = self.beatgrid or {}
+        self.hotcues[number] = hotcue_frame(self.player.position, grid.get("bpm"),
+                                            grid.get("first_beat", 0.0),
+                                            self.player.sample_rate)
+        self.show_hotcues()
+        if self.on_cues_changed:
+            self.on_cues_changed(self)
     
     def clear_hotcues(self):
-        messagebox.showinfo("Clear", f"Deck {self.deck_number}: All hot cues cleared")
+        if not self.hotcues:
+            return
+        self.hotcues = {}
+        self.show_hotcues()
+        if self.on_cues_changed:
+            self.on_cues_changed(self)
+    
+    def load_cues(self, cues):
+        """Hot cues stored in the analysis store for the loaded track"""
+        if self.player:
+            self.hotcues = cues_from_json(cues, self.player.sample_rate)
+            self.show_hotcues()
+    
+    def cues_data(self):
+        return cues_to_json(self.hotcues, self.player.sample_rate)
+    
+    def show_hotcues(self):
+        for number, button in self.hotcue_buttons.items():
+            if number in self.hotcues:
+                button.config(bg=self.cue_colors[number - 1], fg='black')
+            else:
+                button.config(bg='#333', fg=self.cue_colors[number - 1])
+    
+    def set_loop(self, beats):
+        """Start a beat-quantized loop, or leave it when its size is pressed again"""
+        if not self.current_track or self.player is None:
+            return
+        if beats == self.loop_beats:
+            self.player.exit_loop()
+            self.show_loop(None)
+            return
+        if not self.beatgrid:
+            messagebox.showwarning("No Beatgrid", "Loops need an analyzed beatgrid")
+            return
+        self.player.set_loop(beats)
+        self.show_loop(beats)
+    
+    def show_loop(self, beats):
+        self.loop_beats = beats
+        for size, button in self.loop_buttons.items():
+            button.config(bg='#00aa00' if size == beats else '#333')
+
+
+class WaveformTiles:
+    """Ring of PhotoImage tiles holding one deck's rasterized waveform lane
+    
+    Tiles are pinned to track time, so scrolling only moves image items;
+    pixels are rasterized when a tile scrolls into view or the zoom changes.
+    """
+    TILE_WIDTH = 256
+    
+    def __init__(self, canvas, palette, rms_palette, grow_up):
+        self.canvas = canvas
+        self.palette = palette
+        self.rms_palette = rms_palette
+        self.grow_up = grow_up
+        self.tiles = {} # Tile index -> (PhotoImage, canvas item), shown
+        self.spare = [] # Hidden (PhotoImage, canvas item) pairs for reuse
+        self.key = None # (pyramid, seconds per pixel, height, grow_up) the tiles show
+    
+    def update(self, pyramid, position, seconds_per_pixel, playhead_x, top, height, width):
+        key = (pyramid, seconds_per_pixel, height, self.grow_up)
+        if key != self.key:
+            self.key = key
+            self.hide(list(self.tiles))
+        
+        needed = range(0)
+        if pyramid is not None:
+            tile_seconds = self.TILE_WIDTH * seconds_per_pixel
+            origin = playhead_x - position / seconds_per_pixel # x of the track start
+            first = max(int(math.floor(-origin / self.TILE_WIDTH)), 0)
+            last = min(int(math.floor((width - origin) / self.TILE_WIDTH)),
+                       int(pyramid.duration / tile_seconds))
+            needed = range(first, last + 1)
+        
+        self.hide([i for i in self.tiles if i not in needed])
+        
+        for index in needed:
+            tile = self.tiles.get(index)
+            if tile is None:
+                tile = self.spare.pop() if self.spare else self.new_tile()
+                columns = pyramid.columns(index * tile_seconds, seconds_per_pixel,
+                                          self.TILE_WIDTH)
+                pixels = render_rgb(columns, height, self.palette, self.rms_palette,
+                                    self.grow_up)
+                tile[0].configure(data=to_ppm(pixels), format='PPM')
+                self.canvas.itemconfigure(tile[1], state='normal')
+                self.tiles[index] = tile
+            self.canvas.coords(tile[1], round(origin + index * self.TILE_WIDTH), top)
+    
+    def hide(self, indexes):
+        for index in indexes:
+            tile = self.tiles.pop(index)
+            self.canvas.itemconfigure(tile[1], state='hidden')
+            self.spare.append(tile)
+    
+    def new_tile(self):
+        image = tk.PhotoImage(master=self.canvas)
+        item = self.canvas.create_image(0, 0, image=image, anchor=tk.NW, tags=("tile",))
+        self.canvas.tag_lower(item)
+        return image, item
 
 
 class SeratoWaveform:
     """Serato-style vertical waveform display in the center"""
+    # Low/mid/high band colours (peak, RMS body) for the top (deck 1) and bottom (deck 2) lanes
+    TOP_PALETTE = ((255, 85, 0), (255, 136, 0), (255, 187, 102))
+    TOP_RMS_PALETTE = ((255, 150, 80), (255, 190, 90), (255, 225, 170))
+    BOTTOM_PALETTE = ((0, 68, 170), (0, 102, 204), (85, 170, 255))
+    BOTTOM_RMS_PALETTE = ((70, 130, 220), (80, 160, 240), (170, 210, 255))
+    # Lane colours by deck: orange, blue, then green and purple for decks 3 and 4
+    PALETTES = [(TOP_PALETTE, TOP_RMS_PALETTE), (BOTTOM_PALETTE, BOTTOM_RMS_PALETTE),
+                (((0, 150, 60), (0, 200, 90), (120, 240, 150)),
+                 ((70, 190, 110), (90, 220, 140), (170, 245, 190))),
+                (((120, 40, 170), (160, 70, 210), (200, 140, 240)),
+                 ((160, 100, 200), (185, 130, 225), (220, 190, 245)))]
+    
     def __init__(self, parent):
+        self.decks = [] # Decks drawn top to bottom
+        self.seconds_visible = 8.0 # Zoom level
+        self.scheduler = None # RefreshScheduler that coalesces redraws, set by the app
         self.frame = tk.Frame(parent, bg='#0a0a0a')
         self.frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
         
@@ -229,48 +575,291 @@ class SeratoWaveform:
         self.canvas = tk.Canvas(self.frame, bg='#000', height=300, highlightthickness=0)
         self.canvas.pack(fill=tk.BOTH, expand=True)
         
+        # Waveform pixels live in image tiles; only these overlays are canvas items
+        self.lanes = [] # One WaveformTiles per deck, created as decks are added
+        self.center_line = self.canvas.create_line(0, 0, 0, 0, fill='#333', width=2)
+        self.beat_lines = [] # Per lane, a pool of beat marker lines reused between frames
+        self.shown_beats = [] # Per lane, how many of its beat lines are visible
+        self.playhead = self.canvas.create_line(0, 0, 0, 0, fill='white', width=3)
+        self.time_labels = [self.canvas.create_text(0, 10, fill='white', font=("Arial", 10))
+                            for _ in range(3)]
+        self.canvas.bind('<Configure>', lambda e: self.mark_dirty())
+        self.canvas.bind('<MouseWheel>', lambda e: self.zoom(0.5 if e.delta > 0 else 2.0))
+        self.canvas.bind('<Button-4>', lambda e: self.zoom(0.5))
+        self.canvas.bind('<Button-5>', lambda e: self.zoom(2.0))
+        
         self.draw_waveform()
     
-    def draw_waveform(self):
-        """Draw Serato-style dual waveform with orange/blue colors"""
-        self.canvas.delete("all")
+    def zoom(self, factor):
+        self.seconds_visible = min(max(self.seconds_visible * factor, 1.0), 128.0)
+        self.mark_dirty()
+    
+    def mark_dirty(self, lane=None):
+        """Redraw on the next frame: one lane (by deck index) or, by default, everything"""
+        if self.scheduler:
+            self.scheduler.mark(self.draw_waveform, lane)
+        else:
+            self.draw_waveform()
+    
+    @PROFILER.timed("draw_waveform")
+    def draw_waveform(self, lanes=None):
+        """Draw Serato-style dual waveform with orange/blue colors
         
+        Scrolling moves existing tiles and overlays instead of rebuilding them.
+        With lanes (a set of deck indexes) only those lanes are redrawn.
+        """
         width = self.canvas.winfo_width() if self.canvas.winfo_width() > 1 else 600
         height = self.canvas.winfo_height() if self.canvas.winfo_height() > 1 else 300
         center_y = height // 2
-        
-        # Draw center line
-        self.canvas.create_line(0, center_y, width, center_y, fill='#333', width=2)
-        
-        # Draw beat markers (yellow lines)
-        beat_interval = width // 10 # Simulate 10 beats across the screen
-        for x in range(0, width, beat_interval):
-            self.canvas.create_line(x, 0, x, height, fill='#ffff00', width=2)
-        
-        # Draw top waveform (orange)
-        for x in range(0, width, 3):
-            amp = random.randint(20, 80)
-            # Orange gradient
-            color = '#ff8800' if x % 6 == 0 else '#ff6600'
-            self.canvas.create_rectangle(x, center_y - amp, x+2, center_y,
-                                        fill=color, outline='')
-        
-        # Draw bottom waveform (blue)
-        for x in range(0, width, 3):
-            amp = random.randint(20, 80)
-            # Blue gradient
-            color = '#0088ff' if x % 6 == 0 else '#0066cc'
-            self.canvas.create_rectangle(x, center_y, x+2, center_y + amp,
-                                        fill=color, outline='')
-        
-        # Draw playhead (white vertical line)
+        seconds_per_pixel = self.seconds_visible / width
         playhead_x = width // 2
-        self.canvas.create_line(playhead_x, 0, playhead_x, height, fill='white', width=3)
-        
-        # Draw time markers (simulated)
-        for i, time in enumerate(['30', '35', '40']):
-            x_pos = width // 4 + (i * width // 4)
-            self.canvas.create_text(x_pos, 10, text=time, fill='white', font=("Arial", 10))
+        count = len(self.decks)
+        
+        if lanes is None:
+            self.canvas.coords(self.center_line, 0, center_y, width, center_y)
+            # Playhead (white vertical line)
+            self.canvas.coords(self.playhead, playhead_x, 0, playhead_x, height)
+            while len(self.lanes) < count:
+                palette, rms_palette = self.PALETTES[len(self.lanes) % len(self.PALETTES)]
+                self.lanes.append(WaveformTiles(self.canvas, palette, rms_palette, True))
+                self.beat_lines.append([])
+                self.shown_beats.append(0)
+            for index in range(count, len(self.lanes)):
+                self.lanes[index].update(None, 0.0, seconds_per_pixel, playhead_x, 0, 0, width)
+                self.draw_beats(index, None, 0, 0, 0, 0)
+            lanes = range(count)
+        
+        # Lanes above the center line grow up from it, those below grow down
+        bounds = [height * i // count for i in range(count + 1)] if count else []
+        for index in lanes:
+            if index >= min(count, len(self.lanes)):
+                continue
+            deck, lane = self.decks[index], self.lanes[index]
+            top, bottom = bounds[index], bounds[index + 1]
+            lane.grow_up = index < count / 2
+            lane.update(deck.waveform, deck.position, seconds_per_pixel, playhead_x,
+                        top, bottom - top, width)
+            start = deck.position - playhead_x * seconds_per_pixel
+            self.draw_beats(index, deck.beatgrid, start, seconds_per_pixel, top, bottom)
+        
+        if 0 in lanes:
+            # Time markers (seconds into the top deck's track)
+            reference = self.decks[0].position if self.decks else 0.0
+            for i, label in enumerate(self.time_labels, start=1):
+                x_pos = i * width // 4
+                seconds = reference + (x_pos - playhead_x) * seconds_per_pixel
+                self.canvas.coords(label, x_pos, 10)
+                self.canvas.itemconfigure(label, text=str(int(seconds)) if seconds >= 0 else "")
+    
+    def draw_beats(self, index, beatgrid, start, seconds_per_pixel, top, bottom):
+        """Beat markers (yellow lines) for one lane from the analyzed beatgrid"""
+        lines = self.beat_lines[index]
+        shown = 0
+        if beatgrid and beatgrid.get("bpm"):
+            period = 60.0 / beatgrid["bpm"]
+            first = math.ceil((start - beatgrid["first_beat"]) / period)
+            beat = beatgrid["first_beat"] + first * period
+            while beat < start + self.seconds_visible:
+                x = (beat - start) / seconds_per_pixel
+                if shown == len(lines):
+                    lines.append(self.canvas.create_line(0, 0, 0, 0, fill='#ffff00', width=2))
+                self.canvas.coords(lines[shown], x, top, x, bottom)
+                if shown >= self.shown_beats[index]:
+                    self.canvas.itemconfigure(lines[shown], state='normal')
+                shown += 1
+                beat += period
+        for line in lines[shown:self.shown_beats[index]]:
+            self.canvas.itemconfigure(line, state='hidden')
+        self.shown_beats[index] = shown
+
+
+class VirtualTrackList:
+    """Library track list that only materializes the rows on screen
+    
+    The Treeview holds a fixed pool of row items, one per visible line;
+    scrolling rewrites their values from the LibraryIndex columns. The
+    rows shown are ``view``, an array of track ids built from the cached
+    per-column sort permutation and the current search.
+    """
+    def __init__(self, parent, library, columns):
+        self.library = library
+        self.columns = [name for name, width in columns]
+        self.tree = ttk.Treeview(parent, columns=self.columns, show="headings", height=12,
+                                 selectmode="extended")
+        for name, width in columns:
+            self.tree.heading(name, text=name, command=lambda c=name: self.sort_by(c))
+            self.tree.column(name, width=width)
+        self.scrollbar = ttk.Scrollbar(parent, orient="vertical", command=self.yview)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        
+        self.view = np.zeros(0, dtype=np.int64) # Track ids in display order
+        self.top = 0 # Index into view of the first visible row
+        self.cursor = 0 # Index into view of the keyboard focus row
+        self.items = [] # Pooled Treeview items, top to bottom
+        self.row_ids = {} # Visible item -> track id
+        self.selected = set() # Selected track ids, including ones scrolled away
+        self.sort_column = None
+        self.descending = False
+        self.query = ""
+        self.pinned = None # Track ids to restrict the view to, in their own order
+        self.version = None # Library version the view was built from
+        self.rendering = False
+        
+        self.tree.bind('<Configure>', lambda e: self.render())
+        self.tree.bind('<MouseWheel>', lambda e: self.scroll(-3 if e.delta > 0 else 3))
+        self.tree.bind('<Button-4>', lambda e: self.scroll(-3))
+        self.tree.bind('<Button-5>', lambda e: self.scroll(3))
+        for key, step in (('<Up>', -1), ('<Down>', 1), ('<Prior>', 'page-up'),
+                          ('<Next>', 'page-down'), ('<Home>', 'home'), ('<End>', 'end')):
+            self.tree.bind(key, lambda e, s=step: self.move_cursor(s))
+        self.tree.bind('<<TreeviewSelect>>', self.on_select)
+    
+    @property
+    def visible_rows(self):
+        rowheight = int(ttk.Style().lookup("Treeview", "rowheight") or 24)
+        # The heading takes about one row
+        return max(self.tree.winfo_height() // rowheight - 1, 1)
+    
+    @PROFILER.timed("tracklist.refresh")
+    def refresh(self, force=False):
+        """Rebuild the view if the library, sort or search changed since the last build"""
+        library = self.library
+        if not force and self.version == library.version:
+            return
+        self.version = library.version
+        count = len(library.paths)
+        if self.sort_column:
+            order = library.sort_order(self.sort_column, self.descending)
+        elif self.pinned is not None:
+            order = self.pinned[library.alive[self.pinned]]
+        else:
+            order = np.flatnonzero(library.alive[:count])
+        if self.pinned is not None and self.sort_column:
+            mask = np.zeros(count, dtype=bool)
+            mask[self.pinned] = True
+            order = order[mask[order]]
+        if self.query:
+            mask = np.zeros(count, dtype=bool)
+            mask[library.search(self.query)] = True
+            order = order[mask[order]]
+        self.view = order
+        self.render()
+    
+    def set_query(self, query):
+        self.query = query
+        self.top = self.cursor = 0
+        self.refresh(force=True)
+    
+    def show_only(self, ids):
+        """Restrict the view to ids (None shows the whole library again)"""
+        self.pinned = None if ids is None else np.asarray(ids, dtype=np.int64)
+        self.top = self.cursor = 0
+        self.refresh(force=True)
+    
+    def sort_by(self, column, descending=None):
+        """Header click: sort by column, again to reverse"""
+        if descending is None:
+            descending = self.sort_column == column and not self.descending
+        self.descending = descending
+        self.sort_column = column
+        for name in self.columns:
+            arrow = (" ▼" if self.descending else " ▲") if name == column else ""
+            self.tree.heading(name, text=name + arrow)
+        self.refresh(force=True)
+    
+    @PROFILER.timed("tracklist.render")
+    def render(self):
+        """Write the visible slice of the view into the pooled row items"""
+        rows = self.visible_rows
+        while len(self.items) < rows:
+            self.items.append(self.tree.insert("", 'end', values=()))
+        total = len(self.view)
+        self.top = max(min(self.top, total - rows), 0)
+        shown = self.view[self.top:self.top + rows]
+        self.rendering = True
+        self.row_ids = {}
+        for item, track_id in zip(self.items, shown):
+            self.tree.item(item, values=self.format_row(track_id))
+            self.row_ids[item] = int(track_id)
+        # Spare pool items are detached, not deleted, so growing back is free
+        self.tree.set_children("", *self.items[:len(shown)])
+        self.tree.selection_set([item for item, track_id in self.row_ids.items()
+                                 if track_id in self.selected])
+        self.rendering = False
+        if total:
+            self.scrollbar.set(self.top / total, min((self.top + rows) / total, 1.0))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+    
+    def format_row(self, track_id):
+        library = self.library
+        bpm, bitrate, length, plays = (library.numeric[name][track_id]
+                                       for name in ("bpm", "bitrate", "length", "plays"))
+        minutes, seconds = divmod(int(length), 60) if length == length else (0, 0)
+        return (library.text["song"][track_id], library.text["artist"][track_id],
+                library.text["album"][track_id],
+                f"{bpm:.1f}" if bpm == bpm else "",
+                f"{int(bitrate)}" if bitrate == bitrate else "",
+                f"{minutes}:{seconds:02d}" if length == length else "",
+                f"{int(plays)}" if plays == plays else "")
+    
+    def yview(self, *args):
+        """Scrollbar command"""
+        if args[0] == "moveto":
+            self.top = int(float(args[1]) * len(self.view))
+            self.render()
+        elif args[0] == "scroll":
+            count = int(args[1])
+            self.scroll(count * self.visible_rows if args[2] == "pages" else count)
+    
+    def scroll(self, rows):
+        self.top += rows
+        self.render()
+        return "break"
+    
+    def move_cursor(self, step):
+        """Keyboard navigation over the whole view, not just the visible rows"""
+        total = len(self.view)
+        if not total:
+            return "break"
+        rows = self.visible_rows
+        if step == 'home':
+            cursor = 0
+        elif step == 'end':
+            cursor = total - 1
+        elif step in ('page-up', 'page-down'):
+            cursor = self.cursor + (rows if step == 'page-down' else -rows)
+        else:
+            cursor = self.cursor + step
+        self.cursor = max(min(cursor, total - 1), 0)
+        if self.cursor < self.top:
+            self.top = self.cursor
+        elif self.cursor >= self.top + rows:
+            self.top = self.cursor - rows + 1
+        self.selected = {int(self.view[self.cursor])}
+        self.render()
+        return "break"
+    
+    def on_select(self, event=None):
+        if self.rendering:
+            return
+        picked = {self.row_ids[item] for item in self.tree.selection() if item in self.row_ids}
+        # Selections scrolled out of view survive ctrl/shift clicks on visible rows
+        self.selected = (self.selected - set(self.row_ids.values())) | picked
+        focus = self.tree.focus()
+        if focus in self.row_ids:
+            self.cursor = self.top + self.items.index(focus)
+    
+    def selected_paths(self):
+        """Selected tracks in display order"""
+        paths = self.library.paths
+        chosen = self.view[np.isin(self.view, list(self.selected))]
+        return [paths[i] for i in chosen]
+    
+    def path_at(self, y):
+        track_id = self.row_ids.get(self.tree.identify_row(y))
+        return None if track_id is None else self.library.paths[track_id]
 
 
 class MusicAnalyzerDJ:
@@ -283,7 +872,40 @@ class MusicAnalyzerDJ:
         self.tracks = [] # Stores full paths of loaded tracks
         self.deck1 = None # Will store SeratoDeck instance for Deck 1
         self.deck2 = None # Will store SeratoDeck instance for Deck 2
+        self.decks = [] # All SeratoDeck instances, in deck number order
+        self.deck_count = 2 # Decks on screen: 2, or 4 in 4 deck view
+        self.layout = "horizontal" # Decks either side of the waveform, or below it
+        self.library = LibraryIndex() # Search index over the library columns
+        self.compatibility = CompatibilityIndex(self.library)
+        self.smart_crates = SmartCrates(self.library)
+        self.current_crate = None # Smart crate shown in the track list
+        self.resolver = PathResolver(self.library) # Playlist paths -> library ids
+        self.playlist_io = PlaylistWorker()
+        self.scanner = FolderScanner()
+        self.music_folders = set() # Folders added to the sidebar
+        self.scan_root = None
+        self.scan_paths = [] # Everything the current scan found
+        self.scan_errors = 0 # Folders or files the current scan could not read
+        self.analysis_engine = AnalysisEngine()
+        self.analysis_results = {} # Full path -> analysis result dict
+        self.analysis_polling = False
+        self.store = AnalysisStore()
+        self.tag_writer = TagWriter()
+        self.play_log = PlayLog()
+        self.play_counts = self.play_log.play_counts() # Path -> plays, for the library column
+        self.history_session = None # Session shown in the History tab
+        self.tag_edits = {} # Path -> changes being written, applied to the library as they land
+        self.mixer = Mixer()
+        self.overlay = None # Performance overlay label while shown
+        self.overlay_after = None # Pending update_overlay callback
+        self.refresh = RefreshScheduler(self.root)
         self.setup_ui()
+        self.audio_out = open_sink(self.mixer)
+        self.audio_out.start()
+        self.refresh.every_frame(self.update_transport)
+        self.refresh.start()
+        self.poll_history()
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
     
     def setup_ui(self):
         # Menu bar
@@ -303,7 +925,7 @@ class MusicAnalyzerDJ:
         file_menu.add_separator()
         file_menu.add_command(label="⚙️ Preferences...", command=self.preferences)
         file_menu.add_separator()
-        file_menu.add_command(label="❌ Exit", command=self.root.quit)
+        file_menu.add_command(label="❌ Exit", command=self.close)
         
         # VIEW MENU
         view_menu = tk.Menu(menubar, tearoff=0, bg='#2a2a2a', fg='white',
@@ -313,20 +935,35 @@ class MusicAnalyzerDJ:
         view_menu.add_command(label="🎚️ Vertical Layout", command=lambda: self.change_layout("vertical"))
         view_menu.add_command(label="🎚️ 4 Deck View", command=lambda: self.change_layout("4deck"))
         view_menu.add_separator()
+        view_menu.add_command(label="🔥 Most Played", command=self.show_most_played)
+        view_menu.add_separator()
         view_menu.add_checkbutton(label="Show Library") # Placeholder
         view_menu.add_checkbutton(label="Show Waveforms") # Placeholder
         view_menu.add_separator()
         view_menu.add_command(label="⛶ Fullscreen", command=self.toggle_fullscreen)
+        view_menu.add_separator()
+        self.overlay_var = tk.BooleanVar(value=False)
+        view_menu.add_checkbutton(label="⏱ Performance Overlay", variable=self.overlay_var,
+                                  command=self.toggle_overlay)
+        view_menu.add_command(label="💾 Export Performance Trace...", command=self.export_trace)
         
         # TRACK MENU
         track_menu = tk.Menu(menubar, tearoff=0, bg='#2a2a2a', fg='white',
                             activebackground='#0066cc', activeforeground='white')
         menubar.add_cascade(label="Track", menu=track_menu)
         track_menu.add_command(label="🔍 Analyze Files", command=self.analyze_files)
+        track_menu.add_command(label="⏹ Cancel Analysis", command=self.cancel_analysis)
+        track_menu.add_command(label="⏯ Resume Analysis", command=self.resume_analysis)
         track_menu.add_command(label="✏️ Edit ID3 Tags...", command=self.edit_tags)
         track_menu.add_command(label="🎵 Set Beatgrid...", command=self.set_beatgrid)
         track_menu.add_separator()
         track_menu.add_command(label="📊 Track Info...", command=self.track_info)
+        track_menu.add_separator()
+        track_menu.add_command(label="🎹 Tracks That Mix With Deck 1",
+                               command=lambda: self.show_compatible(self.deck1))
+        track_menu.add_command(label="🎹 Tracks That Mix With Deck 2",
+                               command=lambda: self.show_compatible(self.deck2))
+        track_menu.add_command(label="📚 Show All Tracks", command=self.show_all_tracks)
         
         # PLAYLIST MENU
         playlist_menu = tk.Menu(menubar, tearoff=0, bg='#2a2a2a', fg='white',
@@ -355,14 +992,16 @@ class MusicAnalyzerDJ:
         top_section = tk.Frame(main, bg='#0a0a0a')
         top_section.pack(fill=tk.BOTH, expand=True)
         
-        # Left deck
-        self.deck1 = SeratoDeck(top_section, 1, "Badlands")
-        
-        # Center waveform
+        # Decks are packed into the columns either side of the waveform, so
+        # change_layout can rearrange them without rebuilding any widgets
+        self.top_section = top_section
+        self.deck_columns = [tk.Frame(top_section, bg='#0a0a0a') for _ in range(2)]
         self.center_waveform = SeratoWaveform(top_section)
-        
-        # Right deck
-        self.deck2 = SeratoDeck(top_section, 2, "Feel me")
+        self.center_waveform.scheduler = self.refresh
+        self.add_deck("Badlands")
+        self.add_deck("Feel me")
+        self.deck1, self.deck2 = self.decks
+        self.arrange_decks()
         
         # Bottom section - Library browser
         self.create_library_browser(main)
@@ -398,10 +1037,19 @@ class MusicAnalyzerDJ:
         
         tk.Label(search_frame, text="🔍", bg='#2a2a2a', fg='white').pack(side=tk.LEFT)
         self.search_var = tk.StringVar()
+        self.search_var.trace_add("write", lambda *args: self.apply_search())
         search_entry = tk.Entry(search_frame, textvariable=self.search_var,
                                bg='#333', fg='white', width=20, relief=tk.FLAT)
         search_entry.pack(side=tk.LEFT, padx=5)
         
+        # Scan and analysis progress
+        self.scan_label = tk.Label(tabs, text="", font=("Arial", 9),
+                                   fg="#999", bg='#2a2a2a')
+        self.scan_label.pack(side=tk.RIGHT, padx=10)
+        self.analysis_label = tk.Label(tabs, text="", font=("Arial", 9),
+                                       fg="#999", bg='#2a2a2a')
+        self.analysis_label.pack(side=tk.RIGHT, padx=10)
+        
         # Browser content
         self.browser_content_frame = tk.Frame(browser, bg='#1a1a1a')
         self.browser_content_frame.pack(fill=tk.BOTH, expand=True)
@@ -436,6 +1084,11 @@ class MusicAnalyzerDJ:
         self.folder_tree.insert(music_id, 'end', text="House")
         self.folder_tree.insert(music_id, 'end', text="Techno")
         
+        for name, rules in self.store.smart_crates():
+            self.add_smart_crate(name, rules)
+        for name in self.store.crates():
+            self.add_crate(name)
+        
         self.folder_tree.bind('<<TreeviewSelect>>', self.on_folder_click)
         
         tk.Button(self.files_sidebar, text="📁 SELECT FOLDER", font=("Arial", 9, "bold"),
@@ -447,28 +1100,10 @@ class MusicAnalyzerDJ:
         self.list_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         
         # Column headers
-        columns = ("song", "artist", "album", "bpm", "bitrate", "length")
-        self.tree = ttk.Treeview(self.list_frame, columns=columns, show="headings", height=12)
-        
-        self.tree.heading("song", text="song")
-        self.tree.heading("artist", text="artist")
-        self.tree.heading("album", text="album")
-        self.tree.heading("bpm", text="bpm")
-        self.tree.heading("bitrate", text="bitrate")
-        self.tree.heading("length", text="length")
-        
-        self.tree.column("song", width=250)
-        self.tree.column("artist", width=200)
-        self.tree.column("album", width=200)
-        self.tree.column("bpm", width=60)
-        self.tree.column("bitrate", width=80)
-        self.tree.column("length", width=80)
-        
-        scrollbar = ttk.Scrollbar(self.list_frame, orient="vertical", command=self.tree.yview)
-        self.tree.configure(yscrollcommand=scrollbar.set)
-        
-        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        columns = (("song", 250), ("artist", 200), ("album", 200),
+                   ("bpm", 60), ("bitrate", 80), ("length", 80), ("plays", 50))
+        self.track_list = VirtualTrackList(self.list_frame, self.library, columns)
+        self.tree = self.track_list.tree
         
         # RIGHT-CLICK MENU
         self.tree.bind('<Button-3>', self.show_context_menu)
@@ -482,6 +1117,1026 @@ class MusicAnalyzerDJ:
         self.create_browse_tab_content()
         self.create_prepare_tab_content()
         self.create_history_tab_content()
+    
+    def add_deck(self, name=None):
+        """Create the next deck and its player in the audio engine"""
+        number = len(self.decks) + 1
+        deck = SeratoDeck(self.top_section, number, name or f"Deck {number}")
+        deck.on_load = self.on_deck_loaded
+        deck.on_cues_changed = self.save_cues
+        deck.on_history = self.record_history
+        deck.player = self.mixer.add_deck()
+        deck.scheduler = self.refresh
+        self.decks.append(deck)
+        return deck
+    
+    def change_layout(self, layout):
+        """Switch between horizontal and vertical layouts, or toggle 4 deck view"""
+        if layout == "4deck":
+            self.deck_count = 2 if self.deck_count == 4 else 4
+            while len(self.decks) < self.deck_count:
+                self.add_deck()
+            for deck in self.decks[self.deck_count:]:
+                if deck.is_playing:
+                    deck.toggle_play() # A hidden deck cannot be stopped
+        else:
+            self.layout = layout
+        self.arrange_decks()
+    
+    def arrange_decks(self):
+        """Pack the visible decks: odd numbers on the left, even on the right"""
+        left, right = self.deck_columns
+        for widget in (left, right, self.center_waveform.frame):
+            widget.pack_forget()
+        for deck in self.decks:
+            deck.frame.pack_forget()
+        if self.layout == "vertical":
+            # Waveform across the top, decks in a row under it
+            self.center_waveform.frame.pack(side=tk.TOP, fill=tk.BOTH, expand=True,
+                                            padx=5, pady=5)
+            left.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+            right.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        else:
+            left.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+            self.center_waveform.frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True,
+                                            padx=5, pady=5)
+            right.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        visible = self.decks[:self.deck_count]
+        for index, deck in enumerate(visible):
+            deck.frame.pack(in_=self.deck_columns[index % 2], side=tk.LEFT, fill=tk.BOTH,
+                            expand=True, padx=5, pady=5)
+        self.center_waveform.decks = visible
+        self.center_waveform.mark_dirty()
+    
+    def update_transport(self):
+        """Each frame: mark the decks and waveform lanes whose playhead moved"""
+        lanes = self.center_waveform.decks
+        for deck in self.decks:
+            if deck.refresh_transport() and deck in lanes:
+                self.center_waveform.mark_dirty(lanes.index(deck))
+    
+    def toggle_overlay(self):
+        """Show frame times, underruns and queue depths; profiling runs while it is shown"""
+        if self.overlay_var.get():
+            PROFILER.enable()
+            self.overlay = tk.Label(self.root, font=("Courier", 9), bg='#000000', fg='#00ff88',
+                                    justify=tk.LEFT, anchor=tk.NW, padx=6, pady=4)
+            self.overlay.place(relx=1.0, y=4, anchor=tk.NE, x=-4)
+            self.update_overlay()
+        else:
+            PROFILER.disable()
+            if self.overlay_after is not None:
+                # Otherwise a quick off/on leaves the old loop running next to the new one
+                self.root.after_cancel(self.overlay_after)
+                self.overlay_after = None
+            if self.overlay is not None:
+                self.overlay.destroy()
+                self.overlay = None
+    
+    def queue_depths(self):
+        """Backlog of every worker queue the UI drains, plus audio buffered per deck"""
+        depths = {
+            "analysis pending": len(self.analysis_engine.pending),
+            "analysis events": self.analysis_engine.events.qsize(),
+            "scan events": self.scanner.events.qsize(),
+            "tag events": self.tag_writer.events.qsize(),
+            "playlist events": self.playlist_io.events.qsize(),
+            "history unflushed": len(self.play_log._pending),
+        }
+        for number, deck in enumerate(self.mixer.decks, 1):
+            depths[f"deck {number} commands"] = len(deck.commands)
+            end = deck.ring.window[2]
+            depths[f"deck {number} buffered s"] = round(max(end - deck.position, 0) / deck.sample_rate, 1)
+        return depths
+    
+    def update_overlay(self):
+        if self.overlay is None:
+            return
+        stats = PROFILER.stats()
+        frames = stats["frames"]
+        lines = [f"frame p50 {frames['p50_ms']:6.1f} ms  p99 {frames['p99_ms']:6.1f} ms",
+                 f"dropped frames {frames['dropped']}   underruns {self.mixer.underruns}"]
+        for name in ("draw_waveform", "draw_circular_bpm", "tracklist.render", "audio.render",
+                     "decode", "analysis"):
+            span = stats["spans"].get(name)
+            if span:
+                lines.append(f"{name:<18} p99 {span['p99_ms']:6.2f} ms  x{span['calls']}")
+        for name, depth in self.queue_depths().items():
+            PROFILER.gauge(name, depth)
+            lines.append(f"{name:<18} {depth}")
+        self.overlay.config(text="\n".join(lines))
+        self.overlay.lift()
+        self.overlay_after = self.root.after(500, self.update_overlay)
+    
+    def export_trace(self):
+        """Save the profiled spans as a trace for chrome://tracing or Perfetto"""
+        if not PROFILER.enabled and not PROFILER.events:
+            messagebox.showinfo("Performance Trace",
+                                "Nothing recorded yet: turn on View > Performance Overlay first.")
+            return
+        path = filedialog.asksaveasfilename(title="Export Performance Trace",
+                                            defaultextension=".json",
+                                            filetypes=[("Chrome trace", "*.json")])
+        if not path:
+            return
+        try:
+            count = PROFILER.export_chrome_trace(path)
+        except OSError as exc:
+            messagebox.showerror("Performance Trace", f"Could not write {path}:\n{exc}")
+            return
+        self.analysis_label.config(text=f"Wrote {count} trace events to {os.path.basename(path)}")
+    
+    def preferences(self):
+        """Worker counts for analysis, scanning and tag writing; they apply from the next run"""
+        dialog = tk.Toplevel(self.root, bg='#1a1a1a')
+        dialog.title("Preferences")
+        fields = [(self.analysis_engine, "jobs", "Analysis processes"),
+                  (self.scanner, "workers", "Folder scan threads"),
+                  (self.tag_writer, "workers", "Tag writer threads")]
+        entries = []
+        for row, (owner, name, label) in enumerate(fields):
+            tk.Label(dialog, text=label, fg='white', bg='#1a1a1a',
+                     anchor=tk.W).grid(row=row, column=0, sticky=tk.W, padx=10, pady=3)
+            entry = tk.Entry(dialog, bg='#2a2a2a', fg='white', insertbackground='white')
+            entry.insert(0, str(getattr(owner, name)))
+            entry.grid(row=row, column=1, padx=10, pady=3)
+            entries.append(entry)
+        tk.Label(dialog, text=f"Analysis cache: {self.store.path}", fg='#999', bg='#1a1a1a',
+                 font=("Arial", 8)).grid(row=len(fields), column=0, columnspan=2, padx=10)
+        
+        def save():
+            try:
+                values = [int(entry.get()) for entry in entries]
+            except ValueError:
+                values = [0]
+            if min(values) < 1:
+                messagebox.showerror("Preferences", "Worker counts must be whole numbers of 1 or more",
+                                     parent=dialog)
+                return
+            for (owner, name, label), value in zip(fields, values):
+                setattr(owner, name, value)
+            dialog.destroy()
+        
+        tk.Button(dialog, text="Save", bg='#0066cc', fg='white', relief=tk.FLAT,
+                  command=save).grid(row=len(fields) + 1, column=1, sticky=tk.E, padx=10, pady=10)
+    
+    def toggle_fullscreen(self):
+        self.root.attributes('-fullscreen', not self.root.attributes('-fullscreen'))
+    
+    def show_guide(self):
+        messagebox.showinfo("User Guide",
+            "1. File > Load Folder adds a music folder to the library.\n"
+            "2. Track > Analyze Files finds BPM, key and beatgrid; results are cached.\n"
+            "3. Double-click a track (or right-click it) to load it onto a deck.\n"
+            "4. Track > Tracks That Mix With Deck 1/2 lists harmonically compatible tracks.\n"
+            "5. Search with words or filters such as bpm:120-128 key:8A.\n"
+            "6. The Browse tab narrows the library by key and tempo.")
+    
+    def show_shortcuts(self):
+        messagebox.showinfo("Keyboard Shortcuts",
+            "Track list\n"
+            "  Up / Down, Page Up / Page Down, Home / End: move the selection\n"
+            "  Double-click: load onto a free deck\n"
+            "  Right-click: track menu\n"
+            "\n"
+            "Waveform\n"
+            "  Mouse wheel: zoom in and out")
+    
+    def show_about(self):
+        messagebox.showinfo("About", "Music Analyzer DJ\nSerato style DJ software by Dave Nelligan")
+    
+    def load_files(self):
+        """Add individual audio files to the library"""
+        paths = filedialog.askopenfilenames(
+            title="Load Files", filetypes=[("Audio Files", "*.mp3 *.wav *.flac *.m4a")])
+        records = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError as exc:
+                self.report_problem(f"Load: {path}: {exc}")
+                continue
+            records.append(scan_file(path, stat.st_size, stat.st_mtime_ns))
+        if records:
+            self.add_tracks(records)
+            self.refresh_analysis([record["path"] for record in records])
+            self.library.freeze()
+    
+    def select_folder(self):
+        """Add every audio file under a folder to the library"""
+        folder = filedialog.askdirectory(title="Select Music Folder")
+        if not folder:
+            return
+        if folder not in self.music_folders:
+            self.music_folders.add(folder)
+            self.folder_tree.insert("music_folders", 'end', folder,
+                                    text=os.path.basename(folder) or folder)
+        self.scan_folder(folder)
+    
+    def on_folder_click(self, event=None):
+        """Show a smart crate, or re-scan a music folder to pick up new files"""
+        selection = self.folder_tree.selection()
+        if selection and selection[0].startswith("smart:"):
+            self.show_smart_crate(selection[0][len("smart:"):])
+        elif selection and selection[0].startswith("crate:"):
+            self.show_crate(selection[0][len("crate:"):])
+        elif selection and selection[0] in self.music_folders and not self.scanner.running:
+            self.scan_folder(selection[0])
+    
+    def new_smart_crate(self):
+        """Define a smart crate from rules on BPM, key, artist, date added and play count"""
+        dialog = tk.Toplevel(self.root, bg='#1a1a1a')
+        dialog.title("New Smart Crate")
+        fields = [("name", "Name"), ("bpm_low", "BPM from"), ("bpm_high", "BPM to"),
+                  ("keys", "Keys (e.g. 8A, 9A)"), ("artist", "Artist contains"),
+                  ("added", "Added since (YYYY-MM-DD)"), ("plays", "Played at least")]
+        entries = {}
+        for row, (name, label) in enumerate(fields):
+            tk.Label(dialog, text=label, fg='white', bg='#1a1a1a',
+                     anchor=tk.W).grid(row=row, column=0, sticky=tk.W, padx=10, pady=3)
+            entries[name] = tk.Entry(dialog, bg='#2a2a2a', fg='white', insertbackground='white')
+            entries[name].grid(row=row, column=1, padx=10, pady=3)
+        
+        def create():
+            values = {name: entry.get().strip() for name, entry in entries.items()}
+            try:
+                rules = smart_crate_rules(values)
+            except ValueError as exc:
+                messagebox.showerror("Smart Crate", str(exc), parent=dialog)
+                return
+            if not values["name"]:
+                messagebox.showerror("Smart Crate", "Give the crate a name", parent=dialog)
+                return
+            self.store.save_smart_crate(values["name"], rules)
+            self.add_smart_crate(values["name"], rules)
+            dialog.destroy()
+            self.show_smart_crate(values["name"])
+        
+        tk.Button(dialog, text="Create", bg='#0066cc', fg='white', relief=tk.FLAT,
+                  command=create).grid(row=len(fields), column=1, sticky=tk.E, padx=10, pady=10)
+    
+    def add_smart_crate(self, name, rules):
+        self.smart_crates.add(name, rules)
+        iid = "smart:" + name
+        if not self.folder_tree.exists(iid):
+            self.folder_tree.insert("crates", 'end', iid, text=f"⚙️ {name}")
+    
+    def show_smart_crate(self, name):
+        self.current_crate = name
+        ids = self.smart_crates.ids(name)
+        self.track_list.show_only(ids)
+        self.analysis_label.config(text=f"{len(ids)} tracks in {name}")
+    
+    def create_browse_tab_content(self):
+        """Browse tab: pick keys and tempo ranges to filter the track list"""
+        self.browse_lists = {}
+        for name, title, values in (
+                ("key", "Key", [f"{number}{mode}" for mode in "AB" for number in range(1, 13)]),
+                ("bpm", "BPM", [f"{low}-{low + 9}" for low in range(60, 200, 10)])):
+            column = tk.Frame(self.browse_frame, bg='#1a1a1a')
+            column.pack(side=tk.LEFT, fill=tk.Y, padx=5, pady=5)
+            tk.Label(column, text=title, font=("Arial", 9, "bold"),
+                     fg='#999', bg='#1a1a1a', anchor=tk.W).pack(fill=tk.X)
+            listbox = tk.Listbox(column, bg='#2a2a2a', fg='white', relief=tk.FLAT,
+                                 selectmode=tk.MULTIPLE, exportselection=False, width=12)
+            for value in values:
+                listbox.insert(tk.END, value)
+            listbox.pack(fill=tk.Y, expand=True)
+            listbox.bind('<<ListboxSelect>>', lambda e: self.browse_filter())
+            self.browse_lists[name] = listbox
+        tk.Button(self.browse_frame, text="Show in Files", bg='#0066cc', fg='white',
+                  relief=tk.FLAT, command=lambda: self.switch_browser_tab("Files")
+                  ).pack(anchor=tk.NW, padx=10, pady=5)
+        tk.Button(self.browse_frame, text="Clear", bg='#2a2a2a', fg='white', relief=tk.FLAT,
+                  command=self.clear_browse).pack(anchor=tk.NW, padx=10)
+    
+    def browse_filter(self):
+        """Turn the Browse selections into a search, e.g. key:8A,9A bpm:120-129"""
+        terms = []
+        for name, listbox in self.browse_lists.items():
+            picked = [listbox.get(index) for index in listbox.curselection()]
+            if name == "key" and picked:
+                terms.append("key:" + ",".join(picked))
+            elif picked:
+                # Search takes one range per column, so span the lowest to the highest picked
+                lows, highs = zip(*(map(int, value.split("-")) for value in picked))
+                terms.append(f"bpm:{min(lows)}-{max(highs)}")
+        self.search_var.set(" ".join(terms))
+    
+    def clear_browse(self):
+        for listbox in self.browse_lists.values():
+            listbox.selection_clear(0, tk.END)
+        self.search_var.set("")
+    
+    def create_prepare_tab_content(self):
+        """Prepare tab: progress of bulk tag writes and the files that failed"""
+        self.tag_status = tk.Label(self.prepare_frame, text="No tags written yet",
+                                   font=("Arial", 10), fg='white', bg='#1a1a1a', anchor=tk.W)
+        self.tag_status.pack(fill=tk.X, padx=10, pady=5)
+        tk.Button(self.prepare_frame, text="Cancel", bg='#2a2a2a', fg='white', relief=tk.FLAT,
+                  command=self.tag_writer.cancel).pack(anchor=tk.W, padx=10)
+        tk.Label(self.prepare_frame, text="Errors", font=("Arial", 9, "bold"),
+                 fg='#999', bg='#1a1a1a', anchor=tk.W).pack(fill=tk.X, padx=10, pady=(10, 0))
+        self.tag_errors = tk.Listbox(self.prepare_frame, bg='#2a2a2a', fg='#ff6666',
+                                     relief=tk.FLAT, height=8)
+        self.tag_errors.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        tk.Label(self.prepare_frame, text="Scan and analysis problems", font=("Arial", 9, "bold"),
+                 fg='#999', bg='#1a1a1a', anchor=tk.W).pack(fill=tk.X, padx=10, pady=(10, 0))
+        self.problems = tk.Listbox(self.prepare_frame, bg='#2a2a2a', fg='#ff6666',
+                                   relief=tk.FLAT, height=8)
+        self.problems.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+    
+    def report_problem(self, text):
+        """List a file or folder that could not be scanned or analyzed on the Prepare tab"""
+        self.problems.insert(tk.END, text)
+        self.problems.see(tk.END)
+    
+    def switch_browser_tab(self, tab):
+        """Show one browser tab's content and highlight its button"""
+        self.current_browser_tab.set(tab)
+        buttons = {"Files": self.files_tab_btn, "Browse": self.browse_tab_btn,
+                   "Prepare": self.prepare_tab_btn, "History": self.history_tab_btn}
+        for name, button in buttons.items():
+            button.config(bg='#0066cc' if name == tab else '#2a2a2a')
+        for frame in (self.files_sidebar, self.list_frame, self.browse_frame,
+                      self.prepare_frame, self.history_frame):
+            frame.pack_forget()
+        if tab == "Files":
+            self.files_sidebar.pack(side=tk.LEFT, fill=tk.Y)
+            self.list_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        else:
+            frame = {"Browse": self.browse_frame, "Prepare": self.prepare_frame,
+                     "History": self.history_frame}[tab]
+            frame.pack(fill=tk.BOTH, expand=True)
+        if tab == "History":
+            self.refresh_history()
+    
+    def load_to_deck(self, event=None, deck=None):
+        """Load the clicked (or first selected) track onto deck, or the first deck not playing"""
+        path = self.track_list.path_at(event.y) if event is not None else None
+        if path is None:
+            paths = self.track_list.selected_paths()
+            path = paths[0] if paths else None
+        if path is None:
+            return
+        if deck is None:
+            idle = [deck for deck in self.decks[:self.deck_count] if not deck.is_playing]
+            if not idle:
+                messagebox.showwarning("Load Track", "Every deck is playing; stop one first")
+                return
+            deck = idle[0]
+        deck.load_track(path)
+    
+    def show_context_menu(self, event):
+        """Right-click menu for the track under the pointer"""
+        item = self.tree.identify_row(event.y)
+        track_id = self.track_list.row_ids.get(item)
+        if track_id is None:
+            return
+        if track_id not in self.track_list.selected:
+            self.track_list.selected = {track_id}
+            self.track_list.render()
+        menu = tk.Menu(self.root, tearoff=0, bg='#2a2a2a', fg='white',
+                       activebackground='#0066cc', activeforeground='white')
+        for deck in self.decks[:self.deck_count]:
+            menu.add_command(label=f"Load to Deck {deck.deck_number}",
+                             command=lambda d=deck: self.load_to_deck(deck=d))
+        menu.add_separator()
+        menu.add_command(label="Edit ID3 Tags...", command=self.edit_tags)
+        menu.add_command(label="Track Info...", command=self.track_info)
+        menu.add_command(label="Save Crate...", command=self.save_crate)
+        try:
+            menu.tk_popup(event.x_root, event.y_root)
+        finally:
+            menu.grab_release()
+    
+    def track_info(self):
+        """Library fields and analysis of the selected track"""
+        paths = self.track_list.selected_paths()
+        if not paths:
+            messagebox.showwarning("Track Info", "Select a track first!")
+            return
+        path = paths[0]
+        track_id = self.library.ids[path]
+        result = self.analysis_results.get(path) or {}
+        lines = [path, "",
+                 f"Title: {self.library.text['song'][track_id]}",
+                 f"Artist: {self.library.text['artist'][track_id]}",
+                 f"Album: {self.library.text['album'][track_id]}"]
+        if result:
+            key = result.get("key") or ""
+            camelot = to_camelot(key)
+            beatgrid = result.get("beatgrid") or {}
+            lines += [f"Length: {format_time(result.get('duration') or 0)}",
+                      f"BPM: {result['bpm']:.1f}" if result.get("bpm") else "BPM: unknown",
+                      f"Key: {key}" + (f" ({camelot})" if camelot not in ("", key) else "")
+                      if key else "Key: unknown",
+                      f"First beat: {beatgrid['first_beat']:.3f}s" if beatgrid else "Beatgrid: none"]
+            if result.get("loudness") is not None:
+                lines.append(f"Loudness: {result['loudness']:.1f} dB")
+        else:
+            lines.append("Not analyzed yet")
+        lines.append(f"Plays: {self.play_counts.get(path, 0)}")
+        messagebox.showinfo("Track Info", "\n".join(lines))
+    
+    def set_beatgrid(self):
+        """Set a deck's BPM and first beat by hand, for tracks the analysis got wrong"""
+        loaded = [deck for deck in self.decks[:self.deck_count] if deck.full_track_path]
+        if not loaded:
+            messagebox.showwarning("Set Beatgrid", "Load a track onto a deck first!")
+            return
+        dialog = tk.Toplevel(self.root, bg='#1a1a1a')
+        dialog.title("Set Beatgrid")
+        deck_var = tk.StringVar(value=str(loaded[0].deck_number))
+        tk.Label(dialog, text="Deck", fg='white', bg='#1a1a1a',
+                 anchor=tk.W).grid(row=0, column=0, sticky=tk.W, padx=10, pady=3)
+        tk.OptionMenu(dialog, deck_var, *[str(deck.deck_number) for deck in loaded]
+                      ).grid(row=0, column=1, sticky=tk.W, padx=10, pady=3)
+        entries = {}
+        for row, (name, label) in enumerate((("bpm", "BPM"), ("first_beat", "First beat (s)")), 1):
+            tk.Label(dialog, text=label, fg='white', bg='#1a1a1a',
+                     anchor=tk.W).grid(row=row, column=0, sticky=tk.W, padx=10, pady=3)
+            entries[name] = tk.Entry(dialog, bg='#2a2a2a', fg='white', insertbackground='white')
+            entries[name].grid(row=row, column=1, padx=10, pady=3)
+        grid = loaded[0].beatgrid or {"bpm": loaded[0].track_bpm, "first_beat": 0.0}
+        entries["bpm"].insert(0, f"{grid['bpm']:.2f}")
+        entries["first_beat"].insert(0, f"{grid['first_beat']:.3f}")
+        
+        def apply():
+            try:
+                bpm, first_beat = (float(entries[name].get()) for name in ("bpm", "first_beat"))
+            except ValueError:
+                bpm = first_beat = -1.0
+            if not 20 <= bpm <= 400 or first_beat < 0:
+                messagebox.showerror("Set Beatgrid", "BPM must be 20-400 and the first beat 0 or more",
+                                     parent=dialog)
+                return
+            deck = self.decks[int(deck_var.get()) - 1]
+            deck.set_beatgrid(bpm, first_beat)
+            path = deck.full_track_path
+            self.store.set_beatgrid(path, deck.beatgrid)
+            if path in self.analysis_results:
+                self.analysis_results[path].update(bpm=bpm, beatgrid=deck.beatgrid)
+            if path in self.library.ids:
+                self.library.update(path, bpm=bpm)
+                self.refresh_library_view()
+            self.center_waveform.mark_dirty()
+            dialog.destroy()
+        
+        tk.Button(dialog, text="Apply", bg='#0066cc', fg='white', relief=tk.FLAT,
+                  command=apply).grid(row=3, column=1, sticky=tk.E, padx=10, pady=10)
+    
+    def edit_tags(self):
+        """Write title/artist/album/comment and analyzed BPM, key and cues to the selected files"""
+        paths = self.track_list.selected_paths()
+        if not paths:
+            messagebox.showwarning("Edit Tags", "Select some tracks first!")
+            return
+        if self.tag_writer.running:
+            messagebox.showinfo("Edit Tags", "Tags are still being written")
+            return
+        dialog = tk.Toplevel(self.root, bg='#1a1a1a')
+        dialog.title(f"Edit Tags ({len(paths)} tracks)")
+        fields = [("title", "Title"), ("artist", "Artist"), ("album", "Album"),
+                  ("comment", "Comment")]
+        entries = {}
+        for row, (name, label) in enumerate(fields):
+            tk.Label(dialog, text=label, fg='white', bg='#1a1a1a',
+                     anchor=tk.W).grid(row=row, column=0, sticky=tk.W, padx=10, pady=3)
+            entries[name] = tk.Entry(dialog, bg='#2a2a2a', fg='white', insertbackground='white')
+            entries[name].grid(row=row, column=1, padx=10, pady=3)
+        tk.Label(dialog, text="Empty fields are left as they are", fg='#999', bg='#1a1a1a',
+                 font=("Arial", 8)).grid(row=len(fields), column=0, columnspan=2, padx=10)
+        analyzed = tk.BooleanVar(value=True)
+        tk.Checkbutton(dialog, text="Write analyzed BPM, key and hot cues", variable=analyzed,
+                       fg='white', bg='#1a1a1a', selectcolor='#2a2a2a',
+                       activebackground='#1a1a1a').grid(row=len(fields) + 1, column=0,
+                                                        columnspan=2, sticky=tk.W, padx=10)
+        
+        def write():
+            values = {name: entry.get().strip() for name, entry in entries.items()}
+            common = {name: value for name, value in values.items() if value}
+            edits = {}
+            for path in paths:
+                changes = dict(common)
+                if analyzed.get():
+                    changes.update(self.analyzed_tags(path))
+                if changes:
+                    edits[path] = changes
+            dialog.destroy()
+            if edits:
+                self.write_tags(edits)
+        
+        tk.Button(dialog, text="Write Tags", bg='#0066cc', fg='white', relief=tk.FLAT,
+                  command=write).grid(row=len(fields) + 2, column=1, sticky=tk.E, padx=10, pady=10)
+    
+    def analyzed_tags(self, path):
+        """BPM, key and hot cues known for path, as tag changes"""
+        changes = {}
+        result = self.analysis_results.get(path) or {}
+        if result.get("bpm"):
+            changes["bpm"] = result["bpm"]
+        if result.get("key"):
+            changes["key"] = result["key"]
+        cues = self.store.get_cues(path)
+        if cues and cues.get("hotcues"):
+            changes["cues"] = cues
+        return changes
+    
+    def write_tags(self, edits):
+        self.tag_edits = edits
+        self.tag_errors.delete(0, tk.END)
+        self.tag_writer.start(edits)
+        self.switch_browser_tab("Prepare")
+        self.poll_tags()
+    
+    def poll_tags(self):
+        """Apply written tags to the library and show progress on the Prepare tab"""
+        writer = self.tag_writer
+        written = []
+        for event in writer.drain():
+            if event[0] == "written":
+                written.append(event[1])
+            elif event[0] == "error":
+                self.tag_errors.insert(tk.END, event[2])
+        if written:
+            # Only the tags changed, so keep the analysis by re-fingerprinting
+            self.store.refresh_fingerprints(written)
+            for path in written:
+                changes = self.tag_edits.get(path, {})
+                fields = {"song" if name == "title" else name: changes[name]
+                          for name in ("title", "artist", "album") if name in changes}
+                if fields and path in self.library.ids:
+                    self.library.update(path, **fields)
+            self.refresh_library_view()
+        rate = (f"{writer.files_per_second:.0f} files/s, "
+                f"{writer.megabytes_per_second:.1f} MB/s, {writer.in_place} in place")
+        done = writer.files + writer.errors
+        if writer.running or not writer.events.empty():
+            self.tag_status.config(text=f"Writing tags: {done}/{writer.total} ({rate})")
+            self.root.after(100, self.poll_tags)
+        else:
+            self.tag_status.config(
+                text=f"Wrote tags to {writer.files} files in {writer.elapsed:.1f}s ({rate}), "
+                     f"{writer.errors} failed")
+    
+    def new_crate(self):
+        """Start a crate from the selected tracks, or an empty one"""
+        name = simpledialog.askstring("New Crate", "Crate name:", parent=self.root)
+        if not name:
+            return
+        paths = self.track_list.selected_paths()
+        self.store.save_crate(name, paths)
+        self.add_crate(name)
+        self.analysis_label.config(text=f"Created {name} with {len(paths)} tracks")
+    
+    def add_crate(self, name):
+        iid = "crate:" + name
+        if not self.folder_tree.exists(iid):
+            self.folder_tree.insert("crates", 'end', iid, text=f"📦 {name}")
+    
+    def show_crate(self, name):
+        """Show a saved crate's tracks in crate order; ones not in the library are skipped"""
+        paths = self.store.crate_paths(name)
+        ids = [track_id for track_id in self.resolver.resolve(paths) if track_id is not None]
+        self.current_crate = None
+        self.track_list.show_only(ids)
+        missing = len(paths) - len(ids)
+        self.analysis_label.config(
+            text=f"{len(ids)} tracks in {name}" + (f" ({missing} not in library)" if missing else ""))
+    
+    def save_crate(self):
+        """Save the tracks on show (the selection, if any) as a crate"""
+        paths = self.track_list.selected_paths() or \
+            [self.library.paths[i] for i in self.track_list.view]
+        if not paths:
+            messagebox.showwarning("Save Crate", "No tracks to save")
+            return
+        name = simpledialog.askstring("Save Crate", "Crate name:", parent=self.root)
+        if not name:
+            return
+        self.store.save_crate(name, paths)
+        self.add_crate(name)
+        self.analysis_label.config(text=f"Saved {len(paths)} tracks to {name}")
+    
+    def import_playlist(self):
+        """Read an M3U, PLS, Serato crate or Rekordbox XML file into a crate"""
+        path = filedialog.askopenfilename(
+            title="Import Playlist",
+            filetypes=[("Playlists", " ".join("*" + ext for ext in PLAYLIST_EXTENSIONS)),
+                       ("All Files", "*.*")])
+        if not path:
+            return
+        if path.lower().endswith(".xml"):
+            # A Rekordbox collection holds many playlists; list them first so one can be picked
+            self.analysis_label.config(text=f"Reading playlists in {os.path.basename(path)}...")
+            self.playlist_io.list_playlists(path)
+        else:
+            self.analysis_label.config(text=f"Importing {os.path.basename(path)}...")
+            self.playlist_io.read(path)
+        self.poll_playlists()
+    
+    def pick_rekordbox_playlist(self, path, names):
+        """Import one playlist from a Rekordbox XML file, or its whole collection"""
+        dialog = tk.Toplevel(self.root, bg='#1a1a1a')
+        dialog.title(f"Import from {os.path.basename(path)}")
+        choices = ["(Whole collection)"] + names
+        listbox = tk.Listbox(dialog, bg='#2a2a2a', fg='white', relief=tk.FLAT,
+                             width=50, height=min(len(choices), 20), exportselection=False)
+        for choice in choices:
+            listbox.insert(tk.END, choice)
+        listbox.selection_set(1 if names else 0)
+        listbox.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        
+        def import_selected():
+            picked = listbox.curselection()
+            if not picked:
+                return
+            dialog.destroy()
+            playlist = choices[picked[0]] if picked[0] else None
+            self.analysis_label.config(text=f"Importing {playlist or os.path.basename(path)}...")
+            self.playlist_io.read(path, playlist=playlist)
+            self.poll_playlists()
+        
+        tk.Button(dialog, text="Import", bg='#0066cc', fg='white', relief=tk.FLAT,
+                  command=import_selected).pack(anchor=tk.E, padx=10, pady=(0, 10))
+    
+    def export(self):
+        """Write the tracks on show (the selection, if any) as a playlist file"""
+        ids = self.track_list.view
+        if self.track_list.selected:
+            ids = ids[np.isin(ids, list(self.track_list.selected))]
+        if not len(ids):
+            messagebox.showwarning("Export Playlist", "No tracks to export")
+            return
+        path = filedialog.asksaveasfilename(
+            title="Export Playlist", defaultextension=".m3u8",
+            filetypes=[("M3U playlist", "*.m3u8 *.m3u"), ("PLS playlist", "*.pls"),
+                       ("Serato crate", "*.crate"), ("Rekordbox XML", "*.xml")])
+        if not path:
+            return
+        library = self.library
+        entries = [{"path": library.paths[i], "title": library.text["song"][i] or None,
+                    "artist": library.text["artist"][i] or None,
+                    "album": library.text["album"][i] or None,
+                    "duration": library.numeric["length"][i], "bpm": library.numeric["bpm"][i],
+                    "key": key_code(int(library.keys[i]))} for i in ids.tolist()]
+        for entry in entries:
+            # Unknown numbers are NaN in the library
+            for name in ("duration", "bpm"):
+                if entry[name] != entry[name]:
+                    entry[name] = None
+        self.analysis_label.config(text=f"Exporting {len(entries)} tracks...")
+        self.playlist_io.write(path, entries)
+        self.poll_playlists()
+    
+    def poll_playlists(self):
+        """Turn read playlists into crates and report finished exports"""
+        for event in self.playlist_io.drain():
+            name = os.path.splitext(os.path.basename(event[1]))[0]
+            if event[0] == "read" and event[3]:
+                name = event[3].rsplit("/", 1)[-1] # Playlist name without its folders
+            if event[0] == "playlists":
+                self.analysis_label.config(text="")
+                self.pick_rekordbox_playlist(event[1], event[2])
+            elif event[0] == "read":
+                paths = event[2]
+                resolved = self.resolver.resolve(paths)
+                # Matched tracks are saved under their library path, so renamed roots stay fixed
+                found = [self.library.paths[track_id] for track_id in resolved
+                         if track_id is not None]
+                missing = len(paths) - len(found)
+                if not found:
+                    messagebox.showwarning(
+                        "Import Playlist", f"None of the {missing} tracks in {name} are in the library")
+                    continue
+                self.store.save_crate(name, found)
+                self.add_crate(name)
+                self.show_crate(name)
+                self.analysis_label.config(
+                    text=f"Imported {len(found)} tracks into {name}"
+                         + (f", {missing} not in library" if missing else ""))
+            elif event[0] == "written":
+                self.analysis_label.config(
+                    text=f"Exported {event[2]} tracks to {os.path.basename(event[1])}")
+            else:
+                messagebox.showerror("Playlist", f"{os.path.basename(event[1])}: {event[2]}")
+        if self.playlist_io.running or not self.playlist_io.events.empty():
+            self.root.after(100, self.poll_playlists)
+    
+    def create_history_tab_content(self):
+        """History tab: sessions, the tracks played in one, and the most common transitions"""
+        sessions_frame = tk.Frame(self.history_frame, bg='#1a1a1a')
+        sessions_frame.pack(side=tk.LEFT, fill=tk.Y, padx=5, pady=5)
+        tk.Label(sessions_frame, text="Sessions", font=("Arial", 9, "bold"),
+                 fg='#999', bg='#1a1a1a', anchor=tk.W).pack(fill=tk.X)
+        self.session_tree = ttk.Treeview(sessions_frame, columns=("date", "tracks", "length"),
+                                         show="headings", height=10, selectmode="browse")
+        for name, width in (("date", 130), ("tracks", 50), ("length", 60)):
+            self.session_tree.heading(name, text=name)
+            self.session_tree.column(name, width=width)
+        self.session_tree.pack(fill=tk.Y, expand=True)
+        self.session_tree.bind('<<TreeviewSelect>>', self.on_session_select)
+        
+        plays_frame = tk.Frame(self.history_frame, bg='#1a1a1a')
+        plays_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=5, pady=5)
+        tk.Label(plays_frame, text="Played", font=("Arial", 9, "bold"),
+                 fg='#999', bg='#1a1a1a', anchor=tk.W).pack(fill=tk.X)
+        self.session_plays_tree = ttk.Treeview(plays_frame, columns=("time", "deck", "track"),
+                                               show="headings", height=10)
+        for name, width in (("time", 70), ("deck", 50), ("track", 300)):
+            self.session_plays_tree.heading(name, text=name)
+            self.session_plays_tree.column(name, width=width)
+        self.session_plays_tree.pack(fill=tk.BOTH, expand=True)
+        
+        transitions_frame = tk.Frame(self.history_frame, bg='#1a1a1a')
+        transitions_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=5, pady=5)
+        tk.Label(transitions_frame, text="Top transitions", font=("Arial", 9, "bold"),
+                 fg='#999', bg='#1a1a1a', anchor=tk.W).pack(fill=tk.X)
+        self.transitions_tree = ttk.Treeview(transitions_frame, columns=("from", "to", "times"),
+                                             show="headings", height=10)
+        for name, width in (("from", 200), ("to", 200), ("times", 50)):
+            self.transitions_tree.heading(name, text=name)
+            self.transitions_tree.column(name, width=width)
+        self.transitions_tree.pack(fill=tk.BOTH, expand=True)
+    
+    def track_title(self, path):
+        track_id = self.library.ids.get(path)
+        if track_id is not None and self.library.text["song"][track_id]:
+            return self.library.text["song"][track_id]
+        return os.path.splitext(os.path.basename(path))[0]
+    
+    def refresh_history(self):
+        """Reload the History tab from the play log's rollups"""
+        self.session_tree.delete(*self.session_tree.get_children())
+        for session, started, ended, plays in self.play_log.sessions():
+            minutes = int(ended - started) // 60
+            self.session_tree.insert("", 'end', str(session), values=(
+                time.strftime("%Y-%m-%d %H:%M", time.localtime(started)), plays,
+                f"{minutes // 60}:{minutes % 60:02d}"))
+        self.transitions_tree.delete(*self.transitions_tree.get_children())
+        for from_path, to_path, count in self.play_log.transitions(limit=50):
+            self.transitions_tree.insert("", 'end', values=(
+                self.track_title(from_path), self.track_title(to_path), count))
+        if self.history_session is not None and self.session_tree.exists(str(self.history_session)):
+            self.show_session(self.history_session)
+    
+    def on_session_select(self, event=None):
+        selection = self.session_tree.selection()
+        if selection:
+            self.show_session(int(selection[0]))
+    
+    def show_session(self, session):
+        self.history_session = session
+        self.session_plays_tree.delete(*self.session_plays_tree.get_children())
+        for played, deck, path in self.play_log.session_plays(session):
+            self.session_plays_tree.insert("", 'end', values=(
+                time.strftime("%H:%M", time.localtime(played)), deck, self.track_title(path)))
+    
+    def record_history(self, deck, kind):
+        if deck.full_track_path:
+            self.play_log.record(kind, deck.deck_number, deck.full_track_path)
+    
+    def poll_history(self):
+        """Apply play counts the history flusher has rolled up"""
+        played = self.play_log.drain()
+        for event in played:
+            path, plays = event[1], event[2]
+            self.play_counts[path] = plays
+            if path in self.library.ids:
+                self.library.update(path, plays=plays)
+        if played:
+            self.refresh_library_view()
+            if self.current_browser_tab.get() == "History":
+                self.refresh_history()
+        self.root.after(1000, self.poll_history)
+    
+    def show_most_played(self):
+        """Sort the library by play count, most played first"""
+        self.switch_browser_tab("Files")
+        self.track_list.sort_by("plays", descending=True)
+    
+    def close(self):
+        """Stop the audio and background work, flush the play history, then close the window"""
+        self.analysis_engine.cancel()
+        self.scanner.cancel()
+        self.tag_writer.cancel()
+        self.audio_out.stop()
+        self.mixer.close()
+        self.play_log.close()
+        self.store.close()
+        self.root.destroy()
+    
+    def refresh_library_view(self):
+        """Redraw the track list after library changes, following the crate on show"""
+        if self.current_crate in self.smart_crates:
+            self.track_list.pinned = self.smart_crates.ids(self.current_crate)
+        self.track_list.refresh()
+    
+    def scan_folder(self, folder):
+        if self.scanner.running:
+            messagebox.showinfo("Scan", "A folder scan is already running")
+            return
+        self.scan_root = folder
+        self.scan_paths = []
+        self.scan_errors = 0
+        self.scanner.start(folder)
+        self.poll_scan()
+    
+    def poll_scan(self):
+        """Add scanned tracks to the library a batch at a time"""
+        scanner = self.scanner
+        for event in scanner.drain():
+            if event[0] == "batch":
+                paths = [record["path"] for record in event[1]]
+                self.scan_paths.extend(paths)
+                self.add_tracks(event[1])
+                self.refresh_analysis(paths)
+            elif event[0] == "error":
+                self.scan_errors += 1
+                self.report_problem(f"Scan: {event[1]}: {event[2]}")
+            elif event[0] == "done" and not event[1] and not self.scan_errors:
+                # Forget cached analysis for files deleted since the last scan. Not after
+                # errors: an unreadable folder (say a dropped network share) would look empty.
+                self.store.prune(self.scan_root, self.scan_paths)
+        rate = f"{scanner.files_per_second:.0f} files/s"
+        unreadable = f", {self.scan_errors} unreadable (see Prepare)" if self.scan_errors else ""
+        if scanner.running or not scanner.events.empty():
+            self.scan_label.config(text=f"Scanning: {scanner.files} files ({rate}){unreadable}")
+            self.root.after(100, self.poll_scan)
+        else:
+            self.scan_label.config(
+                text=f"Scanned {scanner.files} files in {scanner.elapsed:.1f}s ({rate}){unreadable}")
+            # Build the search structures now rather than on the next keystroke
+            self.root.after_idle(self.library.freeze)
+    
+    def add_tracks(self, records):
+        """Append scanned tracks to the library, skipping ones already loaded"""
+        for record in records:
+            path = record["path"]
+            if path in self.library.ids:
+                continue
+            self.tracks.append(path)
+            song = record.get("title") or os.path.splitext(os.path.basename(path))[0]
+            self.library.add(path, song=song, artist=record.get("artist"),
+                             album=record.get("album"), bitrate=record.get("bitrate"),
+                             length=record.get("duration"),
+                             added=record["mtime_ns"] / 1e9 if record.get("mtime_ns") else None,
+                             plays=self.play_counts.get(path, 0))
+        self.refresh_library_view()
+    
+    def show_compatible(self, deck):
+        """List library tracks in a compatible key and BPM range for what a deck is playing"""
+        if not deck.key:
+            messagebox.showwarning("Harmonic Mixing",
+                                   f"Deck {deck.deck_number} has no analyzed track")
+            return
+        path = deck.full_track_path
+        if path in self.library.ids:
+            ids = self.compatibility.follows(path)
+        else:
+            ids = self.compatibility.compatible(deck.key, deck.bpm)
+        self.current_crate = None
+        self.track_list.show_only(ids)
+        self.analysis_label.config(
+            text=f"{len(ids)} tracks mix with Deck {deck.deck_number} "
+                 f"({deck.key}, {deck.bpm:.1f} BPM)")
+    
+    def show_all_tracks(self):
+        self.current_crate = None
+        self.track_list.show_only(None)
+        self.analysis_label.config(text="")
+    
+    def apply_search(self):
+        """Show only the library rows matching the search box"""
+        self.track_list.set_query(self.search_var.get().strip())
+    
+    def refresh_analysis(self, paths):
+        """Use cached analysis where the file is unchanged, analyze the rest"""
+        fresh, stale = self.store.plan(paths)
+        for result in self.store.get_many(fresh, waveform=False):
+            self.apply_analysis_result(result)
+        self.refresh_library_view()
+        if stale:
+            self.analysis_engine.add(stale)
+            self.poll_analysis()
+        return stale
+    
+    def on_deck_loaded(self, deck):
+        path = deck.full_track_path
+        self.record_history(deck, "load")
+        fresh, stale = self.store.plan([path])
+        if fresh:
+            # The deck needs the full result including the waveform pyramid
+            self.apply_analysis_result(self.store.get(path))
+        elif stale:
+            self.analysis_engine.add(stale)
+            self.poll_analysis()
+        deck.load_cues(self.store.get_cues(path))
+        self.center_waveform.mark_dirty()
+    
+    def save_cues(self, deck):
+        self.store.set_cues(deck.full_track_path, deck.cues_data())
+    
+    def analyze_files(self):
+        """Analyze loaded tracks that are new or changed since the last run"""
+        if not self.tracks:
+            messagebox.showwarning("No Tracks", "Load some files first!")
+            return
+        if not self.refresh_analysis(self.tracks):
+            self.analysis_label.config(text=f"All {len(self.tracks)} tracks analyzed")
+    
+    def cancel_analysis(self):
+        if self.analysis_engine.running:
+            self.analysis_engine.cancel()
+            self.analysis_label.config(text="Cancelling analysis...")
+    
+    def resume_analysis(self):
+        if self.analysis_engine.resume():
+            self.poll_analysis()
+        elif not self.analysis_engine.running:
+            messagebox.showinfo("Analyze", "Nothing left to analyze")
+    
+    def poll_analysis(self, scheduled=False):
+        """Apply finished analysis results without blocking the Tk main loop"""
+        if self.analysis_polling and not scheduled:
+            return
+        engine = self.analysis_engine
+        results = []
+        for event in engine.drain():
+            if event[0] == "result":
+                results.append(event[2])
+            elif event[0] == "error" and event[1]:
+                self.report_problem(f"Analysis: {event[1]}: {event[2]}")
+            elif event[0] == "error":
+                messagebox.showerror("Analysis Error", event[2])
+        if results:
+            self.store.put_many(results) # One transaction per poll
+            for result in results:
+                self.apply_analysis_result(result)
+            # New BPMs/keys can change the sort order and what a search matches
+            self.refresh_library_view()
+        
+        self.analysis_polling = engine.running or not engine.events.empty()
+        failed = f", {engine.failed} failed (see Prepare)" if engine.failed else ""
+        if self.analysis_polling:
+            self.analysis_label.config(text=f"Analyzing {engine.completed}/{engine.total}{failed}")
+            self.root.after(100, self.poll_analysis, True)
+        elif engine.pending:
+            self.analysis_label.config(
+                text=f"Analysis paused ({len(engine.pending)} left){failed}")
+        else:
+            self.analysis_label.config(
+                text=f"Analyzed {engine.completed - engine.failed} tracks{failed}")
+    
+    def apply_analysis_result(self, result):
+        path = result["path"]
+        # Waveforms are only kept in memory for the decks that show them
+        self.analysis_results[path] = {k: v for k, v in result.items() if k != "waveform"}
+        if path in self.library.ids:
+            self.library.update(path, bpm=result.get("bpm") or None,
+                                length=result.get("duration"), key=result.get("key"))
+        for deck in self.decks:
+            if deck.full_track_path == path:
+                deck.apply_analysis(result)
+                if deck.hotcues:
+                    # Cues set before the track's first analysis had no row to go in
+                    self.save_cues(deck)
+                self.center_waveform.mark_dirty()
+
+
+def smart_crate_rules(values):
+    """Crate rules from the New Smart Crate form; ValueError on bad input"""
+    rules = []
+    if values["bpm_low"] or values["bpm_high"]:
+        try:
+            rules.append(("range", "bpm", float(values["bpm_low"]) if values["bpm_low"] else None,
+                          float(values["bpm_high"]) if values["bpm_high"] else None))
+        except ValueError:
+            raise ValueError("BPM must be a number") from None
+    if values["keys"]:
+        codes = [to_camelot(part) for part in values["keys"].replace(",", " ").split()]
+        if not all(codes):
+            raise ValueError("Keys must be Camelot codes or key names, e.g. 8A or Am")
+        rules.append(("key", codes))
+    if values["artist"]:
+        rules.append(("contains", "artist", values["artist"]))
+    if values["added"]:
+        try:
+            since = time.mktime(time.strptime(values["added"], "%Y-%m-%d"))
+        except ValueError:
+            raise ValueError("Dates are YYYY-MM-DD") from None
+        rules.append(("range", "added", since, None))
+    if values["plays"]:
+        try:
+            rules.append(("range", "plays", int(values["plays"]), None))
+        except ValueError:
+            raise ValueError("Play count must be a whole number") from None
+    if not rules:
+        raise ValueError("Fill in at least one rule")
+    return rules
+
+
         # Configure ttk styles for Serato look
 def configure_styles():
     """Configure ttk styles for Serato DJ appearance"""